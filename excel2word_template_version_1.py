@@ -45,9 +45,103 @@ import platform
 from docx import Document
 from docx.shared import Inches, Cm
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from PIL import Image
 import difflib
 from typing import List, Dict, Any, Optional
-import glob
+import zipfile
+import zlib
+import struct
+import time
+import cProfile
+import pstats
+import io
+import gc
+import hashlib
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import ast
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+
+
+# 支持的占位符格式：(起始符, 结束符, 示例)
+PLACEHOLDER_SYNTAXES = [
+    ("{{", "}}", "{{字段名}}"),
+    ("【", "】", "【字段名】"),
+    ("《", "》", "《字段名》"),
+    ("[", "]", "[字段名]"),
+    ("<", ">", "<字段名>"),
+]
+
+# 循环表格行标记：含有该标记的表格行按分组内的每条数据重复一次
+LOOP_ROW_MARKER = "{{#循环}}"
+# 循环表格行内的序号（从1开始）
+LOOP_ROW_NUMBER = "{{#序号}}"
+
+# 条件区域：{{#if 条件}} ... {{/if}}，条件不成立时删除区域内的段落、表格行或文字
+CONDITION_MARKER_PATTERN = re.compile(r'\{\{#if\s+([^{}]+?)\s*\}\}|\{\{/if\}\}')
+CONDITION_END_MARKER = "{{/if}}"
+# 字段与文本比较的条件，如 类型=A、类型!="B"
+CONDITION_TEXT_PATTERN = re.compile(r'(.+?)\s*(==|!=|<>|≠|=)\s*(.+)')
+
+# 分组汇总映射，如"求和: 金额"，按分组字段计算组内汇总值
+AGGREGATE_FUNCTIONS = {"求和": "sum", "计数": "count", "最小值": "min", "最大值": "max", "平均值": "mean"}
+AGGREGATE_PATTERN = re.compile(r'^\s*(求和|计数|最小值|最大值|平均值)\s*[:：]\s*(.+?)\s*$')
+
+# 映射配置文件：按模板内容和Excel字段保存映射设置
+MAPPING_PROFILE_PATH = os.path.join(os.path.expanduser("~"), ".excel2word_mapping_profiles.json")
+
+# 需要扫描占位符的模板XML部件（正文、页眉、页脚）
+# python-docx 不把脚注、尾注加载为XML部件，其中的占位符无法替换，因此不扫描
+TEMPLATE_PART_PATTERN = re.compile(r'word/(document|header|footer)(\d*)\.xml')
+
+# 字段数字格式的预设选项（空表示使用全局数字格式化设置）
+NUMBER_FORMAT_PRESETS = [
+    "", "单元格格式", "0", "0.00", "#,##0", "#,##0.00", "0%", "0.00%",
+    "0.00万", "0.00亿", "¥#,##0.00", "$#,##0.00",
+    "yyyy-mm-dd", "yyyy/m/d", "yyyy年m月d日", "yyyy-mm-dd hh:mm:ss",
+]
+
+# 支持的图片格式（扩展名不区分大小写，按此顺序优先匹配）
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.gif']
+# EXIF方向标记对应的图片摆正方式：(顺时针旋转角度（1/60000度）, 水平翻转, 垂直翻转)，先翻转再旋转
+EXIF_ORIENTATION_TRANSFORMS = {
+    2: (0, True, False),
+    3: (10800000, False, False),
+    4: (0, False, True),
+    5: (16200000, True, False),
+    6: (5400000, False, False),
+    7: (5400000, True, False),
+    8: (16200000, False, False),
+}
+# 多图模式中带序号的图片名，如 A001_1、A001_2
+GALLERY_NAME_PATTERN = re.compile(r'^(.*)_(\d+)$')
+
+# 含子文件夹搜索时保存在图片文件夹中的索引文件，以及内存中索引的复查间隔（秒）
+IMAGE_INDEX_FILENAME = ".e2w_image_index.json"
+IMAGE_INDEX_RECHECK_SECONDS = 60
+# Word文档可以嵌入的图片格式（Pillow识别出的实际格式）
+SUPPORTED_IMAGE_FORMATS = {"JPEG", "PNG", "BMP", "GIF", "TIFF"}
+# 扩展名对应的图片格式，用于发现改了扩展名的文件
+IMAGE_EXTENSION_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".bmp": "BMP", ".gif": "GIF"}
+# 导出前检查图片时视为过大的像素数和文件大小
+LARGE_IMAGE_PIXELS = 40_000_000
+LARGE_IMAGE_BYTES = 20 * 1024 * 1024
+
+# 文件名模板中的字段，如 {地区}、{日期:%Y%m}、{编号:05d}
+FILENAME_FIELD_PATTERN = re.compile(r'\{([^{}:]+)(?::([^{}]*))?\}')
+# 文件名中不允许出现的字符
+INVALID_FILENAME_PATTERN = r'[<>:"/\\|?*]'
+
+# 输出文档的压缩级别（0表示仅存储不压缩）
+COMPRESSION_PRESETS = {
+    "标准（级别6）": 6,
+    "速度优先（级别1）": 1,
+    "体积优先（级别9）": 9,
+    "仅存储（不压缩）": 0,
+}
 
 
 class Excel2WordConverter:
@@ -59,11 +153,36 @@ class Excel2WordConverter:
         # 数据存储
         self.excel_data = None
         self.excel_file_path = None
+        self.excel_number_formats = {}  # Excel字段 -> 单元格数字格式
         self.word_template_path = None
         self.placeholders = []
+        self.placeholder_stats = {}  # 占位符 -> 出现次数和位置
+        self.template_conditions = {}  # 条件标记 -> 条件表达式
         self.mapping_data = []
         self.image_mapping_data = []  # 图片映射数据
         self.console_output = []  # 控制台输出缓存
+        self.console_max_entries = 1000  # 控制台最多保留的记录数
+        self.memory_stage_peaks = {}  # 各导出阶段的峰值内存（MB）
+        self.expression_cache = {}  # 已编译的数学表达式缓存
+        self.number_format_cache = {}  # 已编译的数字格式缓存
+        self.file_digest_cache = {}  # (路径, 修改时间, 大小) -> 文件摘要
+        self.render_cache = OrderedDict()  # 渲染缓存键 -> 文档内容（按最近使用排序）
+        self.render_cache_bytes = 0
+        self.render_cache_max_bytes = 100 * 1024 * 1024
+        self.render_cache_max_files = 500  # 磁盘缓存最多保留的文档数
+        self.render_cache_dir = os.path.join(tempfile.gettempdir(), "excel2word_render_cache")
+        self.render_cache_disk_writes = 0
+        self.last_preview_key = None
+        self.template_bytes_cache = None  # ((路径, 修改时间, 大小), 模板文件内容)
+        self.template_zip_entries = None  # ((路径, 修改时间, 大小), {成员名: ZipInfo})
+        self.image_bytes_cache = OrderedDict()  # (路径, 修改时间, 大小) -> (解析后的图片, EXIF方向)
+        self.image_bytes_cache_size = 0
+        self.image_bytes_cache_max_bytes = 200 * 1024 * 1024
+        self.image_folder_index = {}  # 图片文件夹 -> (文件夹修改时间, 文件夹索引)
+        self.image_index_lock = threading.Lock()  # 预读和图片检查线程会同时建立文件夹索引
+        self.recursive_image_index = {}  # 图片文件夹 -> (检查时间, 含子文件夹的索引)
+        self.prefetched_image_paths = {}  # 图片映射序号 -> 预读线程找到的图片路径（当前文档）
+        self.prefetched_image_bytes = {}  # 图片路径 -> 预读线程读取的图片内容（当前文档）
         
         # 创建界面
         self.create_widgets()
@@ -128,6 +247,8 @@ class Excel2WordConverter:
                   command=self.preview_document).grid(row=0, column=1, padx=5)
         ttk.Button(quick_action_frame, text="按模板导出", 
                   command=self.export_documents).grid(row=0, column=2, padx=5)
+        ttk.Button(quick_action_frame, text="性能分析", 
+                  command=self.profile_document_render).grid(row=0, column=3, padx=5)
         
         # 主要内容区域 - 使用标签页
         notebook = ttk.Notebook(main_frame)
@@ -167,14 +288,16 @@ class Excel2WordConverter:
         word_frame.columnconfigure(0, weight=1)
         word_frame.rowconfigure(0, weight=1)
         
-        self.mapping_tree = ttk.Treeview(word_frame, columns=("placeholder", "mapping"), 
+        self.mapping_tree = ttk.Treeview(word_frame, columns=("placeholder", "mapping", "format"), 
                                         show="tree headings", height=15)
         self.mapping_tree.heading("#0", text="序号")
         self.mapping_tree.heading("placeholder", text="Word占位符")
         self.mapping_tree.heading("mapping", text="匹配模式")
+        self.mapping_tree.heading("format", text="数字格式")
         self.mapping_tree.column("#0", width=50)
         self.mapping_tree.column("placeholder", width=150)
         self.mapping_tree.column("mapping", width=150)
+        self.mapping_tree.column("format", width=100)
         self.mapping_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
         # 绑定双击编辑事件
@@ -192,6 +315,17 @@ class Excel2WordConverter:
         ttk.Checkbutton(mapping_btn_frame, text="使用精准匹配", 
                        variable=self.exact_match_var).pack(side=tk.LEFT, padx=10)
         
+        self.auto_apply_profile_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(mapping_btn_frame, text="自动应用已保存的映射配置", 
+                       variable=self.auto_apply_profile_var).pack(side=tk.LEFT, padx=10)
+        
+        ttk.Button(mapping_btn_frame, text="保存映射配置", 
+                  command=self.save_mapping_profile).pack(side=tk.LEFT, padx=5)
+        ttk.Button(mapping_btn_frame, text="导出配置文件", 
+                  command=self.export_mapping_profile).pack(side=tk.LEFT, padx=5)
+        ttk.Button(mapping_btn_frame, text="导入配置文件", 
+                  command=self.import_mapping_profile).pack(side=tk.LEFT, padx=5)
+        
         # 标签页2: 图片映射
         image_frame = ttk.Frame(notebook)
         notebook.add(image_frame, text="第三步：图片映射")
@@ -334,6 +468,62 @@ class Excel2WordConverter:
         ttk.Label(prefix_naming_frame, text="（如：文档_001.docx）", 
                  font=("Arial", 9), foreground="gray").grid(row=0, column=2, padx=(5, 0))
         
+        # 文件名模板命名
+        pattern_naming_frame = ttk.Frame(naming_frame)
+        pattern_naming_frame.grid(row=3, column=0, sticky=tk.W, pady=2)
+        
+        ttk.Radiobutton(pattern_naming_frame, text="文件名模板：", 
+                       variable=self.naming_mode_var, value="模板").grid(row=0, column=0, sticky=tk.W)
+        
+        self.naming_pattern_var = tk.StringVar(value="{编号}_{姓名}")
+        pattern_entry = ttk.Entry(pattern_naming_frame, textvariable=self.naming_pattern_var, width=20)
+        pattern_entry.grid(row=0, column=1, padx=(10, 0))
+        
+        ttk.Label(pattern_naming_frame, text="（如：{地区}_{日期:%Y%m}.docx）", 
+                 font=("Arial", 9), foreground="gray").grid(row=0, column=2, padx=(5, 0))
+        
+        # 分组导出设置
+        group_frame = ttk.LabelFrame(basic_settings_frame, text="分组导出", padding="5")
+        group_frame.grid(row=4, column=0, sticky=(tk.W, tk.E), pady=(10, 0))
+        
+        ttk.Label(group_frame, text="分组字段:").grid(row=0, column=0, sticky=tk.W)
+        self.group_field_var = tk.StringVar()
+        self.group_field_combo = ttk.Combobox(group_frame, textvariable=self.group_field_var, 
+                                             width=20, state="readonly")
+        self.group_field_combo.grid(row=0, column=1, padx=(10, 0))
+        
+        ttk.Label(group_frame, text=f"（为空时每行一个文档；含{LOOP_ROW_MARKER}的表格行按组内每行重复）", 
+                 font=("Arial", 9), foreground="gray").grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=(2, 0))
+        
+        # 输出方式设置
+        output_target_frame = ttk.LabelFrame(basic_settings_frame, text="输出方式", padding="5")
+        output_target_frame.grid(row=5, column=0, sticky=(tk.W, tk.E), pady=(10, 0))
+        
+        self.output_target_var = tk.StringVar(value="文件夹")
+        ttk.Radiobutton(output_target_frame, text="保存为单独的文件", 
+                       variable=self.output_target_var, value="文件夹").grid(row=0, column=0, sticky=tk.W, pady=2)
+        ttk.Radiobutton(output_target_frame, text="打包为一个ZIP压缩包（附索引.csv）", 
+                       variable=self.output_target_var, value="压缩包").grid(row=1, column=0, sticky=tk.W, pady=2)
+        
+        # 子目录分片设置（大量文件时避免单个目录文件过多）
+        shard_frame = ttk.Frame(output_target_frame)
+        shard_frame.grid(row=2, column=0, sticky=tk.W, pady=2)
+        
+        ttk.Label(shard_frame, text="子目录分片:").grid(row=0, column=0, sticky=tk.W)
+        self.shard_mode_var = tk.StringVar(value="不分目录")
+        ttk.Combobox(shard_frame, textvariable=self.shard_mode_var, 
+                    values=["不分目录", "按字段值", "按行号分段", "按哈希前缀"],
+                    state="readonly", width=10).grid(row=0, column=1, padx=(5, 0))
+        
+        self.shard_field_var = tk.StringVar()
+        self.shard_field_combo = ttk.Combobox(shard_frame, textvariable=self.shard_field_var, 
+                                             width=12, state="readonly")
+        self.shard_field_combo.grid(row=0, column=2, padx=(5, 0))
+        
+        ttk.Label(shard_frame, text="每段行数:").grid(row=0, column=3, padx=(5, 0))
+        self.shard_size_var = tk.StringVar(value="1000")
+        ttk.Entry(shard_frame, textvariable=self.shard_size_var, width=6).grid(row=0, column=4, padx=(5, 0))
+        
         # 右侧：高级设置
         advanced_settings_frame = ttk.LabelFrame(settings_content, text="高级设置", padding="10")
         advanced_settings_frame.grid(row=0, column=1, sticky=(tk.W, tk.E, tk.N, tk.S), padx=(5, 0))
@@ -371,6 +561,91 @@ class Excel2WordConverter:
         ttk.Checkbutton(number_frame, text="使用千分位分隔符", 
                        variable=self.use_thousands_separator_var).grid(row=2, column=0, sticky=tk.W, pady=2)
         
+        # 内存控制设置
+        memory_frame = ttk.LabelFrame(advanced_settings_frame, text="内存控制", padding="5")
+        memory_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        self.low_memory_mode_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(memory_frame, text="低内存导出模式（逐个释放文档）", 
+                       variable=self.low_memory_mode_var).grid(row=0, column=0, sticky=tk.W, pady=2)
+        
+        memory_limit_frame = ttk.Frame(memory_frame)
+        memory_limit_frame.grid(row=1, column=0, sticky=tk.W, pady=2)
+        
+        ttk.Label(memory_limit_frame, text="内存上限(MB):").grid(row=0, column=0, sticky=tk.W)
+        self.memory_limit_var = tk.StringVar(value="0")
+        memory_limit_entry = ttk.Entry(memory_limit_frame, textvariable=self.memory_limit_var, width=8)
+        memory_limit_entry.grid(row=0, column=1, padx=(5, 0))
+        ttk.Label(memory_limit_frame, text="（0表示不限制）", 
+                 font=("Arial", 9), foreground="gray").grid(row=0, column=2, padx=(5, 0))
+        
+        # 占位符格式设置
+        syntax_frame = ttk.LabelFrame(advanced_settings_frame, text="占位符格式", padding="5")
+        syntax_frame.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        self.placeholder_syntax_vars = {}
+        for i, (open_token, close_token, example) in enumerate(PLACEHOLDER_SYNTAXES):
+            # 默认只启用双花括号，避免普通括号文本被误识别
+            syntax_var = tk.BooleanVar(value=(open_token == "{{"))
+            self.placeholder_syntax_vars[open_token] = syntax_var
+            ttk.Checkbutton(syntax_frame, text=example, variable=syntax_var,
+                           command=self.on_placeholder_syntax_changed).grid(row=i // 3, column=i % 3, sticky=tk.W, padx=(0, 10), pady=2)
+        
+        self.placeholder_pattern = self.build_placeholder_pattern()
+        
+        # 渲染缓存设置
+        cache_frame = ttk.LabelFrame(advanced_settings_frame, text="渲染缓存", padding="5")
+        cache_frame.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        self.render_cache_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(cache_frame, text="启用渲染缓存（内容未变化时直接复用）", 
+                       variable=self.render_cache_var).grid(row=0, column=0, sticky=tk.W, pady=2)
+        
+        self.render_cache_disk_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(cache_frame, text="同时缓存到磁盘（重启后仍有效）", 
+                       variable=self.render_cache_disk_var).grid(row=1, column=0, sticky=tk.W, pady=2)
+        
+        ttk.Button(cache_frame, text="清空缓存", 
+                  command=self.clear_render_cache).grid(row=2, column=0, sticky=tk.W, pady=2)
+        
+        # 输出压缩设置
+        compression_frame = ttk.LabelFrame(advanced_settings_frame, text="输出压缩", padding="5")
+        compression_frame.grid(row=4, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        compression_level_frame = ttk.Frame(compression_frame)
+        compression_level_frame.grid(row=0, column=0, sticky=tk.W, pady=2)
+        
+        ttk.Label(compression_level_frame, text="压缩级别:").grid(row=0, column=0, sticky=tk.W)
+        self.compression_level_var = tk.StringVar(value="标准（级别6）")
+        ttk.Combobox(compression_level_frame, textvariable=self.compression_level_var,
+                    values=list(COMPRESSION_PRESETS.keys()),
+                    state="readonly", width=16).grid(row=0, column=1, padx=(5, 0))
+        
+        self.store_intermediate_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(compression_frame, text="合并导出时中间文档仅存储（不压缩）", 
+                       variable=self.store_intermediate_var).grid(row=1, column=0, sticky=tk.W, pady=2)
+        
+        # 图片处理设置
+        image_settings_frame = ttk.LabelFrame(advanced_settings_frame, text="图片处理", padding="5")
+        image_settings_frame.grid(row=5, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+        
+        prefetch_frame = ttk.Frame(image_settings_frame)
+        prefetch_frame.grid(row=0, column=0, sticky=tk.W, pady=2)
+        
+        ttk.Label(prefetch_frame, text="图片预读文档数:").grid(row=0, column=0, sticky=tk.W)
+        self.image_prefetch_var = tk.StringVar(value="8")
+        ttk.Entry(prefetch_frame, textvariable=self.image_prefetch_var, width=5).grid(row=0, column=1, padx=(5, 0))
+        ttk.Label(prefetch_frame, text="（导出时后台提前查找并读取图片，0表示不预读）", 
+                 font=("Arial", 9), foreground="gray").grid(row=0, column=2, padx=(5, 0))
+        
+        self.preflight_images_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(image_settings_frame, text="导出前检查所有图片（缺失、损坏、格式不支持）", 
+                       variable=self.preflight_images_var).grid(row=1, column=0, sticky=tk.W, pady=2)
+        
+        self.exif_transpose_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(image_settings_frame, text="按EXIF方向摆正照片（设置图片旋转属性，不改动图片内容）", 
+                       variable=self.exif_transpose_var).grid(row=2, column=0, sticky=tk.W, pady=2)
+        
         # 底部工具栏
         toolbar_frame = ttk.Frame(main_frame)
         toolbar_frame.grid(row=4, column=0, pady=(10, 0))
@@ -405,12 +680,14 @@ class Excel2WordConverter:
             # 读取Excel数据
             self.excel_data = pd.read_excel(file_path)
             self.excel_file_path = file_path
+            self.excel_number_formats = self.read_excel_number_formats(file_path)
             
             # 更新显示
             self.excel_file_var.set(os.path.basename(file_path))
             self.update_excel_tree()
             
-            messagebox.showinfo("成功", f"Excel导入成功！共导入{len(self.excel_data)}行数据。")
+            profile_message = "\n已自动应用保存的映射配置。" if self.auto_apply_mapping_profile() else ""
+            messagebox.showinfo("成功", f"Excel导入成功！共导入{len(self.excel_data)}行数据。{profile_message}")
             
         except Exception as e:
             messagebox.showerror("错误", f"导入Excel失败：{str(e)}")
@@ -420,6 +697,7 @@ class Excel2WordConverter:
         if messagebox.askyesno("确认", "确定要清除Excel数据吗？这也会清空图片映射设置。"):
             self.excel_data = None
             self.excel_file_path = None
+            self.excel_number_formats = {}
             self.excel_file_var.set("未选择")
             self.update_excel_tree()
             
@@ -433,6 +711,10 @@ class Excel2WordConverter:
             # 清空文件命名字段选择
             self.naming_field_combo['values'] = []
             self.naming_field_var.set("")
+            self.group_field_combo['values'] = []
+            self.group_field_var.set("")
+            self.shard_field_combo['values'] = []
+            self.shard_field_var.set("")
             
             messagebox.showinfo("成功", "Excel数据已清除！")
     
@@ -459,17 +741,18 @@ class Excel2WordConverter:
             # 初始化图片映射表格
             self.update_image_tree()
             
+            profile_message = "\n已自动应用保存的映射配置。" if self.auto_apply_mapping_profile() else ""
+            
             if len(self.placeholders) > 0:
-                messagebox.showinfo("成功", f"Word模板导入成功！识别到{len(self.placeholders)}个占位符。")
+                messagebox.showinfo("成功", f"Word模板导入成功！识别到{len(self.placeholders)}个占位符。{profile_message}")
             else:
+                enabled_syntaxes = "\n".join(f"• {example}" for open_token, _, example in PLACEHOLDER_SYNTAXES
+                                              if self.placeholder_syntax_vars[open_token].get())
                 messagebox.showwarning("提示", 
                     "Word模板导入成功，但未识别到占位符。\n\n"
                     "请确保模板中包含以下格式的占位符：\n"
-                    "• {{字段名}}（双花括号）\n"
-                    "• 【字段名】（中文书名号）\n"
-                    "• 《字段名》（中文双书名号）\n"
-                    "• [字段名]（方括号）\n"
-                    "• <字段名>（尖括号）\n\n"
+                    f"{enabled_syntaxes}\n\n"
+                    "其他格式（【】《》[]<>）可在高级设置的\"占位符格式\"中启用。\n"
                     "支持中文和英文字段名。")
             
         except Exception as e:
@@ -480,6 +763,8 @@ class Excel2WordConverter:
         if messagebox.askyesno("确认", "确定要清除Word模板吗？"):
             self.word_template_path = None
             self.placeholders = []
+            self.placeholder_stats = {}
+            self.template_conditions = {}
             self.mapping_data = []
             self.image_mapping_data = []
             self.word_file_var.set("未选择")
@@ -487,156 +772,139 @@ class Excel2WordConverter:
             self.update_image_tree()
             messagebox.showinfo("成功", "Word模板已清除！")
     
-    def extract_text_from_element(self, element):
-        """从文档元素中提取文本"""
-        text = ""
-        try:
-            # 处理段落
-            if hasattr(element, 'paragraphs'):
-                for paragraph in element.paragraphs:
-                    text += paragraph.text + "\n"
-            
-            # 处理表格
-            if hasattr(element, 'tables'):
-                for table in element.tables:
-                    for row in table.rows:
-                        for cell in row.cells:
-                            text += cell.text + "\n"
-                            # 递归处理表格中的内容
-                            text += self.extract_text_from_element(cell)
-            
-            # 处理形状和文本框
-            if hasattr(element, '_element'):
-                from docx.oxml.ns import qn
-                
-                # 查找所有文本框和形状
-                shapes = element._element.xpath('.//w:txbxContent//w:t')
-                for shape in shapes:
-                    if shape.text:
-                        text += shape.text + "\n"
-                
-                # 查找所有绘图对象中的文本
-                drawings = element._element.xpath('.//w:drawing//w:t')
-                for drawing in drawings:
-                    if drawing.text:
-                        text += drawing.text + "\n"
+    def build_placeholder_pattern(self):
+        """将启用的占位符格式编译为一个正则表达式，提取和替换共用"""
+        alternatives = []
+        for open_token, close_token, _ in PLACEHOLDER_SYNTAXES:
+            if self.placeholder_syntax_vars[open_token].get():
+                excluded = re.escape(open_token[0] + close_token[0])
+                alternatives.append(f"{re.escape(open_token)}[^{excluded}\n]+{re.escape(close_token)}")
+        
+        if not alternatives:
+            alternatives.append(r'\{\{[^{}\n]+\}\}')
+        return re.compile("|".join(alternatives))
+    
+    def on_placeholder_syntax_changed(self):
+        """占位符格式变化时重新编译扫描器，并在保留已有映射的情况下重新识别占位符"""
+        if not any(var.get() for var in self.placeholder_syntax_vars.values()):
+            self.placeholder_syntax_vars["{{"].set(True)
+            messagebox.showwarning("警告", "至少需要启用一种占位符格式！")
         
-        except Exception as e:
-            # 如果遇到错误，继续处理其他内容
-            pass
+        self.placeholder_pattern = self.build_placeholder_pattern()
+        
+        if not self.word_template_path:
+            return
+        
+        previous_mappings = {data["placeholder"]: data for data in self.mapping_data}
+        self.extract_placeholders()
+        for data in self.mapping_data:
+            previous = previous_mappings.get(data["placeholder"])
+            if previous:
+                data["mapping"] = previous["mapping"]
+                data["format"] = previous.get("format", "")
         
-        return text
+        self.update_mapping_tree()
+        self.log_output(f"占位符格式已更新，识别到 {len(self.placeholders)} 个占位符")
+    
+    def get_template_part_label(self, part_name: str) -> Optional[str]:
+        """返回需要扫描占位符的模板XML部件名称，其他部件返回None"""
+        match = TEMPLATE_PART_PATTERN.fullmatch(part_name)
+        if not match:
+            return None
+        
+        part, number = match.group(1), match.group(2)
+        label = {"document": "正文", "header": "页眉", "footer": "页脚"}[part]
+        return f"{label}{number}"
+    
+    def scan_template_placeholders(self, template_path: str):
+        """单次扫描模板的各XML部件，统计占位符出现次数和位置
+        
+        返回 (按首次出现顺序排列的 {占位符: {"count": 次数, "locations": [位置]}}, {条件标记: 条件})
+        """
+        from docx.oxml.ns import qn
+        from lxml import etree
+        
+        paragraph_tag = qn("w:p")
+        text_tag = qn("w:t")
+        cell_tag = qn("w:tc")
+        textbox_tag = qn("w:txbxContent")
+        
+        stats = {}
+        conditions = {}
+        with zipfile.ZipFile(template_path) as archive:
+            for part_name in archive.namelist():
+                part_label = self.get_template_part_label(part_name)
+                if part_label is None:
+                    continue
+                
+                root = etree.fromstring(archive.read(part_name))
+                
+                # 按段落拼接文本，避免占位符被拆分到多个run中
+                paragraph_numbers = {}
+                paragraph_texts = {}
+                for element in root.iter(paragraph_tag, text_tag):
+                    if element.tag == paragraph_tag:
+                        paragraph_numbers[element] = len(paragraph_numbers) + 1
+                        continue
+                    if not element.text:
+                        continue
+                    paragraph = element.getparent()
+                    while paragraph is not None and paragraph.tag != paragraph_tag:
+                        paragraph = paragraph.getparent()
+                    if paragraph is not None:
+                        paragraph_texts.setdefault(paragraph, []).append(element.text)
+                
+                for paragraph, fragments in paragraph_texts.items():
+                    paragraph_text = "".join(fragments)
+                    if "{{#if" in paragraph_text:
+                        for match in CONDITION_MARKER_PATTERN.finditer(paragraph_text):
+                            if match.group(1):
+                                conditions[match.group(0)] = match.group(1)
+                    
+                    matches = self.placeholder_pattern.findall(paragraph_text)
+                    if not matches:
+                        continue
+                    
+                    # 判断段落所在的容器（文本框或表格）
+                    container = ""
+                    ancestor = paragraph.getparent()
+                    while ancestor is not None:
+                        if ancestor.tag == textbox_tag:
+                            container = "文本框"
+                            break
+                        if ancestor.tag == cell_tag:
+                            container = "表格"
+                        ancestor = ancestor.getparent()
+                    location = f"{part_label}{container}第{paragraph_numbers[paragraph]}段"
+                    
+                    for placeholder in matches:
+                        entry = stats.setdefault(placeholder, {"count": 0, "locations": []})
+                        entry["count"] += 1
+                        entry["locations"].append(location)
+        
+        return stats, conditions
     
     def extract_placeholders(self):
         """从Word文档中提取占位符"""
         try:
-            doc = Document(self.word_template_path)
-            text = ""
-            
-            # 从主文档段落中提取文本
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            
-            # 从主文档表格中提取文本
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        text += cell.text + "\n"
-                        # 递归处理表格中的段落和嵌套内容
-                        text += self.extract_text_from_element(cell)
-            
-            # 从页眉中提取文本
-            for section in doc.sections:
-                # 提取页眉
-                if section.header:
-                    text += self.extract_text_from_element(section.header)
-                
-                # 提取页脚
-                if section.footer:
-                    text += self.extract_text_from_element(section.footer)
-                
-                # 提取首页页眉
-                if hasattr(section, 'first_page_header') and section.first_page_header:
-                    text += self.extract_text_from_element(section.first_page_header)
-                
-                # 提取首页页脚
-                if hasattr(section, 'first_page_footer') and section.first_page_footer:
-                    text += self.extract_text_from_element(section.first_page_footer)
-                
-                # 提取奇数页页眉
-                if hasattr(section, 'even_page_header') and section.even_page_header:
-                    text += self.extract_text_from_element(section.even_page_header)
-                
-                # 提取奇数页页脚
-                if hasattr(section, 'even_page_footer') and section.even_page_footer:
-                    text += self.extract_text_from_element(section.even_page_footer)
-            
-            # 从形状和文本框中提取文本
-            try:
-                from docx.oxml.ns import qn
-                
-                # 查找所有文本框
-                for textbox in doc._element.xpath('.//w:txbxContent'):
-                    for paragraph in textbox.xpath('.//w:p'):
-                        para_text = ""
-                        for run in paragraph.xpath('.//w:t'):
-                            if run.text:
-                                para_text += run.text
-                        if para_text:
-                            text += para_text + "\n"
-                
-                # 查找所有绘图对象中的文本
-                for drawing in doc._element.xpath('.//w:drawing'):
-                    for text_run in drawing.xpath('.//w:t'):
-                        if text_run.text:
-                            text = text + text_run.text + "\n"
-            
-            except Exception as extract_error:
-
-                # 如果提取特殊元素失败，继续处理
-                self.log_output(f"提取特殊元素时出错: {extract_error}")
-            
-            # 调试信息：打印提取的文本（可选）
-            # print(f"提取的文本内容:\n{text}")
-            
-            # 使用正则表达式提取占位符，支持Unicode字符
-            patterns = [
-                r'\{\{([^}]+)\}\}',  # {{字段名}}
-                r'\【([^】]+)\】',    # 【字段名】
-                r'\《([^》]+)》',    # 《字段名》
-                r'\[([^\]]+)\]',     # [字段名]
-                r'\<([^>]+)\>',      # <字段名>
-            ]
+            self.placeholder_stats, self.template_conditions = self.scan_template_placeholders(self.word_template_path)
             
-            self.placeholders = []
-            for pattern in patterns:
-                # 使用re.UNICODE标志确保正确处理Unicode字符
-                matches = re.findall(pattern, text, re.UNICODE)
-                for match in matches:
-                    # 根据不同的模式格式化占位符
-                    if pattern == r'\{\{([^}]+)\}\}':
-                        placeholder = f"{{{{{match}}}}}"
-                    # elif pattern == r'\【([^】]+)\】':
-                    #     placeholder = f"【{match}】"
-                    # elif pattern == r'\《([^》]+)》':
-                    #     placeholder = f"《{match}》"
-                    # elif pattern == r'\[([^\]]+)\]':
-                    #     placeholder = f"[{match}]"
-                    # elif pattern == r'\<([^>]+)\>':
-                    #     placeholder = f"<{match}>"
-                    # else:
-                    #     placeholder = f"{{{{{match}}}}}"
-                    
-                    if placeholder not in self.placeholders:
-                        self.placeholders.append(placeholder)
+            # 循环、条件等标记（{{#...}}、{{/...}}）由程序处理，不参与映射
+            for reserved in [p for p in self.placeholder_stats if p.startswith(("{{#", "{{/"))]:
+                self.placeholder_stats.pop(reserved)
             
-            # 初始化映射数据
-            self.mapping_data = [{"placeholder": p, "mapping": ""} for p in self.placeholders]
+            # 初始化映射数据（按占位符在模板中首次出现的顺序）
+            self.placeholders = list(self.placeholder_stats)
+            self.mapping_data = [{"placeholder": p, "mapping": "", "format": ""} for p in self.placeholders]
             self.placeholders.sort()
             
             # 调试信息：显示找到的占位符
             if self.placeholders:
                 self.log_output(f"找到的占位符: {self.placeholders}")
+                for placeholder, entry in self.placeholder_stats.items():
+                    self.log_output(f"  {placeholder}: {entry['count']}处 ({', '.join(entry['locations'])})")
+            if self.template_conditions:
+                self.log_output(f"找到的条件区域: {list(self.template_conditions.values())}")
             
         except Exception as e:
             messagebox.showerror("错误", f"提取占位符失败：{str(e)}")
@@ -658,6 +926,12 @@ class Excel2WordConverter:
         """更新文件命名字段列表"""
         if self.excel_data is not None:
             self.naming_field_combo['values'] = list(self.excel_data.columns)
+            self.group_field_combo['values'] = [""] + list(self.excel_data.columns)
+            if self.group_field_var.get() not in self.excel_data.columns:
+                self.group_field_var.set("")
+            self.shard_field_combo['values'] = list(self.excel_data.columns)
+            if self.shard_field_var.get() not in self.excel_data.columns:
+                self.shard_field_var.set("")
             if not self.naming_field_var.get() and len(self.excel_data.columns) > 0:
                 self.naming_field_var.set(self.excel_data.columns[0])
             
@@ -739,60 +1013,164 @@ class Excel2WordConverter:
         
         return None
     
-    def generate_filename(self, data_row: pd.Series, row_index: int, used_names: set) -> str:
-        """生成文件名"""
-        try:
-            naming_mode = self.naming_mode_var.get()
-            
-            if naming_mode == "默认":
-                # 默认命名：导出文档_001.docx
-                filename = f"导出文档_{row_index+1:03d}.docx"
-                
-            elif naming_mode == "字段":
-                # 使用Excel字段命名
-                field_name = self.naming_field_var.get()
-                if field_name and field_name in data_row.index:
-                    field_value = data_row[field_name]
-                    if pd.notna(field_value):
-                        # 清理文件名，移除不合法字符
-                        base_name = self.clean_filename(str(field_value))
-                        filename = f"{base_name}.docx"
-                        
-                        # 处理重复文件名
-                        if filename in used_names:
-                            counter = 1
-                            while f"{base_name}_{counter}.docx" in used_names:
-                                counter += 1
-                            filename = f"{base_name}_{counter}.docx"
-                    else:
-                        # 字段值为空，使用默认命名
-                        filename = f"导出文档_{row_index+1:03d}.docx"
-                else:
-                    # 字段不存在，使用默认命名
-                    filename = f"导出文档_{row_index+1:03d}.docx"
-                    
-            elif naming_mode == "前缀":
-                # 固定前缀命名
-                prefix = self.naming_prefix_var.get().strip()
-                if not prefix:
-                    prefix = "文档"
-                prefix = self.clean_filename(prefix)
-                filename = f"{prefix}_{row_index+1:03d}.docx"
-                
+    def get_base_filenames(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """按列计算文件名主体（不含扩展名），返回包含"文件名主体"和"回退"两列的表"""
+        naming_mode = self.naming_mode_var.get()
+        row_numbers = pd.Series([f"{index + 1:03d}" for index in rows.index], index=rows.index, dtype=object)
+        default_names = "导出文档_" + row_numbers
+        fallback = pd.Series(naming_mode != "默认", index=rows.index)
+        
+        if naming_mode == "字段":
+            # 使用Excel字段命名，字段不存在或值为空时使用默认命名
+            field_name = self.naming_field_var.get()
+            base_names = default_names.copy()
+            if field_name and field_name in rows.columns:
+                valid = rows[field_name].notna()
+                base_names[valid] = self.clean_filenames(rows.loc[valid, field_name].astype(str))
+                fallback = ~valid
+        elif naming_mode == "前缀":
+            # 固定前缀命名
+            prefix = self.naming_prefix_var.get().strip() or "文档"
+            base_names = self.clean_filename(prefix) + "_" + row_numbers
+            fallback[:] = False
+        elif naming_mode == "模板":
+            # 文件名模板命名，模板中的字段全部为空时使用默认命名
+            base_names = default_names.copy()
+            pattern_names, valid = self.evaluate_filename_pattern(self.naming_pattern_var.get(), rows)
+            base_names[valid] = pattern_names[valid]
+            fallback = ~valid
+        else:
+            base_names = default_names
+        
+        return pd.DataFrame({"文件名主体": base_names, "回退": fallback}, index=rows.index)
+    
+    def compile_filename_pattern(self, pattern: str) -> List[Any]:
+        """把文件名模板编译为片段列表：文本片段为字符串，字段片段为(字段名, 格式)"""
+        pattern = re.sub(r'\.docx\s*$', '', pattern.strip(), flags=re.IGNORECASE)
+        segments = []
+        position = 0
+        for match in FILENAME_FIELD_PATTERN.finditer(pattern):
+            if match.start() > position:
+                segments.append(pattern[position:match.start()])
+            segments.append((match.group(1).strip(), match.group(2) or ""))
+            position = match.end()
+        if position < len(pattern):
+            segments.append(pattern[position:])
+        return segments
+    
+    def format_filename_field(self, values: pd.Series, field_format: str) -> pd.Series:
+        """按格式整列转换文件名模板中的字段值，空值转换为空字符串"""
+        if not field_format:
+            result = values.astype(str)
+        elif "%" in field_format:
+            # 日期格式，如 %Y%m
+            result = pd.to_datetime(values, errors="coerce").dt.strftime(field_format)
+        else:
+            # Python格式说明，如 05d、.2f
+            def format_one(value):
+                try:
+                    return format(value, field_format)
+                except (ValueError, TypeError):
+                    return str(value)
+            result = values.map(format_one)
+        return result.where(values.notna() & result.notna(), "")
+    
+    def evaluate_filename_pattern(self, pattern: str, rows: pd.DataFrame):
+        """整列计算文件名模板，返回(文件名主体, 是否有效)，模板中的字段全部为空时无效"""
+        names = pd.Series("", index=rows.index, dtype=object)
+        valid = pd.Series(False, index=rows.index)
+        has_field = False
+        
+        for segment in self.compile_filename_pattern(pattern):
+            if isinstance(segment, str):
+                names = names + segment
+                continue
+            field_name, field_format = segment
+            has_field = True
+            if field_name not in rows.columns:
+                self.log_output(f"文件名模板中的字段不存在: {field_name}")
+                continue
+            names = names + self.format_filename_field(rows[field_name], field_format)
+            valid |= rows[field_name].notna()
+        
+        if not has_field:
+            valid[:] = True
+        return self.clean_filenames(names), valid
+    
+    def get_output_shards(self, rows: pd.DataFrame, base_names: pd.Series) -> pd.Series:
+        """按列计算每个文档所在的子目录名，不分目录时为空字符串"""
+        shard_mode = self.shard_mode_var.get()
+        
+        if shard_mode == "按字段值":
+            field_name = self.shard_field_var.get()
+            shards = pd.Series("未分类", index=rows.index, dtype=object)
+            if field_name and field_name in rows.columns:
+                valid = rows[field_name].notna()
+                shards[valid] = self.clean_filenames(rows.loc[valid, field_name].astype(str))
+            return shards
+        
+        elif shard_mode == "按行号分段":
+            try:
+                shard_size = max(1, int(self.shard_size_var.get()))
+            except ValueError:
+                shard_size = 1000
+            starts = np.asarray(rows.index) // shard_size * shard_size + 1
+            return pd.Series([f"{start:06d}-{start + shard_size - 1:06d}" for start in starts],
+                             index=rows.index, dtype=object)
+        
+        elif shard_mode == "按哈希前缀":
+            # 按文件名主体计算哈希，同名文件总在同一子目录，重名检查只需在子目录内进行
+            return base_names.map(lambda name: hashlib.md5(name.casefold().encode("utf-8")).hexdigest()[:2])
+        
+        return pd.Series("", index=rows.index, dtype=object)
+    
+    def reserve_filename(self, registry: dict, base_name: str) -> str:
+        """在子目录的已用文件名中登记一个不重名的文件名
+        
+        文件名按不区分大小写比较（与Windows一致），每个文件名主体记录下一个可用序号，
+        同名文件再多也不需要从1开始逐个尝试。
+        """
+        used_names = registry["names"]
+        filename = f"{base_name}.docx"
+        if filename.casefold() in used_names:
+            base_key = base_name.casefold()
+            counter = registry["counters"].get(base_key, 1)
+            while f"{base_key}_{counter}.docx" in used_names:
+                counter += 1
+            registry["counters"][base_key] = counter + 1
+            filename = f"{base_name}_{counter}.docx"
+        used_names.add(filename.casefold())
+        return filename
+    
+    def build_output_filenames(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """一次性计算所有文档的输出文件名（含子目录），返回包含"文件名"和"状态"两列的表"""
+        base_names = self.get_base_filenames(rows)
+        shards = self.get_output_shards(rows, base_names["文件名主体"])
+        
+        registries = {}  # 子目录（不区分大小写） -> {"names": 已用文件名, "counters": 文件名主体的下一个序号}
+        filenames = []
+        statuses = []
+        for base_name, is_fallback, shard in zip(base_names["文件名主体"], base_names["回退"], shards):
+            registry = registries.setdefault(shard.casefold(), {"names": set(), "counters": {}})
+            filename = self.reserve_filename(registry, base_name)
+            
+            if is_fallback:
+                statuses.append("回退")  # 使用了默认命名（可能是因为字段值为空等）
+            elif filename != f"{base_name}.docx":
+                statuses.append("重复处理")
             else:
-                # 未知模式，使用默认命名
-                filename = f"导出文档_{row_index+1:03d}.docx"
-            
-            # 确保文件名不为空且有效
-            if not filename or filename == ".docx":
-                filename = f"导出文档_{row_index+1:03d}.docx"
-            
-            self.log_output(f"生成文件名: 行{row_index+1} -> {filename}")
-            return filename
-            
-        except Exception as e:
-            self.log_output(f"生成文件名失败: {str(e)}")
-            return f"导出文档_{row_index+1:03d}.docx"
+                statuses.append("正常")
+            filenames.append(f"{shard}/{filename}" if shard else filename)
+        
+        return pd.DataFrame({"文件名": filenames, "状态": statuses}, index=rows.index)
+    
+    def clean_filenames(self, filenames: pd.Series) -> pd.Series:
+        """整列清理文件名，规则与clean_filename相同"""
+        clean_names = (filenames.str.replace(INVALID_FILENAME_PATTERN, '_', regex=True)
+                       .str.strip()
+                       .str.strip('.')
+                       .str.slice(0, 200))
+        return clean_names.where(clean_names != "", "文档")
     
     def clean_filename(self, filename: str) -> str:
         """清理文件名，移除不合法字符"""
@@ -827,7 +1205,7 @@ class Excel2WordConverter:
         
         for i, data in enumerate(self.mapping_data):
             self.mapping_tree.insert("", "end", text=str(i+1), 
-                                    values=(data["placeholder"], data["mapping"]))
+                                    values=(data["placeholder"], data["mapping"], data.get("format") or "默认"))
     
     def edit_mapping(self, event):
         """编辑映射关系"""
@@ -842,7 +1220,7 @@ class Excel2WordConverter:
         # 创建编辑对话框
         dialog = tk.Toplevel(self.root)
         dialog.title("编辑映射")
-        dialog.geometry("400x300")
+        dialog.geometry("420x400")
         dialog.transient(self.root)
         dialog.grab_set()
         
@@ -861,25 +1239,48 @@ class Excel2WordConverter:
         if self.excel_data is not None:
             mapping_combo['values'] = [""] + list(self.excel_data.columns)
         
+        # 数字格式输入
+        ttk.Label(dialog, text="数字格式:").grid(row=2, column=0, sticky=tk.W, padx=10, pady=5)
+        format_var = tk.StringVar(value=self.mapping_data[item_index].get("format", ""))
+        format_combo = ttk.Combobox(dialog, textvariable=format_var, width=30)
+        format_combo.grid(row=2, column=1, sticky=(tk.W, tk.E), padx=10, pady=5)
+        format_combo['values'] = NUMBER_FORMAT_PRESETS
+        
         # 说明文本
         help_text = """映射规则说明：
 1. 直接字段映射：选择Excel字段名
-2. 数学表达式：如 字段1+字段2、字段1*2
-3. 固定文本：直接输入文本内容
-4. 空白：占位符将被替换为"0"
+2. 数学表达式：如 字段1+字段2、字段1*2、
+   round(字段1/3, 2)、if(字段1>0, 字段1, 0)
+3. 分组汇总：求和: 字段、计数: 字段、最小值: 字段、
+   最大值: 字段、平均值: 字段（按分组字段计算组内汇总）
+4. 固定文本：直接输入文本内容
+5. 空白：占位符将被替换为"0"
+
+数字格式：留空使用全局数字格式化设置；
+"单元格格式"使用Excel单元格自身的数字格式；
+也可输入Excel格式，如 #,##0.00、0.0%、0.00万、
+¥#,##0.00、yyyy-mm-dd、yyyy年m月d日
         """
         
         help_label = ttk.Label(dialog, text=help_text, justify=tk.LEFT, 
-                              font=("Arial", 9), wraplength=350)
-        help_label.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), padx=10, pady=10)
+                              font=("Arial", 9), wraplength=370)
+        help_label.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), padx=10, pady=10)
         
         # 按钮
         btn_frame = ttk.Frame(dialog)
-        btn_frame.grid(row=3, column=0, columnspan=2, pady=10)
+        btn_frame.grid(row=4, column=0, columnspan=2, pady=10)
         
         def save_mapping():
             new_mapping = mapping_var.get()
+            new_format = format_var.get().strip()
+            
+            # 验证数字格式
+            if new_format and new_format != "单元格格式" and self.compile_number_format(new_format) is None:
+                messagebox.showwarning("警告", f"无法识别的数字格式：{new_format}")
+                return
+            
             self.mapping_data[item_index]["mapping"] = new_mapping
+            self.mapping_data[item_index]["format"] = new_format
             self.update_mapping_tree()
             dialog.destroy()
         
@@ -903,7 +1304,11 @@ class Excel2WordConverter:
             "placeholder": "",
             "width": "9.8",  # 默认宽度
             "height": "",  # 空表示按比例缩放
-            "use_cm": True  # 默认使用厘米
+            "use_cm": True,  # 默认使用厘米
+            "recursive": False,  # 是否搜索子文件夹
+            "gallery": False,  # 多图模式：插入所有匹配的图片
+            "gallery_columns": "2",  # 多图模式每行图片数
+            "gallery_max": "12"  # 多图模式最多图片数
         }
         self.image_mapping_data.append(new_mapping)
         self.update_image_tree()
@@ -936,6 +1341,8 @@ class Excel2WordConverter:
         
         for i, data in enumerate(self.image_mapping_data):
             folder_display = data["folder"] if data["folder"] else "未选择"
+            if data["folder"] and data.get("recursive", False):
+                folder_display += "（含子文件夹）"
             mapping_display = data["mapping_rule"] if data["mapping_rule"] else "未设置"
             placeholder_display = data["placeholder"] if data["placeholder"] else "未选择"
             
@@ -949,6 +1356,8 @@ class Excel2WordConverter:
                 size_display = f"{width}×{height}{unit}"
             else:
                 size_display = f"{width}{unit}(按比例)"
+            if data.get("gallery", False):
+                size_display += f" 多图{data.get('gallery_columns', '2')}列"
             
             self.image_tree.insert("", "end", text=str(i+1), 
                                   values=(folder_display, mapping_display, placeholder_display, size_display))
@@ -966,7 +1375,7 @@ class Excel2WordConverter:
         # 创建编辑对话框
         dialog = tk.Toplevel(self.root)
         dialog.title("编辑图片映射")
-        dialog.geometry("550x600")
+        dialog.geometry("550x700")
         dialog.transient(self.root)
         dialog.grab_set()
         
@@ -987,6 +1396,10 @@ class Excel2WordConverter:
         ttk.Button(folder_frame, text="浏览", command=select_folder).grid(row=0, column=1, padx=(5, 0))
         folder_frame.columnconfigure(0, weight=1)
         
+        recursive_var = tk.BooleanVar(value=current_data.get("recursive", False))
+        ttk.Checkbutton(folder_frame, text="搜索子文件夹（建立索引文件，加快重复导出）", 
+                       variable=recursive_var).grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=(2, 0))
+        
         # 映射规则选择
         ttk.Label(dialog, text="映射规则:").grid(row=1, column=0, sticky=tk.W, padx=10, pady=5)
         mapping_var = tk.StringVar(value=current_data["mapping_rule"])
@@ -1088,6 +1501,22 @@ class Excel2WordConverter:
         
         use_cm_var.trace('w', lambda *args: on_unit_change())
         
+        # 多图模式设置
+        gallery_frame = ttk.LabelFrame(dialog, text="多图模式", padding="5")
+        gallery_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), padx=10, pady=(0, 10))
+        
+        gallery_var = tk.BooleanVar(value=current_data.get("gallery", False))
+        ttk.Checkbutton(gallery_frame, text="插入所有匹配的图片（名称、名称_1、名称_2…），按表格排列", 
+                       variable=gallery_var).grid(row=0, column=0, columnspan=4, sticky=tk.W, pady=2)
+        
+        ttk.Label(gallery_frame, text="每行图片数:").grid(row=1, column=0, sticky=tk.W)
+        gallery_columns_var = tk.StringVar(value=current_data.get("gallery_columns", "2"))
+        ttk.Entry(gallery_frame, textvariable=gallery_columns_var, width=5).grid(row=1, column=1, padx=(5, 15))
+        
+        ttk.Label(gallery_frame, text="最多图片数:").grid(row=1, column=2, sticky=tk.W)
+        gallery_max_var = tk.StringVar(value=current_data.get("gallery_max", "12"))
+        ttk.Entry(gallery_frame, textvariable=gallery_max_var, width=5).grid(row=1, column=3, padx=(5, 0))
+        
         # 说明文本
         help_text = """映射规则说明：
 1. 固定图片名：所有数据行都使用同一张图片
@@ -1102,17 +1531,20 @@ class Excel2WordConverter:
 - 高度：可选，为空时按比例缩放
 - 单位：可选择厘米或英寸
 
+多图模式：
+- 插入"名称"以及"名称_1"、"名称_2"等所有图片，每张图片使用上面的尺寸
+
 图片格式支持：.jpg, .jpeg, .png, .bmp, .gif
 程序会自动尝试不同的文件扩展名进行匹配
         """
         
         help_label = ttk.Label(dialog, text=help_text, justify=tk.LEFT, 
                               font=("Arial", 9), wraplength=500)
-        help_label.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), padx=10, pady=10)
+        help_label.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E), padx=10, pady=10)
         
         # 按钮
         btn_frame = ttk.Frame(dialog)
-        btn_frame.grid(row=5, column=0, columnspan=2, pady=10)
+        btn_frame.grid(row=6, column=0, columnspan=2, pady=10)
         
         def save_mapping():
             new_folder = folder_var.get()
@@ -1159,12 +1591,26 @@ class Excel2WordConverter:
                     messagebox.showwarning("警告", "图片高度必须是有效数字！")
                     return
             
+            # 验证多图模式设置
+            if gallery_var.get():
+                try:
+                    if int(gallery_columns_var.get()) <= 0 or int(gallery_max_var.get()) <= 0:
+                        messagebox.showwarning("警告", "每行图片数和最多图片数必须大于0！")
+                        return
+                except ValueError:
+                    messagebox.showwarning("警告", "每行图片数和最多图片数必须是整数！")
+                    return
+            
             self.image_mapping_data[item_index]["folder"] = new_folder
             self.image_mapping_data[item_index]["mapping_rule"] = new_mapping
             self.image_mapping_data[item_index]["placeholder"] = new_placeholder
             self.image_mapping_data[item_index]["width"] = new_width
             self.image_mapping_data[item_index]["height"] = new_height
             self.image_mapping_data[item_index]["use_cm"] = new_use_cm
+            self.image_mapping_data[item_index]["recursive"] = recursive_var.get()
+            self.image_mapping_data[item_index]["gallery"] = gallery_var.get()
+            self.image_mapping_data[item_index]["gallery_columns"] = gallery_columns_var.get()
+            self.image_mapping_data[item_index]["gallery_max"] = gallery_max_var.get()
             self.update_image_tree()
             dialog.destroy()
         
@@ -1229,10 +1675,7 @@ class Excel2WordConverter:
                         debug_info += f"  文件夹状态: 存在\n"
                         
                         # 列出文件夹中的图片文件
-                        image_files = []
-                        for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.JPG', '.JPEG', '.PNG', '.BMP', '.GIF']:
-                            pattern = os.path.join(mapping['folder'], f"*{ext}")
-                            image_files.extend(glob.glob(pattern))
+                        image_files = self.get_image_folder_index(mapping['folder'], mapping.get("recursive", False))["files"]
                         
                         if image_files:
                             debug_info += f"  图片文件数量: {len(image_files)}\n"
@@ -1285,6 +1728,8 @@ class Excel2WordConverter:
         if self.word_template_path:
             debug_info += f"模板路径: {self.word_template_path}\n"
             debug_info += f"识别的占位符: {self.placeholders}\n"
+            for placeholder, entry in self.placeholder_stats.items():
+                debug_info += f"  {placeholder}: {entry['count']}处 ({', '.join(entry['locations'])})\n"
         else:
             debug_info += "没有导入Word模板\n"
         
@@ -1310,6 +1755,12 @@ class Excel2WordConverter:
         
         debug_info += f"千分位分隔符: {'启用' if self.use_thousands_separator_var.get() else '禁用'}\n"
         
+        field_formats = {data["placeholder"]: data["format"] for data in self.mapping_data if data.get("format")}
+        if field_formats:
+            debug_info += f"字段数字格式: {field_formats}\n"
+        if self.excel_number_formats:
+            debug_info += f"单元格数字格式: {self.excel_number_formats}\n"
+        
         debug_info += "\n"
         
         # 显示文件命名设置
@@ -1332,6 +1783,11 @@ class Excel2WordConverter:
             clean_prefix = self.clean_filename(prefix) if prefix else "文档"
             debug_info += f"清理后前缀: '{clean_prefix}'\n"
             debug_info += f"示例文件名: {clean_prefix}_001.docx, {clean_prefix}_002.docx...\n"
+        elif naming_mode == "模板":
+            debug_info += f"文件名模板: '{self.naming_pattern_var.get()}'\n"
+            if self.excel_data is not None and len(self.excel_data) > 0:
+                sample_names = self.build_output_filenames(self.excel_data.head(3))["文件名"].tolist()
+                debug_info += f"示例文件名: {', '.join(sample_names)}\n"
         else:
             debug_info += "使用默认命名: 导出文档_001.docx, 导出文档_002.docx...\n"
         
@@ -1367,6 +1823,8 @@ class Excel2WordConverter:
             debug_info += "  • 多重备用方案（主方法失败时自动使用替代方法）\n"
             debug_info += "  • 自动分页（文档间插入分页符）\n"
             debug_info += "  • 合并后删除临时文件\n"
+        debug_info += f"输出压缩级别: {self.compression_level_var.get()}\n"
+        debug_info += f"中间文档仅存储: {'是' if self.store_intermediate_var.get() else '否'}\n"
         
         text_widget.insert(tk.END, debug_info)
         text_widget.config(state=tk.DISABLED)
@@ -1381,9 +1839,9 @@ class Excel2WordConverter:
         timestamp = datetime.datetime.now().strftime("%H:%M:%S")
         formatted_message = f"[{timestamp}] {message}"
         self.console_output.append(formatted_message)
-        # 保持最多1000条记录
-        if len(self.console_output) > 1000:
-            self.console_output = self.console_output[-1000:]
+        # 保持最多console_max_entries条记录
+        if len(self.console_output) > self.console_max_entries:
+            del self.console_output[:-self.console_max_entries]
     
     def show_console_output(self):
         """显示控制台输出"""
@@ -1442,42 +1900,299 @@ class Excel2WordConverter:
         text_widget.config(state=tk.DISABLED)
         text_widget.see(tk.END)  # 滚动到底部
     
-    def find_image_file(self, folder_path: str, image_name: str) -> Optional[str]:
-        """在指定文件夹中查找图片文件"""
+    def get_memory_usage(self):
+        """获取当前进程的内存占用和峰值内存（单位MB），无法获取时返回(None, None)"""
+        try:
+            if platform.system() == "Windows":
+                import ctypes
+                from ctypes import wintypes
+                
+                class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                    _fields_ = [
+                        ("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t),
+                    ]
+                
+                counters = PROCESS_MEMORY_COUNTERS()
+                counters.cb = ctypes.sizeof(counters)
+                kernel32 = ctypes.windll.kernel32
+                kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+                psapi = ctypes.windll.psapi
+                psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+                if psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+                    return counters.WorkingSetSize / 1048576, counters.PeakWorkingSetSize / 1048576
+            
+            elif os.path.exists("/proc/self/status"):
+                # Linux：VmRSS为当前占用，VmHWM为峰值（单位kB）
+                current_kb = peak_kb = None
+                with open("/proc/self/status", "r") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            current_kb = int(line.split()[1])
+                        elif line.startswith("VmHWM:"):
+                            peak_kb = int(line.split()[1])
+                if current_kb is not None:
+                    return current_kb / 1024, (peak_kb or current_kb) / 1024
+            
+            else:
+                # 其他系统只能获取峰值
+                import resource
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                # macOS以字节为单位，其他系统以kB为单位
+                peak_mb = peak / 1048576 if platform.system() == "Darwin" else peak / 1024
+                return peak_mb, peak_mb
+        
+        except Exception as e:
+            self.log_output(f"获取内存占用失败: {e}")
+        
+        return None, None
+    
+    def record_memory_stage(self, stage: str) -> Optional[float]:
+        """记录某个导出阶段结束时的内存占用，保留该阶段的峰值"""
+        current_mb, _ = self.get_memory_usage()
+        if current_mb is None:
+            return None
+        
+        if current_mb > self.memory_stage_peaks.get(stage, 0):
+            self.memory_stage_peaks[stage] = current_mb
+        return current_mb
+    
+    def get_memory_limit(self) -> float:
+        """获取内存上限设置（MB），0表示不限制"""
+        try:
+            limit = float(self.memory_limit_var.get())
+            return limit if limit > 0 else 0
+        except ValueError:
+            self.log_output(f"内存上限设置无效: {self.memory_limit_var.get()}，不限制内存")
+            return 0
+    
+    def enforce_memory_limit(self, limit_mb: float) -> bool:
+        """内存超过上限时释放缓存并回收内存，回收后仍超过上限返回False"""
+        if not limit_mb:
+            return True
+        
+        current_mb, _ = self.get_memory_usage()
+        if current_mb is None or current_mb <= limit_mb:
+            return True
+        
+        self.log_output(f"内存占用 {current_mb:.0f}MB 超过上限 {limit_mb:.0f}MB，开始释放内存...")
+        
+        # 清空渲染缓存和图片内容缓存，缩减控制台缓存并强制回收
+        self.render_cache.clear()
+        self.render_cache_bytes = 0
+        self.image_bytes_cache.clear()
+        self.image_bytes_cache_size = 0
+        self.console_max_entries = min(self.console_max_entries, 100)
+        del self.console_output[:-self.console_max_entries]
+        gc.collect()
+        
+        current_mb, _ = self.get_memory_usage()
+        if current_mb is None or current_mb <= limit_mb:
+            self.log_output(f"内存释放完成，当前占用 {current_mb:.0f}MB" if current_mb else "内存释放完成")
+            return True
+        
+        self.log_output(f"释放后内存占用仍为 {current_mb:.0f}MB，超过上限 {limit_mb:.0f}MB")
+        return False
+    
+    def get_memory_report(self) -> str:
+        """生成峰值内存报告"""
+        _, peak_mb = self.get_memory_usage()
+        if peak_mb is None:
+            return "峰值内存: 无法获取"
+        
+        report = f"峰值内存: {peak_mb:.0f}MB"
+        for stage, stage_peak in self.memory_stage_peaks.items():
+            report += f"\n  {stage}: {stage_peak:.0f}MB"
+        return report
+    
+    def get_image_index_file_paths(self, folder_path: str) -> List[str]:
+        """返回索引文件的保存位置：优先放在图片文件夹中，文件夹不可写时放在临时目录"""
+        folder_key = hashlib.sha1(os.path.abspath(folder_path).encode("utf-8")).hexdigest()
+        return [
+            os.path.join(folder_path, IMAGE_INDEX_FILENAME),
+            os.path.join(tempfile.gettempdir(), "excel2word_image_index", f"{folder_key}.json"),
+        ]
+    
+    def load_image_index_file(self, folder_path: str) -> dict:
+        """读取保存的子文件夹索引 {相对路径: {"mtime", "files", "subdirs"}}，没有时返回空字典
+        
+        只记录各文件夹的修改时间和图片文件名；图片内容的变化由图片信息缓存按文件修改时间和大小判断。
+        """
+        for index_path in self.get_image_index_file_paths(folder_path):
+            try:
+                with open(index_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == 2:
+                    return data.get("dirs", {})
+            except (OSError, ValueError):
+                continue
+        return {}
+    
+    def save_image_index_file(self, folder_path: str, dirs: dict):
+        """保存子文件夹索引，图片文件夹不可写时保存到临时目录"""
+        content = json.dumps({"version": 2, "dirs": dirs}, ensure_ascii=False)
+        for index_path in self.get_image_index_file_paths(folder_path):
+            try:
+                os.makedirs(os.path.dirname(index_path), exist_ok=True)
+                with open(index_path, "w", encoding="utf-8") as f:
+                    f.write(content)
+                return index_path
+            except OSError as e:
+                self.log_output(f"无法写入图片索引文件 {index_path}: {e}")
+        return None
+    
+    def scan_image_tree(self, folder_path: str, stored_dirs: dict):
+        """增量扫描图片文件夹及其子文件夹，修改时间未变的文件夹直接使用保存的索引
+        
+        返回(新的文件夹索引, 重新扫描的文件夹数)。
+        """
+        dirs = {}
+        scanned = 0
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            dir_path = os.path.join(folder_path, relative_dir) if relative_dir else folder_path
+            try:
+                dir_mtime = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                continue
+            
+            entry = stored_dirs.get(relative_dir)
+            if entry is None or entry.get("mtime") != dir_mtime:
+                files = []
+                subdirs = []
+                try:
+                    with os.scandir(dir_path) as scanner:
+                        for item in scanner:
+                            if item.is_dir(follow_symlinks=False):
+                                subdirs.append(item.name)
+                            elif os.path.splitext(item.name)[1].lower() in IMAGE_EXTENSIONS and item.is_file():
+                                files.append(item.name)
+                except OSError as e:
+                    self.log_output(f"扫描图片文件夹失败: {dir_path}, 错误: {e}")
+                entry = {"mtime": dir_mtime, "files": files, "subdirs": subdirs}
+                scanned += 1
+            
+            dirs[relative_dir] = entry
+            pending.extend(os.path.join(relative_dir, name) if relative_dir else name for name in entry["subdirs"])
+        return dirs, scanned
+    
+    def get_recursive_image_index(self, folder_path: str) -> dict:
+        """返回包含子文件夹的图片索引，使用保存在磁盘上的索引文件增量更新"""
+        with self.image_index_lock:
+            cached = self.recursive_image_index.get(folder_path)
+            if cached is not None and time.time() - cached[0] < IMAGE_INDEX_RECHECK_SECONDS:
+                return cached[1]
+            
+            stored_dirs = self.load_image_index_file(folder_path)
+            dirs, scanned = self.scan_image_tree(folder_path, stored_dirs)
+            if scanned or set(dirs) != set(stored_dirs):
+                self.save_image_index_file(folder_path, dirs)
+                # 首次创建索引文件会改变根文件夹的修改时间，更新后再保存一次
+                root_mtime = os.stat(folder_path).st_mtime_ns
+                if dirs[""]["mtime"] != root_mtime:
+                    dirs[""]["mtime"] = root_mtime
+                    self.save_image_index_file(folder_path, dirs)
+            
+            entries = []
+            for relative_dir, entry in dirs.items():
+                for name in entry["files"]:
+                    stem, ext = os.path.splitext(name)
+                    relative_path = os.path.join(relative_dir, name) if relative_dir else name
+                    entries.append((IMAGE_EXTENSIONS.index(ext.lower()), relative_dir.count(os.sep) + bool(relative_dir),
+                                    relative_path, stem, os.path.join(folder_path, relative_path)))
+            entries.sort()
+            index = self.build_image_index([(stem, path) for _, _, _, stem, path in entries])
+            
+            self.recursive_image_index[folder_path] = (time.time(), index)
+            self.log_output(f"已索引图片文件夹（含子文件夹）: {folder_path}（{len(dirs)} 个文件夹，"
+                            f"{len(entries)} 个图片，重新扫描 {scanned} 个文件夹）")
+            return index
+    
+    def build_image_index(self, images: List[tuple]) -> dict:
+        """由按优先级排好序的 [(文件名主体, 路径)] 生成图片索引
+        
+        文件名主体统一按casefold后的形式作为键，与Windows文件名不区分大小写的行为一致。
+        """
+        images = [(stem.casefold(), path) for stem, path in images]
+        by_stem = {}
+        by_base = {}  # 名称 -> {序号: 路径}，用于多图模式查找"名称_序号"的图片
+        for stem, path in images:
+            by_stem.setdefault(stem, {}).setdefault(os.path.splitext(path)[1].lower(), path)
+            numbered = GALLERY_NAME_PATTERN.match(stem)
+            if numbered:
+                by_base.setdefault(numbered.group(1), {}).setdefault(int(numbered.group(2)), path)
+        return {
+            "files": [path for _, path in images],
+            "stems": images,
+            "by_stem": by_stem,
+            "by_base": by_base,
+        }
+    
+    def get_image_folder_index(self, folder_path: str, recursive: bool = False) -> dict:
+        """返回图片文件夹的索引，文件夹内容变化（修改时间改变）后才重新扫描
+        
+        索引包含按格式优先级排序的图片路径列表"files"，以及 文件名主体 -> {扩展名: 路径} 的"by_stem"。
+        """
+        if recursive:
+            return self.get_recursive_image_index(folder_path)
+        
+        # 多个线程同时查找同一文件夹时只扫描一次
+        with self.image_index_lock:
+            folder_mtime = os.stat(folder_path).st_mtime_ns
+            cached = self.image_folder_index.get(folder_path)
+            if cached is not None and cached[0] == folder_mtime:
+                return cached[1]
+            
+            entries = []
+            with os.scandir(folder_path) as scanner:
+                for entry in scanner:
+                    stem, ext = os.path.splitext(entry.name)
+                    if ext.lower() in IMAGE_EXTENSIONS and entry.is_file():
+                        entries.append((IMAGE_EXTENSIONS.index(ext.lower()), entry.name, stem, entry.path))
+            entries.sort()
+            
+            index = self.build_image_index([(stem, path) for _, _, stem, path in entries])
+            self.image_folder_index[folder_path] = (folder_mtime, index)
+            self.log_output(f"已索引图片文件夹: {folder_path}（{len(entries)} 个图片）")
+            return index
+    
+    def find_image_file(self, folder_path: str, image_name: str, recursive: bool = False) -> Optional[str]:
+        """在指定文件夹（recursive为True时包括子文件夹）中查找图片文件（使用文件夹索引，不重复扫描目录）"""
         self.log_output(f"查找图片文件: 文件夹='{folder_path}', 图片名='{image_name}'")
         
         if not os.path.exists(folder_path):
             self.log_output(f"图片文件夹不存在: {folder_path}")
             return None
         
-        # 支持的图片格式
-        extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.JPG', '.JPEG', '.PNG', '.BMP', '.GIF']
-        
-        # 尝试不同的扩展名（精确匹配）
-        self.log_output(f"尝试精确匹配图片文件...")
-        for ext in extensions:
-            file_path = os.path.join(folder_path, f"{image_name}{ext}")
-            if os.path.exists(file_path):
-                self.log_output(f"找到精确匹配的图片: {file_path}")
-                return file_path
-        
-        # 如果没有找到，尝试模糊匹配
-        self.log_output(f"精确匹配失败，尝试模糊匹配...")
-        for ext in extensions:
-            pattern = os.path.join(folder_path, f"*{image_name}*{ext}")
-            matches = glob.glob(pattern)
-            if matches:
-                found_file = matches[0]
-                self.log_output(f"找到模糊匹配的图片: {found_file}")
-                return found_file
-        
-        # 列出文件夹中的所有图片文件用于调试
-        self.log_output(f"没有找到匹配的图片文件，列出文件夹中的所有图片:")
-        all_images = []
-        for ext in extensions:
-            pattern = os.path.join(folder_path, f"*{ext}")
-            all_images.extend(glob.glob(pattern))
+        index = self.get_image_folder_index(folder_path, recursive)
         
+        # 精确匹配：文件名主体相同（不区分大小写），按扩展名优先级选择
+        lookup_name = image_name.casefold()
+        exact_matches = index["by_stem"].get(lookup_name)
+        if exact_matches:
+            for ext in IMAGE_EXTENSIONS:
+                if ext in exact_matches:
+                    self.log_output(f"找到精确匹配的图片: {exact_matches[ext]}")
+                    return exact_matches[ext]
+        
+        # 模糊匹配：文件名主体包含图片名（不区分大小写）
+        for stem, path in index["stems"]:
+            if lookup_name in stem:
+                self.log_output(f"找到模糊匹配的图片: {path}")
+                return path
+        
+        # 列出文件夹中的图片文件用于调试
+        self.log_output(f"没有找到匹配的图片文件，列出文件夹中的所有图片:")
+        all_images = index["files"]
         if all_images:
             for img in all_images[:10]:  # 只显示前10个
                 self.log_output(f"  可用图片: {os.path.basename(img)}")
@@ -1488,10 +2203,67 @@ class Excel2WordConverter:
         
         return None
     
+    def find_gallery_images(self, folder_path: str, image_name: str, recursive: bool = False) -> List[str]:
+        """多图模式：查找"名称"及"名称_1"、"名称_2"等全部图片，按序号排列"""
+        if not os.path.isdir(folder_path):
+            self.log_output(f"图片文件夹不存在: {folder_path}")
+            return []
+        
+        index = self.get_image_folder_index(folder_path, recursive)
+        images = []
+        lookup_name = image_name.casefold()
+        exact_matches = index["by_stem"].get(lookup_name, {})
+        for ext in IMAGE_EXTENSIONS:
+            if ext in exact_matches:
+                images.append(exact_matches[ext])
+                break
+        numbered = index["by_base"].get(lookup_name, {})
+        images.extend(numbered[number] for number in sorted(numbered))
+        self.log_output(f"多图模式找到 {len(images)} 张图片: {image_name}")
+        return images
+    
+    def get_gallery_images_for_row(self, mapping_data: dict, data_row: pd.Series, row_index: int) -> List[str]:
+        """多图模式：根据映射规则获取当前行对应的全部图片路径"""
+        folder_path = mapping_data["folder"]
+        mapping_rule = mapping_data["mapping_rule"]
+        recursive = mapping_data.get("recursive", False)
+        if not folder_path or not mapping_rule:
+            return []
+        
+        if mapping_rule.startswith("固定图片名: "):
+            image_name = mapping_rule.replace("固定图片名: ", "")
+        elif mapping_rule == "固定图片名":
+            # 没有具体名称时使用文件夹中的全部图片
+            return list(self.get_image_folder_index(folder_path, recursive)["files"]) if os.path.isdir(folder_path) else []
+        elif mapping_rule.startswith("根据字段: "):
+            field_name = mapping_rule.replace("根据字段: ", "")
+            if field_name not in data_row.index or pd.isna(data_row[field_name]):
+                self.log_output(f"字段 {field_name} 不存在或值为空")
+                return []
+            image_name = str(data_row[field_name])
+        elif mapping_rule == "根据行号":
+            image_name = str(row_index + 1)
+        else:
+            return []
+        
+        return self.find_gallery_images(folder_path, image_name, recursive)
+    
+    def resolve_mapping_images(self, mapping_data: dict, data_row: pd.Series, row_index: int) -> List[str]:
+        """获取图片映射在当前行用到的图片路径列表（普通模式最多一张，多图模式为全部匹配的图片）"""
+        if mapping_data.get("gallery", False):
+            try:
+                max_count = max(1, int(mapping_data.get("gallery_max", "12")))
+            except ValueError:
+                max_count = 12
+            return self.get_gallery_images_for_row(mapping_data, data_row, row_index)[:max_count]
+        image_path = self.get_image_for_row(mapping_data, data_row, row_index)
+        return [image_path] if image_path and os.path.exists(image_path) else []
+    
     def get_image_for_row(self, mapping_data: dict, data_row: pd.Series, row_index: int) -> Optional[str]:
         """根据映射规则获取当前行对应的图片路径"""
         folder_path = mapping_data["folder"]
         mapping_rule = mapping_data["mapping_rule"]
+        recursive = mapping_data.get("recursive", False)
         
         self.log_output(f"图片映射详情 - 文件夹: {folder_path}, 规则: {mapping_rule}")
         
@@ -1505,14 +2277,11 @@ class Excel2WordConverter:
             # 提取固定图片名
             fixed_name = mapping_rule.replace("固定图片名: ", "")
             self.log_output(f"使用固定图片名: {fixed_name}")
-            return self.find_image_file(folder_path, fixed_name)
+            return self.find_image_file(folder_path, fixed_name, recursive)
         elif mapping_rule == "固定图片名":
             # 如果只是"固定图片名"没有具体名称，使用文件夹中的第一个图片
             self.log_output("查找文件夹中的第一个图片文件")
-            image_files = []
-            for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.JPG', '.JPEG', '.PNG', '.BMP', '.GIF']:
-                pattern = os.path.join(folder_path, f"*{ext}")
-                image_files.extend(glob.glob(pattern, recursive=False))
+            image_files = self.get_image_folder_index(folder_path, recursive)["files"] if os.path.isdir(folder_path) else []
             
             if image_files:
                 selected_image = image_files[0]
@@ -1531,7 +2300,7 @@ class Excel2WordConverter:
                 self.log_output(f"字段值: {field_value}")
                 if pd.notna(field_value):
                     image_name = str(field_value)
-                    result = self.find_image_file(folder_path, image_name)
+                    result = self.find_image_file(folder_path, image_name, recursive)
                     self.log_output(f"查找图片结果: {result}")
                     return result
                 else:
@@ -1543,7 +2312,7 @@ class Excel2WordConverter:
             # 根据行号选择图片
             image_name = str(row_index + 1)  # 行号从1开始
             self.log_output(f"根据行号选择图片: {image_name}")
-            result = self.find_image_file(folder_path, image_name)
+            result = self.find_image_file(folder_path, image_name, recursive)
             self.log_output(f"查找图片结果: {result}")
             return result
         
@@ -1577,200 +2346,1808 @@ class Excel2WordConverter:
             # 清除段落原有内容
             paragraph.clear()
             
-            # 添加新的运行并插入图片
-            run = paragraph.add_run()
+            # 添加新的运行并插入图片（解析后的图片在多个文档间共享）
+            run = paragraph.add_run()
+            
+            # 根据单位和尺寸设置图片（只设置宽度时高度按比例缩放）
+            unit = Cm if use_cm else Inches
+            self.add_picture_to_run(run, image_path, unit(width_value), unit(height_value) if height_value else None)
+            
+            # 设置段落居中对齐
+            paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            
+            self.log_output(f"成功插入图片: {image_path}")
+            return True
+            
+        except FileNotFoundError:
+            self.log_output(f"图片文件未找到: {image_path}")
+            paragraph.clear()
+            paragraph.text = f"[图片文件未找到: {os.path.basename(image_path)}]"
+            return False
+        except Exception as e:
+            self.log_output(f"插入图片失败: {image_path}, 错误: {str(e)}")
+            # 如果插入失败，显示错误文本
+            paragraph.clear()
+            paragraph.text = f"[图片插入失败: {os.path.basename(image_path) if image_path else '未知'} - {str(e)}]"
+            return False
+    
+    def insert_image_gallery(self, doc: Document, img_mapping: dict, image_paths: List[str]) -> bool:
+        """多图模式：在占位符所在位置插入图片表格（每行gallery_columns张），返回是否找到占位符"""
+        from docx.oxml.ns import qn
+        from docx.table import Table
+        from docx.text.paragraph import Paragraph
+        
+        placeholder = img_mapping["placeholder"]
+        try:
+            columns = max(1, int(img_mapping.get("gallery_columns", "2")))
+        except ValueError:
+            columns = 2
+        try:
+            image_width = float(img_mapping.get("width", "9.8"))
+        except ValueError:
+            image_width = 9.8
+        try:
+            height_str = img_mapping.get("height", "")
+            image_height = float(height_str) if height_str else None
+        except ValueError:
+            image_height = None
+        use_cm = img_mapping.get("use_cm", True)
+        
+        columns = min(columns, len(image_paths))
+        rows = (len(image_paths) + columns - 1) // columns
+        
+        # 表格宽度限制在版心内：每列宽度为版心宽度÷列数，图片宽度超过列宽（减去单元格边距）时等比缩小
+        section = doc.sections[0]
+        column_width = (section.page_width - section.left_margin - section.right_margin) // columns
+        max_image_width = column_width - Cm(0.38)
+        unit = Cm if use_cm else Inches
+        if unit(image_width) > max_image_width:
+            scale = max_image_width / unit(image_width)
+            image_width *= scale
+            if image_height:
+                image_height *= scale
+            self.log_output(f"多图表格超出版心宽度，图片宽度缩小为 {image_width:.2f}{'厘米' if use_cm else '英寸'}")
+        
+        # 遍历正文（含表格、嵌套表格、文本框）和页眉页脚各部件中的段落
+        paragraph_tag = qn("w:p")
+        found = False
+        for part in self.get_story_parts(doc):
+            for paragraph_element in list(part.element.iter(paragraph_tag)):
+                paragraph = Paragraph(paragraph_element, part)
+                if placeholder not in paragraph.text:
+                    continue
+                found = True
+                
+                # 表格先建在正文末尾，再移到占位符段落之前；以占位符所在部件创建表格对象，
+                # 使图片关系添加到正确的部件（页眉页脚中的占位符也能正常显示图片）
+                gallery_table = doc.add_table(rows=rows, cols=columns)
+                paragraph_element.addprevious(gallery_table._tbl)
+                gallery_table = Table(gallery_table._tbl, part)
+                gallery_table.autofit = False
+                for column in gallery_table.columns:
+                    column.width = column_width
+                    for cell in column.cells:
+                        cell.width = column_width
+                
+                for i, image_path in enumerate(image_paths):
+                    cell_paragraph = gallery_table.cell(i // columns, i % columns).paragraphs[0]
+                    self.insert_image_into_paragraph(cell_paragraph, image_path, image_width, image_height, use_cm)
+                
+                self.replace_text_preserve_style(paragraph, placeholder, "")
+                self.log_output(f"已插入多图表格: {placeholder}（{len(image_paths)} 张，{rows}行×{columns}列）")
+        return found
+    
+    def normalize_match_key(self, text: str) -> str:
+        """字段匹配用的规范化名称：转为小写并去除特殊字符（支持Unicode字符）"""
+        return re.sub(r'[^\w\s\u4e00-\u9fff]', '', str(text).lower(), flags=re.UNICODE).strip()
+    
+    def calculate_similarity(self, str1: str, str2: str) -> float:
+        """计算字符串相似度"""
+        if not str1 or not str2:
+            return 0.0
+        return self.calculate_normalized_similarity(self.normalize_match_key(str1), self.normalize_match_key(str2))
+    
+    def calculate_normalized_similarity(self, str1: str, str2: str) -> float:
+        """计算已规范化名称的相似度"""
+        if not str1 or not str2:
+            return 0.0
+        
+        if str1 == str2:
+            return 1.0
+        
+        # 使用difflib计算相似度
+        similarity = difflib.SequenceMatcher(None, str1, str2).ratio()
+
+        # print(str1,str2,similarity)
+        
+        # 包含关系加权
+        if str1 in str2 or str2 in str1:
+            min_len = min(len(str1), len(str2))
+            max_len = max(len(str1), len(str2))
+            if min_len / max_len > 0.5:
+                similarity = max(similarity, 0.8)
+        
+        return similarity
+    
+    def get_match_grams(self, key: str) -> set:
+        """名称的单字和双字片段，用于快速筛选候选字段"""
+        return set(key) | {key[i:i + 2] for i in range(len(key) - 1)}
+    
+    def match_fields(self, names: List[str], columns: list, threshold: float = 0.6, candidate_count: int = 10) -> Dict[int, int]:
+        """模糊匹配占位符名称和Excel字段，返回 {名称序号: 字段序号}
+        
+        先用字片段索引为每个名称筛选最相近的若干候选字段，只对候选计算精确相似度，
+        再按相似度总和最大进行一对一分配。
+        """
+        name_keys = [self.normalize_match_key(name) for name in names]
+        column_keys = [self.normalize_match_key(column) for column in columns]
+        
+        # 字片段倒排索引：片段 -> 包含该片段的字段
+        gram_index = {}
+        column_gram_counts = []
+        for column_index, key in enumerate(column_keys):
+            grams = self.get_match_grams(key)
+            column_gram_counts.append(len(grams))
+            for gram in grams:
+                gram_index.setdefault(gram, []).append(column_index)
+        
+        # 只对候选字段计算精确相似度
+        scores = {}
+        for name_index, key in enumerate(name_keys):
+            if not key:
+                continue
+            grams = self.get_match_grams(key)
+            shared = {}
+            for gram in grams:
+                for column_index in gram_index.get(gram, ()):
+                    shared[column_index] = shared.get(column_index, 0) + 1
+            
+            candidates = sorted(shared, key=lambda c: 2 * shared[c] / (len(grams) + column_gram_counts[c]), reverse=True)
+            for column_index in candidates[:candidate_count]:
+                similarity = self.calculate_normalized_similarity(key, column_keys[column_index])
+                if similarity > threshold:
+                    scores[(name_index, column_index)] = similarity
+        
+        if not scores:
+            return {}
+        
+        # 只保留出现在候选中的名称和字段，按相似度总和最大做一对一分配
+        row_ids = sorted({name_index for name_index, _ in scores})
+        col_ids = sorted({column_index for _, column_index in scores})
+        row_position = {name_index: i for i, name_index in enumerate(row_ids)}
+        col_position = {column_index: j for j, column_index in enumerate(col_ids)}
+        
+        size = max(len(row_ids), len(col_ids))
+        cost = np.zeros((size, size))
+        for (name_index, column_index), similarity in scores.items():
+            cost[row_position[name_index], col_position[column_index]] = -similarity
+        
+        matches = {}
+        for i, j in self.solve_assignment(cost):
+            if i < len(row_ids) and j < len(col_ids) and cost[i, j] < 0:
+                matches[row_ids[i]] = col_ids[j]
+        return matches
+    
+    def solve_assignment(self, cost: np.ndarray) -> List[tuple]:
+        """匈牙利算法求代价最小的一对一分配（方阵），返回 [(行, 列)]"""
+        n = cost.shape[0]
+        u = np.zeros(n + 1)
+        v = np.zeros(n + 1)
+        p = np.zeros(n + 1, dtype=int)  # 列 -> 分配的行（从1开始，0表示未分配）
+        way = np.zeros(n + 1, dtype=int)
+        
+        for i in range(1, n + 1):
+            p[0] = i
+            j0 = 0
+            minv = np.full(n + 1, np.inf)
+            used = np.zeros(n + 1, dtype=bool)
+            
+            while True:
+                used[j0] = True
+                i0 = p[j0]
+                
+                # 对所有未使用的列一次性更新最小差值
+                current = cost[i0 - 1] - u[i0] - v[1:]
+                free = ~used[1:]
+                improve = free & (current < minv[1:])
+                minv[1:][improve] = current[improve]
+                way[1:][improve] = j0
+                
+                masked = np.where(free, minv[1:], np.inf)
+                j1 = int(np.argmin(masked)) + 1
+                delta = masked[j1 - 1]
+                
+                u[p[used]] += delta
+                v[used] -= delta
+                minv[~used] -= delta
+                
+                j0 = j1
+                if p[j0] == 0:
+                    break
+            
+            while j0:
+                j1 = way[j0]
+                p[j0] = p[j1]
+                j0 = j1
+        
+        return [(p[j] - 1, j - 1) for j in range(1, n + 1) if p[j]]
+    
+    def auto_match_fields(self):
+        """自动匹配字段"""
+        try:
+            if self.excel_data is None or not self.placeholders:
+                messagebox.showwarning("警告", "请先导入Excel数据和Word模板！")
+                return
+            
+            matched_count = 0
+            excel_columns = list(self.excel_data.columns)
+            
+            # 提取占位符中的字段名（去掉{}符号）
+            clean_placeholders = [data["placeholder"].strip('{}【】《》[]<>') for data in self.mapping_data]
+            
+            if self.exact_match_var.get():
+                # 精准匹配：按小写字段名直接查找（同名字段取第一个）
+                column_lookup = {}
+                for column in excel_columns:
+                    column_lookup.setdefault(str(column).lower(), column)
+                matches = {i: column_lookup[name.lower()] for i, name in enumerate(clean_placeholders)
+                           if name.lower() in column_lookup}
+            else:
+                # 模糊匹配：候选筛选后按整体最优做一对一匹配
+                matches = {i: excel_columns[column_index]
+                           for i, column_index in self.match_fields(clean_placeholders, excel_columns).items()}
+            
+            for i, matched_field in matches.items():
+                self.mapping_data[i]["mapping"] = matched_field
+                matched_count += 1
+            
+            self.update_mapping_tree()
+            
+            match_mode = "精准匹配" if self.exact_match_var.get() else "模糊匹配"
+            messagebox.showinfo("完成", 
+                f"自动匹配完成！\n匹配模式：{match_mode}\n成功匹配：{matched_count}个占位符\n总占位符：{len(self.placeholders)}个")
+            
+        except Exception as e:
+            messagebox.showerror("错误", f"自动匹配失败：{str(e)}")
+    
+    def get_mapping_profile_key(self) -> Optional[str]:
+        """映射配置的键：模板内容摘要 + Excel字段签名，未同时导入模板和Excel时返回None"""
+        if not self.word_template_path or self.excel_data is None:
+            return None
+        
+        columns = json.dumps([str(column) for column in self.excel_data.columns], ensure_ascii=False)
+        column_signature = hashlib.sha256(columns.encode("utf-8")).hexdigest()[:16]
+        return f"{self.get_file_digest(self.word_template_path)}:{column_signature}"
+    
+    def collect_mapping_profile(self) -> dict:
+        """收集当前的映射配置（文本映射、图片映射、数字格式和命名设置）"""
+        import datetime
+        
+        return {
+            "template_name": os.path.basename(self.word_template_path or ""),
+            "columns": [str(column) for column in self.excel_data.columns] if self.excel_data is not None else [],
+            "mappings": {data["placeholder"]: {"mapping": data["mapping"], "format": data.get("format", "")}
+                         for data in self.mapping_data},
+            "image_mappings": [dict(mapping) for mapping in self.image_mapping_data],
+            "settings": {
+                "naming_mode": self.naming_mode_var.get(),
+                "naming_field": self.naming_field_var.get(),
+                "naming_prefix": self.naming_prefix_var.get(),
+                "naming_pattern": self.naming_pattern_var.get(),
+                "number_format": self.number_format_var.get(),
+                "enable_custom_decimal": self.enable_custom_decimal_var.get(),
+                "custom_decimal": self.custom_decimal_var.get(),
+                "thousands_separator": self.use_thousands_separator_var.get(),
+                "placeholder_syntaxes": [token for token, var in self.placeholder_syntax_vars.items() if var.get()],
+                "group_field": self.group_field_var.get(),
+            },
+            "saved_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+    
+    def apply_mapping_profile(self, profile: dict):
+        """应用映射配置，模板中不存在的占位符和Excel中不存在的字段设置会被忽略"""
+        settings = profile.get("settings", {})
+        
+        # 先恢复占位符格式，格式变化时重新识别占位符
+        syntaxes = settings.get("placeholder_syntaxes")
+        if syntaxes:
+            current = [token for token, var in self.placeholder_syntax_vars.items() if var.get()]
+            if sorted(current) != sorted(syntaxes):
+                for token, var in self.placeholder_syntax_vars.items():
+                    var.set(token in syntaxes)
+                self.on_placeholder_syntax_changed()
+        
+        mappings = profile.get("mappings", {})
+        for data in self.mapping_data:
+            saved = mappings.get(data["placeholder"])
+            if saved:
+                data["mapping"] = saved.get("mapping", "")
+                data["format"] = saved.get("format", "")
+        
+        if "image_mappings" in profile:
+            self.image_mapping_data = [dict(mapping) for mapping in profile["image_mappings"]]
+        
+        columns = [str(column) for column in self.excel_data.columns] if self.excel_data is not None else []
+        if "naming_mode" in settings:
+            self.naming_mode_var.set(settings["naming_mode"])
+        if settings.get("naming_field") in columns:
+            self.naming_field_var.set(settings["naming_field"])
+        if "naming_prefix" in settings:
+            self.naming_prefix_var.set(settings["naming_prefix"])
+        if "naming_pattern" in settings:
+            self.naming_pattern_var.set(settings["naming_pattern"])
+        if "number_format" in settings:
+            self.number_format_var.set(settings["number_format"])
+        if "enable_custom_decimal" in settings:
+            self.enable_custom_decimal_var.set(settings["enable_custom_decimal"])
+        if "custom_decimal" in settings:
+            self.custom_decimal_var.set(settings["custom_decimal"])
+        if "thousands_separator" in settings:
+            self.use_thousands_separator_var.set(settings["thousands_separator"])
+        if not settings.get("group_field") or settings["group_field"] in columns:
+            self.group_field_var.set(settings.get("group_field", ""))
+        
+        self.update_naming_ui()
+        self.update_mapping_tree()
+        self.update_image_tree()
+    
+    def load_mapping_profiles(self) -> dict:
+        """读取映射配置文件，返回 {配置键: 配置}"""
+        if not os.path.exists(MAPPING_PROFILE_PATH):
+            return {}
+        try:
+            with open(MAPPING_PROFILE_PATH, "r", encoding="utf-8") as f:
+                return json.load(f).get("profiles", {})
+        except Exception as e:
+            self.log_output(f"读取映射配置文件失败: {e}")
+            return {}
+    
+    def auto_apply_mapping_profile(self) -> bool:
+        """模板和Excel都已导入时，自动应用与之匹配的已保存映射配置"""
+        if not self.auto_apply_profile_var.get():
+            return False
+        
+        profile_key = self.get_mapping_profile_key()
+        if profile_key is None:
+            return False
+        
+        profile = self.load_mapping_profiles().get(profile_key)
+        if not profile:
+            return False
+        
+        self.apply_mapping_profile(profile)
+        self.log_output(f"已自动应用映射配置（保存于 {profile.get('saved_at', '未知时间')}）")
+        return True
+    
+    def save_mapping_profile(self):
+        """按当前模板和Excel字段保存映射配置"""
+        try:
+            profile_key = self.get_mapping_profile_key()
+            if profile_key is None:
+                messagebox.showwarning("警告", "请先导入Excel数据和Word模板！")
+                return
+            
+            profiles = self.load_mapping_profiles()
+            profiles[profile_key] = self.collect_mapping_profile()
+            
+            # 先写入临时文件再替换，避免写入中断损坏配置文件
+            temp_path = MAPPING_PROFILE_PATH + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "profiles": profiles}, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, MAPPING_PROFILE_PATH)
+            
+            self.log_output(f"映射配置已保存: {profile_key}")
+            messagebox.showinfo("成功", f"映射配置已保存！\n下次导入相同的模板和Excel字段时将自动应用。\n配置文件：{MAPPING_PROFILE_PATH}")
+            
+        except Exception as e:
+            messagebox.showerror("错误", f"保存映射配置失败：{str(e)}")
+    
+    def export_mapping_profile(self):
+        """将当前映射配置导出为单独的配置文件"""
+        try:
+            if not self.mapping_data and not self.image_mapping_data:
+                messagebox.showwarning("警告", "当前没有可导出的映射配置！")
+                return
+            
+            file_path = filedialog.asksaveasfilename(
+                title="导出映射配置",
+                defaultextension=".json",
+                filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+            )
+            if not file_path:
+                return
+            
+            with open(file_path, "w", encoding="utf-8") as f:
+                json.dump(self.collect_mapping_profile(), f, ensure_ascii=False, indent=2)
+            
+            messagebox.showinfo("成功", f"映射配置已导出到：{file_path}")
+            
+        except Exception as e:
+            messagebox.showerror("错误", f"导出映射配置失败：{str(e)}")
+    
+    def import_mapping_profile(self):
+        """从配置文件导入映射配置并应用"""
+        try:
+            if not self.word_template_path:
+                messagebox.showwarning("警告", "请先导入Word模板！")
+                return
+            
+            file_path = filedialog.askopenfilename(
+                title="导入映射配置",
+                filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+            )
+            if not file_path:
+                return
+            
+            with open(file_path, "r", encoding="utf-8") as f:
+                profile = json.load(f)
+            
+            self.apply_mapping_profile(profile)
+            
+            current_columns = [str(column) for column in self.excel_data.columns] if self.excel_data is not None else []
+            if profile.get("columns") and profile["columns"] != current_columns:
+                messagebox.showwarning("提示", "映射配置已导入，但配置保存时的Excel字段与当前数据不完全一致，请检查映射结果。")
+            else:
+                messagebox.showinfo("成功", "映射配置已导入！")
+            
+        except Exception as e:
+            messagebox.showerror("错误", f"导入映射配置失败：{str(e)}")
+    
+    def is_number(self, value) -> bool:
+        """检查值是否为数字"""
+        try:
+            float(value)
+            return True
+        except (ValueError, TypeError):
+            return False
+    
+    def build_number_formatter(self):
+        """根据当前数字格式设置生成格式化函数（只读取一次界面设置）"""
+        # 确定小数格式
+        if self.enable_custom_decimal_var.get():
+            try:
+                decimal_places = int(self.custom_decimal_var.get())
+                base_format = lambda num: f"{num:.{decimal_places}f}"
+            except ValueError:
+                # 如果自定义小数位数无效，使用原值
+                base_format = str
+        else:
+            # 使用预设格式
+            format_option = self.number_format_var.get()
+            if format_option == "取整数":
+                base_format = lambda num: str(int(round(num)))
+            elif format_option == "保留1位小数":
+                base_format = lambda num: f"{num:.1f}"
+            elif format_option == "保留2位小数":
+                base_format = lambda num: f"{num:.2f}"
+            elif format_option == "保留3位小数":
+                base_format = lambda num: f"{num:.3f}"
+            else:
+                base_format = str
+        
+        if not self.use_thousands_separator_var.get():
+            return base_format
+        
+        def format_with_separator(num: float) -> str:
+            formatted_value = base_format(num)
+            try:
+                # 分离整数和小数部分
+                if '.' in formatted_value:
+                    integer_part, decimal_part = formatted_value.split('.')
+                    # 为整数部分添加千分位分隔符
+                    integer_part = f"{int(integer_part):,}"
+                    return f"{integer_part}.{decimal_part}"
+                return f"{int(float(formatted_value)):,}"
+            except:
+                # 如果添加千分位分隔符失败，返回原格式化值
+                return formatted_value
+        
+        return format_with_separator
+    
+    def read_excel_number_formats(self, file_path: str) -> dict:
+        """读取Excel第一行数据各字段的单元格数字格式（仅支持xlsx）"""
+        if not file_path.lower().endswith((".xlsx", ".xlsm")) or self.excel_data is None:
+            return {}
+        
+        try:
+            from openpyxl import load_workbook
+            
+            workbook = load_workbook(file_path, read_only=True)
+            try:
+                # 与pandas默认读取的工作表一致
+                rows = workbook.worksheets[0].iter_rows(min_row=2, max_row=2)
+                first_row = next(rows, ())
+            finally:
+                workbook.close()
+            
+            formats = {}
+            for position, column in enumerate(self.excel_data.columns):
+                if position < len(first_row):
+                    number_format = getattr(first_row[position], "number_format", None)
+                    if number_format and number_format != "General":
+                        formats[column] = number_format
+            
+            if formats:
+                self.log_output(f"读取到单元格数字格式: {formats}")
+            return formats
+            
+        except Exception as e:
+            self.log_output(f"读取单元格数字格式失败: {e}")
+            return {}
+    
+    def compile_number_format(self, spec: str) -> Optional[dict]:
+        """将Excel风格的数字格式编译为格式化函数，无法识别或为常规格式时返回None
+        
+        返回 {"kind": "number"/"date"/"text", "func": 格式化函数}
+        """
+        if spec in self.number_format_cache:
+            return self.number_format_cache[spec]
+        
+        compiled = None
+        try:
+            compiled = self._compile_number_format(spec)
+        except Exception as e:
+            self.log_output(f"数字格式编译失败: {spec}, 错误: {e}")
+        
+        self.number_format_cache[spec] = compiled
+        return compiled
+    
+    def _compile_number_format(self, spec: str) -> Optional[dict]:
+        """编译数字格式（不带缓存）"""
+        spec = (spec or "").strip()
+        if not spec or spec.lower() == "general" or spec in ("常规", "通用格式"):
+            return None
+        
+        if spec == "@":
+            return {"kind": "text", "func": str}
+        
+        # 拆分为格式代码和文本常量，只使用第一节（正数格式）
+        items = []  # (是否为格式代码, 字符)
+        index = 0
+        while index < len(spec):
+            char = spec[index]
+            if char == ";":
+                break
+            if char == '"':
+                end = spec.find('"', index + 1)
+                end = len(spec) if end == -1 else end
+                items.extend((False, c) for c in spec[index + 1:end])
+                index = end + 1
+                continue
+            if char == "\\" and index + 1 < len(spec):
+                items.append((False, spec[index + 1]))
+                index += 2
+                continue
+            if char in "_*" and index + 1 < len(spec):
+                # 对齐填充，忽略
+                index += 2
+                continue
+            if char == "[":
+                end = spec.find("]", index)
+                end = len(spec) if end == -1 else end
+                block = spec[index + 1:end]
+                if block.startswith("$"):
+                    # 货币符号，如 [$¥-804]
+                    items.extend((False, c) for c in block[1:].split("-")[0])
+                index = end + 1
+                continue
+            items.append((True, char))
+            index += 1
+        
+        codes = "".join(char for is_code, char in items if is_code)
+        
+        if "0" not in codes and "#" not in codes and "?" not in codes:
+            if re.search(r'[yYdDhHsSmM]', codes) or "上午/下午" in codes:
+                return self._compile_date_format(items)
+            return None
+        
+        # 找到数字占位区域
+        positions = [i for i, (is_code, char) in enumerate(items) if is_code and char in "0#?"]
+        first, last = positions[0], positions[-1]
+        region = "".join(char for _, char in items[first:last + 1])
+        
+        # 数字区域后紧跟的逗号表示按千缩放
+        divisor = 1.0
+        after = last + 1
+        while after < len(items) and items[after] == (True, ","):
+            divisor *= 1000
+            after += 1
+        
+        prefix = "".join(char for _, char in items[:first])
+        suffix = "".join(char for _, char in items[after:])
+        
+        # 百分比和万/亿缩放（万/亿需写在格式代码中，引号内的只作为文本）
+        multiplier = 100.0 ** sum(1 for is_code, char in items if is_code and char == "%")
+        if any(item == (True, "亿") for item in items):
+            divisor *= 100000000
+        elif any(item == (True, "万") for item in items):
+            divisor *= 10000
+        
+        integer_code, _, decimal_code = region.partition(".")
+        grouping = "," in integer_code
+        min_integer_digits = integer_code.count("0")
+        decimal_code = decimal_code.replace(",", "")
+        max_decimals = len(decimal_code)
+        min_decimals = decimal_code.count("0")
+        separator = "," if grouping else ""
+        
+        def format_number(value) -> str:
+            number = float(value) * multiplier / divisor
+            # Excel按四舍五入（而非银行家舍入）处理小数位
+            rounded = Decimal(repr(abs(number))).quantize(Decimal(1).scaleb(-max_decimals), rounding=ROUND_HALF_UP)
+            text = f"{rounded:{separator}.{max_decimals}f}"
+            integer_text, _, decimal_text = text.partition(".")
+            
+            # 可选小数位（#）去掉末尾的0
+            if max_decimals > min_decimals:
+                decimal_text = decimal_text[:min_decimals] + decimal_text[min_decimals:].rstrip("0")
+            
+            # 整数位补0
+            if not grouping and len(integer_text) < min_integer_digits:
+                integer_text = integer_text.zfill(min_integer_digits)
+            if min_integer_digits == 0 and integer_text == "0":
+                integer_text = ""
+            
+            text = f"{integer_text}.{decimal_text}" if decimal_text else (integer_text or "0")
+            sign = "-" if number < 0 and any(c not in "0.," for c in text) else ""
+            return f"{sign}{prefix}{text}{suffix}"
+        
+        return {"kind": "number", "func": format_number}
+    
+    def _compile_date_format(self, items) -> dict:
+        """编译日期时间格式"""
+        # 将格式代码切分为日期时间标记
+        tokens = []  # (是否为格式标记, 文本)
+        index = 0
+        token_pattern = re.compile(r'yyyy|yy|mmmm|mmm|mm|m|dddd|ddd|dd|d|hh|h|ss|s|am/pm|a/p|上午/下午', re.IGNORECASE)
+        while index < len(items):
+            is_code, char = items[index]
+            if is_code:
+                code = ""
+                end = index
+                while end < len(items) and items[end][0]:
+                    code += items[end][1]
+                    end += 1
+                position = 0
+                while position < len(code):
+                    match = token_pattern.match(code, position)
+                    if match:
+                        tokens.append((True, match.group(0).lower()))
+                        position = match.end()
+                    else:
+                        tokens.append((False, code[position]))
+                        position += 1
+                index = end
+            else:
+                tokens.append((False, char))
+                index += 1
+        
+        token_names = [text for is_token, text in tokens if is_token]
+        twelve_hour = any(name in ("am/pm", "a/p", "上午/下午") for name in token_names)
+        
+        # m/mm 在小时之后或秒之前表示分钟
+        formatters = []
+        for position, (is_token, text) in enumerate(tokens):
+            if not is_token:
+                formatters.append(lambda ts, text=text: text)
+                continue
+            
+            if text in ("m", "mm"):
+                previous = [t for is_t, t in tokens[:position] if is_t]
+                following = [t for is_t, t in tokens[position + 1:] if is_t]
+                if (previous and previous[-1] in ("h", "hh")) or (following and following[0] in ("s", "ss")):
+                    text = "minute_" + text
+            
+            if text == "yyyy":
+                formatters.append(lambda ts: f"{ts.year:04d}")
+            elif text == "yy":
+                formatters.append(lambda ts: f"{ts.year % 100:02d}")
+            elif text == "mmmm":
+                formatters.append(lambda ts: ts.strftime("%B"))
+            elif text == "mmm":
+                formatters.append(lambda ts: ts.strftime("%b"))
+            elif text == "mm":
+                formatters.append(lambda ts: f"{ts.month:02d}")
+            elif text == "m":
+                formatters.append(lambda ts: str(ts.month))
+            elif text == "minute_mm":
+                formatters.append(lambda ts: f"{ts.minute:02d}")
+            elif text == "minute_m":
+                formatters.append(lambda ts: str(ts.minute))
+            elif text == "dddd":
+                formatters.append(lambda ts: ts.strftime("%A"))
+            elif text == "ddd":
+                formatters.append(lambda ts: ts.strftime("%a"))
+            elif text == "dd":
+                formatters.append(lambda ts: f"{ts.day:02d}")
+            elif text == "d":
+                formatters.append(lambda ts: str(ts.day))
+            elif text in ("hh", "h"):
+                width = 2 if text == "hh" else 1
+                if twelve_hour:
+                    formatters.append(lambda ts, width=width: f"{(ts.hour % 12) or 12:0{width}d}")
+                else:
+                    formatters.append(lambda ts, width=width: f"{ts.hour:0{width}d}")
+            elif text == "ss":
+                formatters.append(lambda ts: f"{ts.second:02d}")
+            elif text == "s":
+                formatters.append(lambda ts: str(ts.second))
+            elif text == "上午/下午":
+                formatters.append(lambda ts: "上午" if ts.hour < 12 else "下午")
+            elif text == "a/p":
+                formatters.append(lambda ts: "A" if ts.hour < 12 else "P")
+            else:
+                formatters.append(lambda ts: "AM" if ts.hour < 12 else "PM")
+        
+        def format_date(value) -> str:
+            if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+                # Excel日期序列号
+                timestamp = pd.Timestamp("1899-12-30") + pd.to_timedelta(float(value), unit="D")
+            else:
+                timestamp = pd.Timestamp(value)
+            if pd.isna(timestamp):
+                raise ValueError("无效的日期")
+            return "".join(formatter(timestamp) for formatter in formatters)
+        
+        return {"kind": "date", "func": format_date}
+    
+    def apply_number_format(self, series: pd.Series, compiled: dict) -> pd.Series:
+        """对整列应用编译后的数字格式，空值为"0"，无法格式化的值保留原文本"""
+        if compiled["kind"] == "number":
+            return self.format_value_series(series, compiled["func"])
+        
+        result = pd.Series("0", index=series.index, dtype=object)
+        valid = series.notna()
+        if not valid.any():
+            return result
+        
+        func = compiled["func"]
+        cache = {}
+        
+        def format_cell(cell_value):
+            try:
+                return cache[cell_value]
+            except KeyError:
+                pass
+            try:
+                formatted_value = func(cell_value)
+            except Exception:
+                formatted_value = str(cell_value)
+            cache[cell_value] = formatted_value
+            return formatted_value
+        
+        result[valid] = series[valid].map(format_cell)
+        return result
+    
+    def get_mapping_number_format(self, mapping: dict, mapping_type: str) -> Optional[dict]:
+        """获取映射的字段数字格式，未设置时返回None（使用全局设置）"""
+        spec = mapping.get("format", "")
+        if spec == "单元格格式":
+            # 使用Excel单元格自身的数字格式
+            spec = self.excel_number_formats.get(mapping["mapping"], "") if mapping_type == "column" else ""
+        if not spec:
+            return None
+        return self.compile_number_format(spec)
+    
+    def format_value_series(self, series: pd.Series, formatter) -> pd.Series:
+        """按列格式化字段值：空值为"0"，数字按格式化函数处理，其余转为文本"""
+        result = pd.Series("0", index=series.index, dtype=object)
+        valid = series.notna()
+        if not valid.any():
+            return result
+        
+        values = series[valid]
+        
+        def format_text(text: str) -> str:
+            # 与单元格文本一致，能解析为数字的才格式化，格式化失败保留原文本
+            if not self.is_number(text):
+                return text
+            try:
+                return formatter(float(text))
+            except Exception:
+                return text
+        
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            # 数值列：每个不同的值只格式化一次
+            numbers = values.astype(float)
+            formatted = {}
+            for num in pd.unique(numbers):
+                try:
+                    formatted[num] = formatter(num)
+                except Exception:
+                    formatted[num] = str(num)
+            result[valid] = numbers.map(formatted)
+            return result
+        
+        # 其他列：每个不同的值只格式化一次
+        cache = {}
+        
+        def format_cell(cell_value):
+            try:
+                return cache[cell_value]
+            except KeyError:
+                formatted_value = cache[cell_value] = format_text(str(cell_value))
+                return formatted_value
+            except TypeError:
+                # 不可哈希的值不缓存
+                return format_text(str(cell_value))
+        
+        result[valid] = values.map(format_cell)
+        return result
+    
+    def classify_mapping(self, match_pattern: str, columns) -> str:
+        """判断映射类型：empty（空白）、aggregate（分组汇总）、expression（数学表达式）、column（字段）、text（固定文本）"""
+        if not match_pattern:
+            return "empty"
+        aggregate_match = AGGREGATE_PATTERN.match(match_pattern)
+        if aggregate_match and aggregate_match.group(2) in columns:
+            return "aggregate"
+        if any(op in match_pattern for op in ['+', '-', '*', '/']):
+            return "expression"
+        if re.match(r'\s*(?:round|sum|min|max|abs|if|如果)\s*\(', match_pattern, re.IGNORECASE):
+            return "expression"
+        if match_pattern in columns:
+            return "column"
+        return "text"
+    
+    def prepare_mapping_values(self, data: pd.DataFrame) -> pd.DataFrame:
+        """按列预先计算所有行的文本替换值，返回 行×占位符 的字符串表"""
+        # 图片占位符不参与文本替换
+        image_placeholders = {m["placeholder"] for m in self.image_mapping_data if m.get("placeholder")}
+        
+        formatter = self.build_number_formatter()
+        prepared = {}
+        group_codes = None
+        
+        for mapping in self.mapping_data:
+            placeholder = mapping["placeholder"]
+            match_pattern = mapping["mapping"]
+            
+            if not placeholder or placeholder in image_placeholders or placeholder in prepared:
+                continue
+            
+            mapping_type = self.classify_mapping(match_pattern, data.columns)
+            number_format = self.get_mapping_number_format(mapping, mapping_type)
+            
+            if mapping_type == "aggregate":
+                # 分组汇总，组内每行都填充该组的汇总值
+                if group_codes is None:
+                    group_codes = self.get_group_codes(data)
+                aggregated = self.evaluate_aggregate(match_pattern, data, group_codes)
+                if number_format:
+                    prepared[placeholder] = self.apply_number_format(aggregated, number_format)
+                elif AGGREGATE_PATTERN.match(match_pattern).group(1) == "计数":
+                    # 计数始终为整数
+                    prepared[placeholder] = aggregated.astype(str).astype(object)
+                else:
+                    prepared[placeholder] = self.format_value_series(aggregated, formatter)
+            elif mapping_type == "expression":
+                # 数学表达式（字段数字格式优先于全局设置）
+                if number_format and number_format["kind"] == "number":
+                    prepared[placeholder] = self.evaluate_math_expression(match_pattern, data, number_format["func"])
+                else:
+                    prepared[placeholder] = self.evaluate_math_expression(match_pattern, data, formatter)
+            elif mapping_type == "column":
+                # 直接字段映射，对字段值进行数字格式化（字段数字格式优先于全局设置）
+                if number_format:
+                    prepared[placeholder] = self.apply_number_format(data[match_pattern], number_format)
+                else:
+                    prepared[placeholder] = self.format_value_series(data[match_pattern], formatter)
+            elif mapping_type == "text":
+                # 固定文本
+                prepared[placeholder] = pd.Series(match_pattern, index=data.index, dtype=object)
+            else:
+                # 未映射的占位符默认填充"0"
+                prepared[placeholder] = pd.Series("0", index=data.index, dtype=object)
+        
+        # 条件区域按列计算，渲染时按标记查找
+        for marker, condition in self.template_conditions.items():
+            prepared[marker] = self.evaluate_condition(condition, data).map({True: "True", False: "False"})
+        
+        self.log_output(f"预计算替换值完成: {len(data)} 行 × {len(prepared)} 个占位符")
+        return pd.DataFrame(prepared, index=data.index, dtype=object)
+
+    def evaluate_aggregate(self, match_pattern: str, data: pd.DataFrame, group_codes: np.ndarray) -> pd.Series:
+        """按分组计算汇总值（sum/count/min/max/mean），结果按行对齐"""
+        function_name, column = AGGREGATE_PATTERN.match(match_pattern).groups()
+        function = AGGREGATE_FUNCTIONS[function_name]
+        values = data[column]
+        
+        if function == "count":
+            return values.notna().groupby(group_codes).transform("sum").astype(int)
+        
+        numbers = pd.to_numeric(values, errors="coerce")
+        is_datetime = pd.api.types.is_datetime64_any_dtype(values)
+        if function in ("min", "max") and (is_datetime or numbers.isna().sum() > values.isna().sum()):
+            # 非数字字段（如日期）按原值比较
+            try:
+                return values.groupby(group_codes).transform(function)
+            except TypeError:
+                pass
+        return numbers.groupby(group_codes).transform(function)
+    
+    def evaluate_condition(self, condition: str, data: pd.DataFrame) -> pd.Series:
+        """按列计算条件区域的条件，返回每行条件是否成立"""
+        condition = condition.strip().translate(str.maketrans("＝！＜＞“”‘’", "=!<>\"\"''"))
+        
+        # 单独的字段名：字段值非空且不为0时成立
+        if condition in data.columns:
+            values = data[condition]
+            text = values.astype(str).str.strip()
+            return values.notna() & ~text.isin(["", "0", "0.0", "False", "false"])
+        
+        # 字段与文本比较，如 类型=A、类型!="B"：右侧带引号，或既不是数字也不包含字段名时按文本比较
+        # （先于数学表达式判断，文本不会被当作未知字段编译）
+        match = CONDITION_TEXT_PATTERN.fullmatch(condition)
+        if match and match.group(1).strip() in data.columns:
+            expected = match.group(3).strip()
+            quoted = len(expected) >= 2 and expected[0] == expected[-1] and expected[0] in "\"'"
+            if quoted or not (self.is_number(expected) or any(str(column) in expected for column in data.columns)):
+                values = data[match.group(1).strip()]
+                expected = expected[1:-1] if quoted else expected
+                equal = values.notna() & (values.astype(str).str.strip() == expected)
+                return equal if match.group(2) in ("==", "=") else ~equal
+        
+        # 数学表达式和比较，如 金额>1000、金额+金额2>=0
+        compiled = self.compile_math_expression(condition, data.columns)
+        if compiled["tree"] is not None:
+            try:
+                result, invalid = self.compute_expression_array(compiled, data)
+                truth = np.nan_to_num(np.asarray(result, dtype=float)) != 0
+                return pd.Series(truth & ~invalid, index=data.index)
+            except Exception as e:
+                self.log_output(f"条件计算失败: {condition}, 错误: {e}")
+        
+        self.log_output(f"无法识别的条件: {condition}，按不成立处理")
+        return pd.Series(False, index=data.index)
+    
+    def process_math_expression(self, expression: str, data_row: pd.Series) -> str:
+        """处理单行数据的数学表达式"""
+        try:
+            row_frame = pd.DataFrame([data_row])
+            return self.evaluate_math_expression(expression, row_frame).iloc[0]
+        except:
+            return expression
+    
+    def compile_math_expression(self, expression: str, columns) -> dict:
+        """将数学表达式编译为语法树，字段名按名称绑定（结果按表达式和字段列表缓存）"""
+        cache_key = (expression, tuple(str(column) for column in columns))
+        if cache_key in self.expression_cache:
+            return self.expression_cache[cache_key]
+        
+        # 字段名按长度从长到短匹配，避免一个字段名是另一个字段名的一部分时替换错误
+        column_lookup = {}
+        for column in columns:
+            name = str(column)
+            # 纯数字的字段名无法与数字常量区分，不参与绑定
+            if name.strip() and not self.is_number(name):
+                column_lookup.setdefault(name, column)
+        
+        # 表达式拆分为文本片段和字段引用，计算失败时用于拼出替换后的文本
+        parts = []
+        bound_columns = {}
+        tokenized = expression
+        if column_lookup:
+            names = sorted(column_lookup, key=len, reverse=True)
+            column_pattern = re.compile(r'(?<![\w.])(?:' + '|'.join(re.escape(name) for name in names) + r')(?!\w)')
+            
+            tokens = []
+            position = 0
+            for match in column_pattern.finditer(expression):
+                parts.append(expression[position:match.start()])
+                column = column_lookup[match.group(0)]
+                parts.append((column,))
+                token = f"__c{len(bound_columns)}__"
+                for existing_token, existing_column in bound_columns.items():
+                    if existing_column == column:
+                        token = existing_token
+                        break
+                bound_columns[token] = column
+                tokens.append(expression[position:match.start()])
+                tokens.append(token)
+                position = match.end()
+            parts.append(expression[position:])
+            tokens.append(expression[position:])
+            tokenized = "".join(tokens)
+        else:
+            parts.append(expression)
+        
+        compiled = {"tree": None, "error": None, "columns": bound_columns, "parts": parts}
+        
+        try:
+            # 统一全角符号和Excel写法
+            text = tokenized.translate(str.maketrans("（），×÷＋－＊／＜＞＝", "(),*/+-*/<>="))
+            text = text.strip()
+            if text.startswith("="):
+                text = text[1:]
+            text = text.replace("<>", "!=")
+            text = re.sub(r'(?<![<>=!])=(?!=)', '==', text)
+            text = re.sub(r'(?<!\w)(?:if|IF|If|如果)\s*\(', '__if__(', text)
+            
+            tree = ast.parse(text, mode="eval")
+            self.validate_expression_tree(tree, bound_columns)
+            compiled["tree"] = tree
+        except Exception as e:
+            compiled["error"] = str(e)
+            self.log_output(f"数学表达式无法编译: {expression}, 错误: {e}")
+        
+        self.expression_cache[cache_key] = compiled
+        return compiled
+    
+    def validate_expression_tree(self, tree, bound_columns: dict):
+        """检查表达式只包含算术运算、比较和允许的函数"""
+        allowed_nodes = (
+            ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.Call,
+            ast.Name, ast.Constant, ast.Load,
+            ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+            ast.UAdd, ast.USub, ast.Not, ast.And, ast.Or,
+            ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+        )
+        function_names = {"round", "sum", "min", "max", "abs", "__if__"}
+        
+        for node in ast.walk(tree):
+            if not isinstance(node, allowed_nodes):
+                raise ValueError(f"表达式中不支持的语法: {type(node).__name__}")
+            
+            if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+                raise ValueError(f"表达式中不支持的常量: {node.value!r}")
+            
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id.lower() not in function_names:
+                    raise ValueError("表达式中只支持 round、sum、min、max、abs、if 函数")
+                if node.keywords:
+                    raise ValueError("表达式函数不支持关键字参数")
+                if node.func.id == "__if__" and len(node.args) != 3:
+                    raise ValueError("if函数需要3个参数：if(条件, 成立时的值, 不成立时的值)")
+                if node.func.id.lower() == "round" and len(node.args) == 2 and not isinstance(node.args[1], ast.Constant):
+                    raise ValueError("round函数的小数位数必须是数字")
+            
+            if isinstance(node, ast.Name):
+                if node.id not in bound_columns and node.id.lower() not in function_names:
+                    raise ValueError(f"表达式中包含未知的字段: {node.id}")
+    
+    def evaluate_math_expression(self, expression: str, data: pd.DataFrame, formatter=None) -> pd.Series:
+        """对所有行按列计算数学表达式，返回格式化后的文本列"""
+        if formatter is None:
+            formatter = self.build_number_formatter()
+        
+        compiled = self.compile_math_expression(expression, data.columns)
+        
+        # 计算失败时返回字段值替换后的表达式文本（空值按"0"处理）
+        def substituted_text(rows_mask) -> pd.Series:
+            subset = data[rows_mask]
+            text = pd.Series("", index=subset.index, dtype=object)
+            for part in compiled["parts"]:
+                if isinstance(part, tuple):
+                    values = subset[part[0]]
+                    text = text + values.map(str).where(values.notna(), "0")
+                else:
+                    text = text + part
+            return text
+        
+        if compiled["tree"] is None:
+            return substituted_text(pd.Series(True, index=data.index))
+        
+        try:
+            result, invalid = self.compute_expression_array(compiled, data)
+        except Exception as e:
+            self.log_output(f"数学表达式计算失败: {expression}, 错误: {e}")
+            return substituted_text(pd.Series(True, index=data.index))
+        
+        output = pd.Series("", index=data.index, dtype=object)
+        if result.dtype == bool:
+            # 比较结果直接输出
+            output[:] = [str(value) for value in result]
+            failed = invalid
+        else:
+            numbers = result.astype(float)
+            failed = invalid | ~np.isfinite(numbers)
+            formatted = {}
+            for number in pd.unique(numbers[~failed]):
+                try:
+                    formatted[number] = formatter(number)
+                except Exception:
+                    formatted[number] = str(number)
+            output[~failed] = [formatted[number] for number in numbers[~failed]]
+        
+        if failed.any():
+            output[failed] = substituted_text(pd.Series(failed, index=data.index))
+        return output
+    
+    def compute_expression_array(self, compiled: dict, data: pd.DataFrame):
+        """按列计算已编译的表达式，返回 (每行结果数组, 字段值非数字导致无法计算的行)"""
+        row_count = len(data)
+        
+        # 字段值转为数字，空值按0处理，非数字文本使该行计算失败
+        invalid = np.zeros(row_count, dtype=bool)
+        column_values = {}
+        for token, column in compiled["columns"].items():
+            raw_values = data[column]
+            if pd.api.types.is_bool_dtype(raw_values):
+                raw_values = raw_values.astype(float)
+            numbers = pd.to_numeric(raw_values, errors="coerce")
+            invalid |= (raw_values.notna() & numbers.isna()).to_numpy()
+            column_values[token] = numbers.fillna(0).to_numpy(dtype=float)
+        
+        def evaluate(node):
+            if isinstance(node, ast.Expression):
+                return evaluate(node.body)
+            if isinstance(node, ast.Constant):
+                return float(node.value)
+            if isinstance(node, ast.Name):
+                return column_values[node.id]
+            if isinstance(node, ast.UnaryOp):
+                operand = evaluate(node.operand)
+                if isinstance(node.op, ast.USub):
+                    return -operand
+                if isinstance(node.op, ast.Not):
+                    return np.logical_not(operand)
+                return operand
+            if isinstance(node, ast.BinOp):
+                left = evaluate(node.left)
+                right = evaluate(node.right)
+                if isinstance(node.op, ast.Add):
+                    return np.add(left, right)
+                if isinstance(node.op, ast.Sub):
+                    return np.subtract(left, right)
+                if isinstance(node.op, ast.Mult):
+                    return np.multiply(left, right)
+                if isinstance(node.op, ast.Div):
+                    return np.true_divide(left, right)
+                if isinstance(node.op, ast.FloorDiv):
+                    return np.floor_divide(left, right)
+                if isinstance(node.op, ast.Mod):
+                    return np.mod(left, right)
+                return np.power(left, right)
+            if isinstance(node, ast.BoolOp):
+                values = [evaluate(value) for value in node.values]
+                if isinstance(node.op, ast.And):
+                    return np.logical_and.reduce(values)
+                return np.logical_or.reduce(values)
+            if isinstance(node, ast.Compare):
+                result = True
+                left = evaluate(node.left)
+                for op, comparator in zip(node.ops, node.comparators):
+                    right = evaluate(comparator)
+                    if isinstance(op, ast.Eq):
+                        current = np.equal(left, right)
+                    elif isinstance(op, ast.NotEq):
+                        current = np.not_equal(left, right)
+                    elif isinstance(op, ast.Lt):
+                        current = np.less(left, right)
+                    elif isinstance(op, ast.LtE):
+                        current = np.less_equal(left, right)
+                    elif isinstance(op, ast.Gt):
+                        current = np.greater(left, right)
+                    else:
+                        current = np.greater_equal(left, right)
+                    result = np.logical_and(result, current)
+                    left = right
+                return result
+            if isinstance(node, ast.Call):
+                name = node.func.id.lower()
+                args = [evaluate(arg) for arg in node.args]
+                if name == "__if__":
+                    return np.where(np.asarray(args[0]) != 0, args[1], args[2])
+                if not args:
+                    raise ValueError(f"{name}函数缺少参数")
+                if name == "round":
+                    digits = int(node.args[1].value) if len(node.args) > 1 else 0
+                    return np.round(args[0], digits)
+                if name == "abs":
+                    return np.abs(args[0])
+                if name == "sum":
+                    return np.sum(np.broadcast_arrays(*args), axis=0)
+                if name == "min":
+                    return np.minimum.reduce(np.broadcast_arrays(*args))
+                return np.maximum.reduce(np.broadcast_arrays(*args))
+            raise ValueError(f"表达式中不支持的语法: {type(node).__name__}")
+        
+        with np.errstate(all="ignore"):
+            result = np.broadcast_to(evaluate(compiled["tree"]), (row_count,))
+        return result, invalid
+    
+    def get_file_digest(self, file_path: str) -> str:
+        """计算文件内容的摘要（按路径、修改时间和大小缓存）"""
+        stat = os.stat(file_path)
+        cache_key = (file_path, stat.st_mtime_ns, stat.st_size)
+        digest = self.file_digest_cache.get(cache_key)
+        if digest is None:
+            hasher = hashlib.sha256()
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(chunk)
+            digest = self.file_digest_cache[cache_key] = hasher.hexdigest()
+        return digest
+    
+    def collect_render_settings(self) -> dict:
+        """收集影响文档渲染结果的全部设置"""
+        return {
+            "mapping": self.mapping_data,
+            "image_mapping": self.image_mapping_data,
+            "number_format": self.number_format_var.get(),
+            "custom_decimal": self.custom_decimal_var.get() if self.enable_custom_decimal_var.get() else None,
+            "thousands_separator": self.use_thousands_separator_var.get(),
+            "placeholder_syntaxes": [token for token, var in self.placeholder_syntax_vars.items() if var.get()],
+            "group_field": self.group_field_var.get(),
+            "exif_transpose": self.exif_transpose_var.get(),
+        }
+    
+    def load_template_document(self) -> Document:
+        """从内存中的模板内容创建文档，模板文件只在变化后才重新读取"""
+        stat = os.stat(self.word_template_path)
+        cache_key = (self.word_template_path, stat.st_mtime_ns, stat.st_size)
+        if self.template_bytes_cache is None or self.template_bytes_cache[0] != cache_key:
+            with open(self.word_template_path, "rb") as f:
+                self.template_bytes_cache = (cache_key, f.read())
+            self.log_output(f"已读取模板到内存: {len(self.template_bytes_cache[1]) / 1024:.0f}KB")
+        return Document(io.BytesIO(self.template_bytes_cache[1]))
+    
+    def get_template_zip_entries(self) -> dict:
+        """返回内存中模板压缩包的成员信息 {成员名: ZipInfo}"""
+        cache_key = self.template_bytes_cache[0]
+        if self.template_zip_entries is None or self.template_zip_entries[0] != cache_key:
+            with zipfile.ZipFile(io.BytesIO(self.template_bytes_cache[1])) as archive:
+                self.template_zip_entries = (cache_key, {info.filename: info for info in archive.infolist()})
+        return self.template_zip_entries[1]
+    
+    def build_content_types_xml(self, template_xml: bytes, parts: list) -> Optional[bytes]:
+        """根据模板的内容类型清单和文档当前的部件生成新的清单，与模板一致时返回None"""
+        from lxml import etree
+        
+        namespace = "{http://schemas.openxmlformats.org/package/2006/content-types}"
+        root = etree.fromstring(template_xml)
+        defaults = {element.get("Extension").lower(): element.get("ContentType")
+                    for element in root.iter(f"{namespace}Default")}
+        overrides = {element.get("PartName"): element for element in root.iter(f"{namespace}Override")}
+        
+        changed = False
+        part_names = set()
+        for part in parts:
+            part_name = str(part.partname)
+            extension = part.partname.ext.lower()
+            part_names.add(part_name)
+            if part_name in overrides or defaults.get(extension) == part.content_type:
+                continue
+            
+            # 新增部件：新扩展名（如新图片格式）按扩展名登记，其余按部件名登记
+            if extension not in defaults:
+                root.insert(0, root.makeelement(f"{namespace}Default", Extension=extension, ContentType=part.content_type))
+                defaults[extension] = part.content_type
+            else:
+                etree.SubElement(root, f"{namespace}Override", PartName=part_name, ContentType=part.content_type)
+            changed = True
+        
+        # 删除已不在文档中的部件
+        for part_name, element in overrides.items():
+            if part_name not in part_names:
+                root.remove(element)
+                changed = True
+        
+        if not changed:
+            return None
+        return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+    
+    def write_docx_package(self, doc: Document, compression_level: int = 6) -> bytes:
+        """直接写出docx压缩包：未修改的部件从模板中按原压缩数据复制，
+        只重新序列化正文、页眉页脚等修改过的部件和新增的图片"""
+        from docx.opc.part import XmlPart
+        
+        template_bytes = self.template_bytes_cache[1]
+        template_entries = self.get_template_zip_entries()
+        package = doc.part.package
+        parts = list(package.iter_parts())
+        story_parts = {id(part) for part in self.get_story_parts(doc)}
+        
+        output = io.BytesIO()
+        now = time.localtime()[:6]
+        compress_type = zipfile.ZIP_DEFLATED if compression_level else zipfile.ZIP_STORED
+        
+        with zipfile.ZipFile(output, "w") as archive:
+            def write_new(name: str, data: bytes):
+                archive.writestr(zipfile.ZipInfo(name, date_time=now), data,
+                                 compress_type=compress_type, compresslevel=compression_level or None)
+            
+            def copy_raw(info: zipfile.ZipInfo):
+                # 从模板的本地文件头定位原压缩数据，不解压直接写入新压缩包
+                header = struct.unpack(zipfile.structFileHeader,
+                                       template_bytes[info.header_offset:info.header_offset + zipfile.sizeFileHeader])
+                # 文件头最后两个字段为文件名长度和扩展字段长度
+                data_start = info.header_offset + zipfile.sizeFileHeader + header[-2] + header[-1]
+                
+                copied = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                copied.compress_type = info.compress_type
+                copied.flag_bits = info.flag_bits & ~0x08  # 大小写在文件头中，不使用数据描述符
+                copied.external_attr = info.external_attr
+                copied.CRC = info.CRC
+                copied.compress_size = info.compress_size
+                copied.file_size = info.file_size
+                
+                archive.fp.seek(archive.start_dir)
+                copied.header_offset = archive.start_dir
+                archive.fp.write(copied.FileHeader())
+                archive.fp.write(template_bytes[data_start:data_start + info.compress_size])
+                archive.start_dir = archive.fp.tell()
+                archive.filelist.append(copied)
+                archive.NameToInfo[copied.filename] = copied
+            
+            # 新增或删除部件时重新生成内容类型清单
+            with zipfile.ZipFile(io.BytesIO(template_bytes)) as template:
+                content_types = self.build_content_types_xml(template.read("[Content_Types].xml"), parts)
+            if content_types is None:
+                copy_raw(template_entries["[Content_Types].xml"])
+            else:
+                write_new("[Content_Types].xml", content_types)
+            
+            # 包关系总是重新写出（压缩包的中央目录在至少写入一个新成员后才会在关闭时生成）
+            write_new("_rels/.rels", package.rels.xml)
             
-            # 根据单位和尺寸设置图片
-            if use_cm:
-                if height_value:
-                    # 同时设置宽度和高度
-                    run.add_picture(image_path, width=Cm(width_value), height=Cm(height_value))
+            for part in parts:
+                member_name = part.partname.membername
+                info = template_entries.get(member_name)
+                
+                if isinstance(part, XmlPart):
+                    unchanged = info is not None and id(part) not in story_parts
                 else:
-                    # 只设置宽度，高度按比例缩放
-                    run.add_picture(image_path, width=Cm(width_value))
-            else:
-                if height_value:
-                    # 同时设置宽度和高度
-                    run.add_picture(image_path, width=Inches(width_value), height=Inches(height_value))
+                    # 二进制部件（图片、字体等）内容与模板一致时直接复制
+                    blob = part.blob
+                    unchanged = info is not None and info.file_size == len(blob) and info.CRC == zlib.crc32(blob)
+                
+                if unchanged:
+                    copy_raw(info)
                 else:
-                    # 只设置宽度，高度按比例缩放
-                    run.add_picture(image_path, width=Inches(width_value))
+                    write_new(member_name, part.blob)
+                
+                if len(part.rels):
+                    rels_name = part.partname.rels_uri.membername
+                    rels_info = template_entries.get(rels_name)
+                    if unchanged and rels_info is not None:
+                        copy_raw(rels_info)
+                    else:
+                        write_new(rels_name, part.rels.xml)
+        
+        return output.getvalue()
+    
+    def get_compression_level(self, intermediate: bool = False) -> int:
+        """返回输出文档的压缩级别，合并用的中间文档可设置为仅存储"""
+        if intermediate and self.store_intermediate_var.get():
+            return 0
+        return COMPRESSION_PRESETS.get(self.compression_level_var.get(), 6)
+    
+    def recompress_docx(self, content: bytes, compression_level: int) -> bytes:
+        """按指定压缩级别重新打包docx内容"""
+        output = io.BytesIO()
+        compress_type = zipfile.ZIP_DEFLATED if compression_level else zipfile.ZIP_STORED
+        with zipfile.ZipFile(io.BytesIO(content)) as source, \
+                zipfile.ZipFile(output, "w", compress_type, compresslevel=compression_level or None) as target:
+            for info in source.infolist():
+                target.writestr(info, source.read(info.filename), compress_type, compression_level or None)
+        return output.getvalue()
+    
+    def save_document_content(self, doc: Document, compression_level: int = 6) -> bytes:
+        """保存文档为docx内容，优先使用直接写压缩包的方式，失败时回退到python-docx保存"""
+        try:
+            return self.write_docx_package(doc, compression_level)
+        except Exception as e:
+            self.log_output(f"直接写出文档失败，使用常规保存: {e}")
+            buffer = io.BytesIO()
+            doc.save(buffer)
+            if compression_level != 6:
+                return self.recompress_docx(buffer.getvalue(), compression_level)
+            return buffer.getvalue()
+    
+    def save_document_file(self, doc: Document, output_path: str, compression_level: int = 6):
+        """按指定压缩级别保存文档到文件（用于合并文档等不基于模板的文档）"""
+        if compression_level == 6:
+            doc.save(output_path)
+            return
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        with open(output_path, "wb") as f:
+            f.write(self.recompress_docx(buffer.getvalue(), compression_level))
+    
+    def validate_image_file(self, image_path: str) -> List[tuple]:
+        """检查图片能否正常解码和嵌入，返回 [(级别, 问题说明)]，级别为"错误"或"警告"
+        
+        在后台线程中运行，只访问文件系统，不读取界面变量。
+        """
+        issues = []
+        try:
+            file_size = os.path.getsize(image_path)
+            if file_size > LARGE_IMAGE_BYTES:
+                issues.append(("警告", f"文件过大（{file_size / 1048576:.0f}MB）"))
             
-            # 设置段落居中对齐
-            paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            with Image.open(image_path) as img:
+                image_format, mode, (width, height) = img.format, img.mode, img.size
+                img.verify()
             
-            self.log_output(f"成功插入图片: {image_path}")
-            return True
+            if image_format not in SUPPORTED_IMAGE_FORMATS:
+                issues.append(("错误", f"格式不支持: {image_format}"))
+                return issues
             
-        except FileNotFoundError:
-            self.log_output(f"图片文件未找到: {image_path}")
-            paragraph.clear()
-            paragraph.text = f"[图片文件未找到: {os.path.basename(image_path)}]"
-            return False
+            expected_format = IMAGE_EXTENSION_FORMATS.get(os.path.splitext(image_path)[1].lower())
+            if expected_format and expected_format != image_format:
+                issues.append(("警告", f"扩展名与实际格式不符（实际为{image_format}）"))
+            if mode == "CMYK":
+                issues.append(("警告", "CMYK颜色模式，部分软件中可能显示异常"))
+            
+            if width * height > LARGE_IMAGE_PIXELS:
+                issues.append(("警告", f"像素过大（{width}×{height}）"))
+            else:
+                # verify只检查文件结构，完整解码一次以发现截断或损坏的数据
+                with Image.open(image_path) as img:
+                    img.load()
         except Exception as e:
-            self.log_output(f"插入图片失败: {image_path}, 错误: {str(e)}")
-            # 如果插入失败，显示错误文本
-            paragraph.clear()
-            paragraph.text = f"[图片插入失败: {os.path.basename(image_path) if image_path else '未知'} - {str(e)}]"
-            return False
+            issues.append(("错误", f"无法解码: {e}"))
+        return issues
     
-    def calculate_similarity(self, str1: str, str2: str) -> float:
-        """计算字符串相似度"""
-        if not str1 or not str2:
-            return 0.0
+    def preflight_check_images(self, export_data: pd.DataFrame, export_groups: List[List[int]],
+                               image_mappings: list) -> bool:
+        """导出前检查每个文档用到的图片，有问题时显示报告并询问是否继续，返回是否继续导出"""
+        self.log_output("=== 开始检查图片 ===")
+        first_positions = [positions[0] for positions in export_groups]
+        
+        # 并行查找每个文档的图片，再对不重复的图片文件并行检查
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            row_images = list(executor.map(
+                lambda position: self.prefetch_row_paths(image_mappings, export_data.iloc[position],
+                                                         export_data.index[position]),
+                first_positions))
+            image_paths = sorted({image_path for paths in row_images for mapping_paths in paths.values()
+                                  for image_path in mapping_paths})
+            file_issues = dict(zip(image_paths, executor.map(self.validate_image_file, image_paths)))
+        
+        report = []  # (行号, 图片占位符, 图片文件, 级别, 问题)
+        for position, paths in zip(first_positions, row_images):
+            row_number = export_data.index[position] + 1
+            for mapping_index, img_mapping in image_mappings:
+                mapping_paths = paths.get(mapping_index, [])
+                if not mapping_paths:
+                    report.append((row_number, img_mapping["placeholder"], "无", "错误", "未找到图片"))
+                    continue
+                for image_path in mapping_paths:
+                    for level, message in file_issues.get(image_path, []):
+                        report.append((row_number, img_mapping["placeholder"], os.path.basename(image_path), level, message))
+        
+        error_count = sum(1 for item in report if item[3] == "错误")
+        warning_count = len(report) - error_count
+        self.log_output(f"图片检查完成: 共 {len(image_paths)} 个图片文件，错误 {error_count} 个，警告 {warning_count} 个")
+        if not report:
+            return True
         
-        # 转换为小写并去除特殊字符（支持Unicode字符）
-        str1 = re.sub(r'[^\w\s\u4e00-\u9fff]', '', str1.lower(), flags=re.UNICODE).strip()
-        str2 = re.sub(r'[^\w\s\u4e00-\u9fff]', '', str2.lower(), flags=re.UNICODE).strip()
+        # 显示检查报告
+        report_window = tk.Toplevel(self.root)
+        report_window.title("图片检查报告")
+        report_window.geometry("800x500")
+        report_window.transient(self.root)
         
-        if str1 == str2:
-            return 1.0
+        ttk.Label(report_window, text=f"发现 {error_count} 个错误、{warning_count} 个警告", 
+                 font=("Arial", 12, "bold")).pack(pady=10)
         
-        # 使用difflib计算相似度
-        similarity = difflib.SequenceMatcher(None, str1, str2).ratio()
-
-        # print(str1,str2,similarity)
+        report_frame = ttk.Frame(report_window)
+        report_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=(0, 10))
         
-        # 包含关系加权
-        if str1 in str2 or str2 in str1:
-            min_len = min(len(str1), len(str2))
-            max_len = max(len(str1), len(str2))
-            if min_len / max_len > 0.5:
-                similarity = max(similarity, 0.8)
+        columns = ("行号", "图片占位符", "图片文件", "级别", "问题")
+        tree = ttk.Treeview(report_frame, columns=columns, show="headings", height=15)
+        for column, width in zip(columns, (60, 120, 180, 60, 300)):
+            tree.heading(column, text=column)
+            tree.column(column, width=width)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
-        return similarity
+        scrollbar = ttk.Scrollbar(report_frame, orient="vertical", command=tree.yview)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.configure(yscrollcommand=scrollbar.set)
+        
+        for item in report:
+            tree.insert("", "end", values=item)
+            self.log_output(f"  第 {item[0]} 行 {item[1]}: {item[2]} - {item[3]}: {item[4]}")
+        
+        ttk.Button(report_window, text="关闭", command=report_window.destroy).pack(pady=10)
+        
+        proceed = messagebox.askyesno("图片检查", 
+            f"图片检查发现 {error_count} 个错误、{warning_count} 个警告（详见检查报告）。\n"
+            f"有错误的图片在文档中会显示为提示文字。\n\n是否继续导出？", parent=report_window)
+        if not proceed:
+            self.log_output("根据图片检查结果取消导出")
+        return proceed
     
-    def auto_match_fields(self):
-        """自动匹配字段"""
+    def get_image_prefetch_count(self) -> int:
+        """获取图片预读的文档数，0表示不预读"""
         try:
-            if self.excel_data is None or not self.placeholders:
-                messagebox.showwarning("警告", "请先导入Excel数据和Word模板！")
-                return
-            
-            matched_count = 0
-            excel_columns = list(self.excel_data.columns)
-            
-            for i, data in enumerate(self.mapping_data):
-                placeholder = data["placeholder"]
-                # 提取占位符中的字段名（去掉{}符号）
-                clean_placeholder = placeholder.strip('{}【】《》[]<>')
-                
-                matched_field = None
-                
-                if self.exact_match_var.get():
-                    # 精准匹配
-                    for column in excel_columns:
-                        if column.lower() == clean_placeholder.lower():
-                            matched_field = column
-                            break
-                else:
-                    # 模糊匹配
-                    best_similarity = 0.0
-                    for column in excel_columns:
-                        similarity = self.calculate_similarity(clean_placeholder, column)
-                        if similarity > 0.6 and similarity > best_similarity:
-                            best_similarity = similarity
-                            matched_field = column
-                
-                if matched_field:
-                    self.mapping_data[i]["mapping"] = matched_field
-                    matched_count += 1
-            
-            self.update_mapping_tree()
-            
-            match_mode = "精准匹配" if self.exact_match_var.get() else "模糊匹配"
-            messagebox.showinfo("完成", 
-                f"自动匹配完成！\n匹配模式：{match_mode}\n成功匹配：{matched_count}个占位符\n总占位符：{len(self.placeholders)}个")
-            
-        except Exception as e:
-            messagebox.showerror("错误", f"自动匹配失败：{str(e)}")
+            return max(0, int(self.image_prefetch_var.get()))
+        except ValueError:
+            self.log_output(f"图片预读文档数设置无效: {self.image_prefetch_var.get()}，不预读图片")
+            return 0
     
-    def is_number(self, value) -> bool:
-        """检查值是否为数字"""
+    def prefetch_row_paths(self, image_mappings: list, data_row: pd.Series, row_index: int) -> dict:
+        """查找一个文档需要的图片路径，返回 {图片映射序号: [图片路径]}（可在后台线程中运行）"""
+        paths = {}
+        for mapping_index, img_mapping in image_mappings:
+            try:
+                paths[mapping_index] = self.resolve_mapping_images(img_mapping, data_row, row_index)
+            except Exception as e:
+                self.log_output(f"查找图片失败（原始数据第 {row_index + 1} 行）: {e}")
+                paths[mapping_index] = []
+        return paths
+    
+    def prefetch_row_images(self, image_mappings: list, data_row: pd.Series, row_index: int) -> dict:
+        """在后台线程中查找并读取一个文档需要的图片，返回 {图片映射序号: ([图片路径], {图片路径: 图片内容})}
+        
+        只访问映射数据和文件系统，不读取界面变量；已在图片缓存中的图片不再读取。
+        """
+        results = {}
+        for mapping_index, img_mapping in image_mappings:
+            try:
+                image_paths = self.resolve_mapping_images(img_mapping, data_row, row_index)
+                contents = {}
+                for image_path in image_paths:
+                    stat = os.stat(image_path)
+                    if (image_path, stat.st_mtime_ns, stat.st_size) not in self.image_bytes_cache:
+                        with open(image_path, "rb") as f:
+                            contents[image_path] = f.read()
+                results[mapping_index] = (image_paths, contents)
+            except Exception as e:
+                # 预读失败时渲染阶段会重新查找
+                self.log_output(f"预读图片失败（原始数据第 {row_index + 1} 行）: {e}")
+        return results
+    
+    def use_prefetched_images(self, results: dict):
+        """设置当前文档使用的预读图片，传入空字典时清除"""
+        self.prefetched_image_paths = {mapping_index: image_paths for mapping_index, (image_paths, _) in results.items()}
+        self.prefetched_image_bytes = {}
+        for _, contents in results.values():
+            self.prefetched_image_bytes.update(contents)
+    
+    def get_mapping_images(self, mapping_index: int, img_mapping: dict, data_row: pd.Series,
+                           row_index: int) -> List[str]:
+        """获取图片映射对应的图片路径列表，优先使用预读结果"""
+        if mapping_index in self.prefetched_image_paths:
+            return self.prefetched_image_paths[mapping_index]
+        return self.resolve_mapping_images(img_mapping, data_row, row_index)
+    
+    def get_docx_image(self, image_path: str) -> tuple:
+        """读取并解析图片（尺寸、DPI、格式和EXIF方向），返回 (docx图片对象, EXIF方向)
+        
+        多个文档使用同一图片时只读取和解析一次，超过容量时淘汰最久未使用的图片。
+        """
+        from docx.image.image import Image as DocxImage
+        
+        stat = os.stat(image_path)
+        cache_key = (image_path, stat.st_mtime_ns, stat.st_size)
+        cached = self.image_bytes_cache.get(cache_key)
+        if cached is not None:
+            self.image_bytes_cache.move_to_end(cache_key)
+            return cached
+        
+        content = self.prefetched_image_bytes.get(image_path)
+        if content is None:
+            with open(image_path, "rb") as f:
+                content = f.read()
+        
+        image = DocxImage.from_blob(content)
         try:
-            float(value)
-            return True
-        except (ValueError, TypeError):
-            return False
+            with Image.open(io.BytesIO(content)) as img:
+                orientation = img.getexif().get(0x0112, 1)
+        except Exception as e:
+            self.log_output(f"读取图片EXIF方向失败: {image_path}, 错误: {e}")
+            orientation = 1
+        cached = (image, orientation)
+        
+        # 低内存模式下不缓存图片
+        if not self.low_memory_mode_var.get() and len(content) <= self.image_bytes_cache_max_bytes:
+            self.image_bytes_cache[cache_key] = cached
+            self.image_bytes_cache_size += len(content)
+            while self.image_bytes_cache_size > self.image_bytes_cache_max_bytes:
+                _, (evicted, _) = self.image_bytes_cache.popitem(last=False)
+                self.image_bytes_cache_size -= len(evicted.blob)
+        return cached
+    
+    def add_picture_to_run(self, run, image_path: str, width, height=None):
+        """在run中插入图片，复用已解析的图片；带EXIF方向标记的图片通过图片的旋转、翻转属性摆正，不改动图片内容
+        
+        width、height为显示的宽高（height为空时按比例计算）。
+        """
+        from docx.opc.constants import RELATIONSHIP_TYPE as RT
+        from docx.opc.packuri import PackURI
+        from docx.oxml.ns import qn
+        from docx.oxml.shape import CT_Inline
+        from docx.parts.image import ImagePart
+        
+        image, orientation = self.get_docx_image(image_path)
+        rotation, flip_h, flip_v = (0, False, False)
+        if self.exif_transpose_var.get():
+            rotation, flip_h, flip_v = EXIF_ORIENTATION_TRANSFORMS.get(orientation, (0, False, False))
+        
+        # 同一文档中重复使用的图片只保存一份
+        part = run.part
+        image_parts = part.package.image_parts
+        image_part = next((existing for existing in image_parts if existing.sha1 == image.sha1), None)
+        if image_part is None:
+            used_names = {str(existing.partname) for existing in part.package.iter_parts()}
+            number = len(image_parts) + 1
+            while f"/word/media/image{number}.{image.ext}" in used_names:
+                number += 1
+            image_part = ImagePart.from_image(image, PackURI(f"/word/media/image{number}.{image.ext}"))
+            image_parts.append(image_part)
+        r_id = part.relate_to(image_part, RT.IMAGE)
+        
+        # 旋转90度时图片框的宽高与显示的宽高互换
+        rotated = rotation in (5400000, 16200000)
+        if rotated:
+            cx, cy = image.scaled_dimensions(height, width)
+        else:
+            cx, cy = image.scaled_dimensions(width, height)
+        
+        inline = CT_Inline.new_pic_inline(part.next_id, r_id, image.filename, cx, cy)
+        if rotation or flip_h or flip_v:
+            xfrm = inline.find(".//" + qn("a:xfrm"))
+            if rotation:
+                xfrm.set("rot", str(rotation))
+            if flip_h:
+                xfrm.set("flipH", "1")
+            if flip_v:
+                xfrm.set("flipV", "1")
+            if rotated:
+                # 行内图片按旋转后的外框排版
+                effect_extent = inline.makeelement(qn("wp:effectExtent"), {
+                    "l": str((cy - cx) // 2), "t": str((cx - cy) // 2),
+                    "r": str((cy - cx) // 2), "b": str((cx - cy) // 2),
+                })
+                inline.find(qn("wp:extent")).addnext(effect_extent)
+        run._r.add_drawing(inline)
+    
+    def get_render_settings_digest(self) -> str:
+        """模板内容和全部渲染设置的摘要，每次导出或预览只计算一次"""
+        settings_text = json.dumps({
+            "template": self.get_file_digest(self.word_template_path),
+            "settings": self.collect_render_settings(),
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(settings_text.encode("utf-8")).hexdigest()
+    
+    def get_render_cache_key(self, settings_digest: str, data_row: pd.Series, row_index: int,
+                             prepared_values: Dict[str, str],
+                             loop_values: Optional[List[Dict[str, str]]] = None,
+                             compression_level: int = 6) -> tuple:
+        """根据设置摘要、行数据和图片文件生成渲染缓存键
+        
+        返回 (缓存键, {图片映射序号: [图片路径]})，查找到的图片在渲染时直接使用，不再重复查找。
+        """
+        # 图片按实际匹配到的文件及其修改时间参与计算
+        image_paths = {}
+        images = []
+        for mapping_index, img_mapping in enumerate(self.image_mapping_data):
+            if not img_mapping.get("placeholder"):
+                continue
+            paths = image_paths[mapping_index] = self.get_mapping_images(mapping_index, img_mapping, data_row, row_index)
+            for image_path in paths:
+                stat = os.stat(image_path)
+                images.append([mapping_index, image_path, stat.st_mtime_ns, stat.st_size])
+            if not paths:
+                images.append([mapping_index, None])
+        
+        key_data = {
+            "settings": settings_digest,
+            "row": {str(column): str(value) for column, value in data_row.items()},
+            "values": prepared_values,
+            "loop": loop_values,
+            "images": images,
+            "compression": compression_level,
+        }
+        key_text = json.dumps(key_data, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(key_text.encode("utf-8")).hexdigest(), image_paths
+    
+    def get_cached_render(self, cache_key: str) -> Optional[bytes]:
+        """从内存或磁盘缓存中读取渲染结果"""
+        content = self.render_cache.get(cache_key)
+        if content is not None:
+            self.render_cache.move_to_end(cache_key)
+            return content
+        
+        if self.render_cache_disk_var.get():
+            cache_path = os.path.join(self.render_cache_dir, f"{cache_key}.docx")
+            try:
+                with open(cache_path, "rb") as f:
+                    content = f.read()
+                os.utime(cache_path)  # 更新最近使用时间
+                self.store_cached_render(cache_key, content, write_disk=False)
+                return content
+            except OSError:
+                pass
+        return None
+    
+    def store_cached_render(self, cache_key: str, content: bytes, write_disk: bool = True):
+        """保存渲染结果，超过容量时淘汰最久未使用的缓存"""
+        # 低内存模式下不在内存中保留文档内容
+        if not self.low_memory_mode_var.get() and len(content) <= self.render_cache_max_bytes:
+            if cache_key in self.render_cache:
+                self.render_cache_bytes -= len(self.render_cache.pop(cache_key))
+            self.render_cache[cache_key] = content
+            self.render_cache_bytes += len(content)
+            while self.render_cache_bytes > self.render_cache_max_bytes:
+                _, evicted = self.render_cache.popitem(last=False)
+                self.render_cache_bytes -= len(evicted)
+        
+        if write_disk and self.render_cache_disk_var.get():
+            try:
+                os.makedirs(self.render_cache_dir, exist_ok=True)
+                with open(os.path.join(self.render_cache_dir, f"{cache_key}.docx"), "wb") as f:
+                    f.write(content)
+                self.render_cache_disk_writes += 1
+                if self.render_cache_disk_writes % 50 == 0:
+                    self.prune_disk_render_cache()
+            except OSError as e:
+                self.log_output(f"写入磁盘渲染缓存失败: {e}")
     
-    def format_number_value(self, value: str) -> str:
-        """根据设置格式化数字值"""
+    def prune_disk_render_cache(self):
+        """磁盘缓存超过数量上限时删除最久未使用的文件"""
         try:
-            # 检查是否为数字
-            if not self.is_number(value):
-                return value
-            
-            # 转换为浮点数
-            num_value = float(value)
-            
-            # 根据用户设置决定格式化方式
-            if self.enable_custom_decimal_var.get():
-                # 使用自定义小数位数
-                try:
-                    decimal_places = int(self.custom_decimal_var.get())
-                    formatted_value = f"{num_value:.{decimal_places}f}"
-                except ValueError:
-                    # 如果自定义小数位数无效，使用原值
-                    formatted_value = str(num_value)
-            else:
-                # 使用预设格式
-                format_option = self.number_format_var.get()
-                if format_option == "保留原格式":
-                    formatted_value = str(num_value)
-                elif format_option == "取整数":
-                    formatted_value = str(int(round(num_value)))
-                elif format_option == "保留1位小数":
-                    formatted_value = f"{num_value:.1f}"
-                elif format_option == "保留2位小数":
-                    formatted_value = f"{num_value:.2f}"
-                elif format_option == "保留3位小数":
-                    formatted_value = f"{num_value:.3f}"
-                else:
-                    formatted_value = str(num_value)
-            
-            # 添加千分位分隔符（如果启用）
-            if self.use_thousands_separator_var.get():
+            entries = [entry for entry in os.scandir(self.render_cache_dir) if entry.name.endswith(".docx")]
+            if len(entries) <= self.render_cache_max_files:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:len(entries) - self.render_cache_max_files]:
+                os.remove(entry.path)
+        except OSError as e:
+            self.log_output(f"清理磁盘渲染缓存失败: {e}")
+    
+    def clear_render_cache(self):
+        """清空内存和磁盘渲染缓存"""
+        self.render_cache.clear()
+        self.render_cache_bytes = 0
+        self.last_preview_key = None
+        
+        removed = 0
+        if os.path.isdir(self.render_cache_dir):
+            for entry in os.scandir(self.render_cache_dir):
                 try:
-                    # 分离整数和小数部分
-                    if '.' in formatted_value:
-                        integer_part, decimal_part = formatted_value.split('.')
-                        # 为整数部分添加千分位分隔符
-                        integer_part = f"{int(integer_part):,}"
-                        formatted_value = f"{integer_part}.{decimal_part}"
-                    else:
-                        formatted_value = f"{int(float(formatted_value)):,}"
-                except:
-                    # 如果添加千分位分隔符失败，返回原格式化值
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
                     pass
-            
-            self.log_output(f"数字格式化: {value} -> {formatted_value}")
-            return formatted_value
-            
-        except Exception as e:
-            self.log_output(f"数字格式化失败: {value}, 错误: {str(e)}")
-            return value
-
-    def process_math_expression(self, expression: str, data_row: pd.Series) -> str:
-        """处理数学表达式"""
+        
+        self.log_output(f"渲染缓存已清空，删除磁盘缓存文件 {removed} 个")
+        messagebox.showinfo("成功", "渲染缓存已清空！")
+    
+    def render_document_content(self, data_row: pd.Series, row_index: int, prepared_values: Dict[str, str],
+                                loop_values: Optional[List[Dict[str, str]]] = None,
+                                compression_level: int = 6, settings_digest: Optional[str] = None,
+                                render_key: Optional[tuple] = None) -> bytes:
+        """渲染文档并返回docx内容，启用渲染缓存时复用内容未变化的结果
+        
+        settings_digest为本次导出的设置摘要，render_key为已计算的 (缓存键, 图片路径)，为空时在此计算。
+        """
+        cache_key = None
+        image_paths = None
+        if self.render_cache_var.get():
+            if render_key is None:
+                if settings_digest is None:
+                    settings_digest = self.get_render_settings_digest()
+                render_key = self.get_render_cache_key(settings_digest, data_row, row_index, prepared_values,
+                                                       loop_values, compression_level)
+            cache_key, image_paths = render_key
+            content = self.get_cached_render(cache_key)
+            if content is not None:
+                self.log_output(f"使用渲染缓存（原始数据第 {row_index + 1} 行）")
+                return content
+        
+        # 计算缓存键时已查找到的图片在渲染时直接使用
+        previous_image_paths = self.prefetched_image_paths
+        if image_paths is not None:
+            self.prefetched_image_paths = image_paths
         try:
-            result = expression
-            
-            # 替换字段名为实际值
-            for column in data_row.index:
-                if column in result:
-                    value = str(data_row[column]) if pd.notna(data_row[column]) else "0"
-                    result = result.replace(column, value)
-            
-            # 计算表达式
-            try:
-                computed_value = eval(result)
-                # 对计算结果进行数字格式化
-                return self.format_number_value(str(computed_value))
-            except:
-                return result
-                
-        except:
-            return expression
+            doc = self.load_template_document()
+            self.record_memory_stage("加载模板")
+            self.apply_mapping_to_document(doc, data_row, row_index, prepared_values, loop_values)
+            self.record_memory_stage("应用映射")
+        finally:
+            self.prefetched_image_paths = previous_image_paths
+        
+        content = self.save_document_content(doc, compression_level)
+        doc = None
+        
+        if cache_key is not None:
+            self.store_cached_render(cache_key, content)
+        return content
     
     def replace_text_preserve_style(self, paragraph, placeholder, value):
         """在段落中替换文本，保持原有样式"""
@@ -2622,7 +4999,7 @@ class Excel2WordConverter:
             self.log_output(f"替代完整复制方法失败: {e}")
             return False
 
-    def merge_documents_completely(self, file_paths, output_path):
+    def merge_documents_completely(self, file_paths, output_path, compression_level: int = 6):
         """完整合并多个文档"""
         try:
             self.log_output("=== 开始完整文档合并 ===")
@@ -2649,6 +5026,10 @@ class Excel2WordConverter:
                     # 完整复制文档结构
                     self.copy_document_structure(doc_to_merge, merged_doc)
                     
+                    # 低内存模式下复制完成后立即释放被合并的文档
+                    if self.low_memory_mode_var.get():
+                        doc_to_merge = None
+                    
                     self.log_output(f"第 {i+1} 个文档合并完成")
                     
                 except Exception as doc_error:
@@ -2656,7 +5037,7 @@ class Excel2WordConverter:
                     raise doc_error
             
             # 保存合并文档
-            merged_doc.save(output_path)
+            self.save_document_file(merged_doc, output_path, compression_level)
             self.log_output(f"合并文档保存至: {output_path}")
             self.log_output("=== 完整文档合并完成 ===")
             
@@ -2772,65 +5153,230 @@ class Excel2WordConverter:
         except Exception as e:
             self.log_output(f"复制表格时出错: {e}")
 
-    def replace_placeholder_in_element(self, element, placeholder, value):
-        """在文档元素中替换占位符"""
-        try:
-            # 处理段落
-            if hasattr(element, 'paragraphs'):
-                for paragraph in element.paragraphs:
-                    if placeholder in paragraph.text:
-                        # 使用保持样式的替换方法
-                        self.replace_text_preserve_style(paragraph, placeholder, value)
-            
-            # 处理表格
-            if hasattr(element, 'tables'):
-                for table in element.tables:
-                    for row in table.rows:
-                        for cell in row.cells:
-                            # 处理表格单元格中的每个段落
-                            for cell_paragraph in cell.paragraphs:
-                                if placeholder in cell_paragraph.text:
-                                    self.replace_text_preserve_style(cell_paragraph, placeholder, value)
-                            # 递归处理表格中的内容
-                            self.replace_placeholder_in_element(cell, placeholder, value)
-            
-            # 处理形状和文本框
-            if hasattr(element, '_element'):
-                try:
-                    from docx.oxml.ns import qn
-                    
-                    # 查找所有文本框和形状中的文本
-                    shapes = element._element.xpath('.//w:txbxContent//w:t')
-                    for shape in shapes:
-                        if shape.text and placeholder in shape.text:
-                            shape.text = shape.text.replace(placeholder, value)
-                    
-                    # 查找所有绘图对象中的文本
-                    drawings = element._element.xpath('.//w:drawing//w:t')
-                    for drawing in drawings:
-                        if drawing.text and placeholder in drawing.text:
-                            drawing.text = drawing.text.replace(placeholder, value)
+    def get_group_codes(self, data: pd.DataFrame) -> np.ndarray:
+        """返回每行所属分组的编号（按首次出现顺序），未设置分组时每行为一组"""
+        group_field = self.group_field_var.get()
+        if not group_field or group_field not in data.columns:
+            return np.arange(len(data))
+        
+        column = data[group_field]
+        codes, _ = pd.factorize(column.astype(object).where(column.notna(), ""))
+        return codes
+    
+    def get_export_groups(self, export_data: pd.DataFrame) -> List[List[int]]:
+        """按分组字段划分导出数据，返回每个文档对应的行位置列表（按首次出现顺序）"""
+        group_field = self.group_field_var.get()
+        if not group_field or group_field not in export_data.columns:
+            return [[position] for position in range(len(export_data))]
+        
+        codes = self.get_group_codes(export_data)
+        order = np.argsort(codes, kind="stable")
+        boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+        return [group.tolist() for group in np.split(order, boundaries)]
+    
+    def expand_loop_rows(self, doc: Document, loop_values: List[Dict[str, str]]):
+        """将含循环标记的表格行按组内每行数据复制一份并填充"""
+        import copy
+        from docx.oxml.ns import qn
+        from docx.text.paragraph import Paragraph
+        
+        paragraph_tag = qn("w:p")
+        row_tag = qn("w:tr")
+        
+        # 找出含循环标记的表格行（按标记所在段落最近的表格行）
+        loop_rows = []
+        for paragraph_element in doc.element.body.iter(paragraph_tag):
+            paragraph = Paragraph(paragraph_element, doc.part)
+            if LOOP_ROW_MARKER not in paragraph.text:
+                continue
+            self.replace_text_preserve_style(paragraph, LOOP_ROW_MARKER, "")
+            
+            row_element = paragraph_element.getparent()
+            while row_element is not None and row_element.tag != row_tag:
+                row_element = row_element.getparent()
+            if row_element is None:
+                self.log_output(f"警告：循环标记 {LOOP_ROW_MARKER} 不在表格行中，已忽略")
+            elif row_element not in loop_rows:
+                loop_rows.append(row_element)
+        
+        for row_element in loop_rows:
+            for number, values in enumerate(loop_values, 1):
+                new_row = copy.deepcopy(row_element)
+                for paragraph_element in new_row.iter(paragraph_tag):
+                    paragraph = Paragraph(paragraph_element, doc.part)
+                    text = paragraph.text
+                    if not text:
+                        continue
+                    for placeholder in self.placeholder_pattern.findall(text):
+                        value = values.get(placeholder)
+                        if value is not None:
+                            self.replace_text_preserve_style(paragraph, placeholder, value)
+                    for _ in range(text.count(LOOP_ROW_NUMBER)):
+                        self.replace_text_preserve_style(paragraph, LOOP_ROW_NUMBER, str(number))
+                row_element.addprevious(new_row)
+            
+            row_element.getparent().remove(row_element)
+        
+        if loop_rows:
+            self.log_output(f"循环表格行: {len(loop_rows)} 行模板，每行重复 {len(loop_values)} 次")
+    
+    def get_story_parts(self, doc: Document) -> list:
+        """返回包含文本内容的文档部件：正文（含表格、文本框）以及页眉、页脚"""
+        from docx.opc.constants import RELATIONSHIP_TYPE as RT
+        
+        parts = [doc.part]
+        for rel in doc.part.rels.values():
+            if rel.is_external or rel.reltype not in (RT.HEADER, RT.FOOTER):
+                continue
+            if hasattr(rel.target_part, "element"):
+                parts.append(rel.target_part)
+        return parts
+    
+    def remove_paragraph_element(self, paragraph_element):
+        """删除段落；表格单元格中的最后一个段落只清空内容（单元格至少需要一个段落）"""
+        from docx.oxml.ns import qn
+        
+        parent = paragraph_element.getparent()
+        if parent is None:
+            return
+        if parent.tag == qn("w:tc") and len(parent.findall(qn("w:p"))) == 1:
+            for child in list(paragraph_element):
+                if child.tag != qn("w:pPr"):
+                    paragraph_element.remove(child)
+            return
+        parent.remove(paragraph_element)
+    
+    def apply_conditional_blocks(self, doc: Document, prepared_values: Dict[str, str], data_row: pd.Series):
+        """处理条件区域：条件不成立时删除区域内容，成立时只删除标记
+        
+        - 标记在同一段落内：删除标记之间的文字
+        - 标记在同级段落中：删除两个标记之间的段落和表格
+        - 标记在同一表格行的不同单元格中：删除整行
+        """
+        from docx.oxml.ns import qn
+        from docx.text.paragraph import Paragraph
+        
+        paragraph_tag = qn("w:p")
+        row_tag = qn("w:tr")
+        
+        def nearest_row(element):
+            while element is not None and element.tag != row_tag:
+                element = element.getparent()
+            return element
+        
+        def strip_markers(paragraph_element, part, markers):
+            paragraph = Paragraph(paragraph_element, part)
+            for marker in markers:
+                self.replace_text_preserve_style(paragraph, marker, "")
+            if not paragraph.text.strip() and not paragraph_element.findall(".//" + qn("w:drawing")):
+                self.remove_paragraph_element(paragraph_element)
+        
+        for part in self.get_story_parts(doc):
+            # 按文档顺序配对开始和结束标记，支持嵌套
+            stack = []
+            blocks = []
+            for paragraph_element in list(part.element.iter(paragraph_tag)):
+                text = Paragraph(paragraph_element, part).text
+                if "{{#if" not in text and CONDITION_END_MARKER not in text:
+                    continue
+                for match in CONDITION_MARKER_PATTERN.finditer(text):
+                    if match.group(1):
+                        stack.append((paragraph_element, match.group(0), match.group(1)))
+                    elif stack:
+                        start_element, marker, condition = stack.pop()
+                        blocks.append((start_element, marker, condition, paragraph_element))
+                    else:
+                        self.log_output(f"警告：多余的条件结束标记 {CONDITION_END_MARKER}，已删除")
+                        strip_markers(paragraph_element, part, [CONDITION_END_MARKER])
+            
+            for start_element, marker, condition in stack:
+                self.log_output(f"警告：条件 {condition} 缺少结束标记 {CONDITION_END_MARKER}，按成立处理")
+                strip_markers(start_element, part, [marker])
+            
+            # 内层区域先结束，先处理
+            for start_element, marker, condition, end_element in blocks:
+                if start_element.getparent() is None or end_element.getparent() is None:
+                    # 已随外层区域删除
+                    continue
                 
-                except Exception as e:
-                    # 如果处理特殊元素失败，继续处理
-                    pass
+                value = prepared_values.get(marker)
+                if value is None:
+                    value = str(bool(self.evaluate_condition(condition, pd.DataFrame([data_row])).iloc[0]))
+                keep = value == "True"
+                self.log_output(f"条件区域 {condition}: {'成立' if keep else '不成立'}")
+                
+                if keep:
+                    strip_markers(start_element, part, [marker])
+                    strip_markers(end_element, part, [CONDITION_END_MARKER])
+                elif start_element is end_element:
+                    paragraph = Paragraph(start_element, part)
+                    text = paragraph.text
+                    begin = text.find(marker)
+                    end = text.find(CONDITION_END_MARKER, begin) + len(CONDITION_END_MARKER)
+                    self.replace_text_preserve_style(paragraph, text[begin:end], "")
+                    if not paragraph.text.strip() and not start_element.findall(".//" + qn("w:drawing")):
+                        self.remove_paragraph_element(start_element)
+                elif start_element.getparent() is end_element.getparent():
+                    element = start_element
+                    while element is not None:
+                        next_element = element.getnext()
+                        if element is end_element:
+                            self.remove_paragraph_element(element)
+                            break
+                        if element.tag == paragraph_tag:
+                            self.remove_paragraph_element(element)
+                        else:
+                            element.getparent().remove(element)
+                        element = next_element
+                elif nearest_row(start_element) is not None and nearest_row(start_element) is nearest_row(end_element):
+                    row_element = nearest_row(start_element)
+                    row_element.getparent().remove(row_element)
+                else:
+                    self.log_output(f"警告：条件 {condition} 的开始和结束标记不在同一层级，只删除标记")
+                    strip_markers(start_element, part, [marker])
+                    strip_markers(end_element, part, [CONDITION_END_MARKER])
+    
+    def replace_placeholders_in_document(self, doc: Document, prepared_values: Dict[str, str]):
+        """遍历文档各部件的段落一次，用占位符扫描器找出段落中的占位符并替换"""
+        from docx.oxml.ns import qn
+        from docx.text.paragraph import Paragraph
         
-        except Exception as e:
-            # 如果遇到错误，继续处理其他内容
-            pass
+        paragraph_tag = qn("w:p")
+        for part in self.get_story_parts(doc):
+            try:
+                for paragraph_element in list(part.element.iter(paragraph_tag)):
+                    paragraph = Paragraph(paragraph_element, part)
+                    text = paragraph.text
+                    if not text:
+                        continue
+                    
+                    # 同一段落中重复出现的占位符逐个替换
+                    for placeholder in self.placeholder_pattern.findall(text):
+                        value = prepared_values.get(placeholder)
+                        if value is not None:
+                            self.replace_text_preserve_style(paragraph, placeholder, value)
+            
+            except Exception as replace_error:
+                # 如果某个部件替换失败，继续处理其他部件
+                self.log_output(f"替换占位符时出错({part.partname}): {replace_error}")
     
-    def apply_mapping_to_document(self, doc: Document, data_row: pd.Series, row_index: int = 0):
-        """将映射应用到文档"""
+    def apply_mapping_to_document(self, doc: Document, data_row: pd.Series, row_index: int = 0,
+                                  prepared_values: Optional[Dict[str, str]] = None,
+                                  loop_values: Optional[List[Dict[str, str]]] = None):
+        """将映射应用到文档（prepared_values为预计算的 占位符->替换值，为空时按当前行计算；
+        loop_values为循环表格行使用的组内各行替换值，为空时只使用当前行）"""
         try:
-            # 收集所有图片占位符，避免被文本处理逻辑替换
-            image_placeholders = set()
-            for img_mapping in self.image_mapping_data:
-                if img_mapping.get("placeholder"):
-                    image_placeholders.add(img_mapping["placeholder"])
+            if prepared_values is None:
+                row_frame = pd.DataFrame([data_row], index=[row_index])
+                prepared_values = self.prepare_mapping_values(row_frame).iloc[0].to_dict()
+            
+            # 先处理条件区域，再展开循环表格行，其余占位符使用组内第一行的值
+            self.apply_conditional_blocks(doc, prepared_values, data_row)
+            self.expand_loop_rows(doc, loop_values if loop_values is not None else [prepared_values])
             
             # 处理图片占位符（先处理图片，避免被文本替换）
             self.log_output(f"开始处理图片占位符，共 {len(self.image_mapping_data)} 个映射")
-            for img_mapping in self.image_mapping_data:
+            for mapping_index, img_mapping in enumerate(self.image_mapping_data):
                 placeholder = img_mapping["placeholder"]
                 
                 if not placeholder:
@@ -2840,10 +5386,17 @@ class Excel2WordConverter:
                 self.log_output(f"映射规则: {img_mapping['mapping_rule']}")
                 self.log_output(f"图片文件夹: {img_mapping['folder']}")
                 
-                # 获取对应的图片路径
-                image_path = self.get_image_for_row(img_mapping, data_row, row_index)
+                # 获取对应的图片路径（导出时可能已由预读线程找到）
+                image_paths = self.get_mapping_images(mapping_index, img_mapping, data_row, row_index)
+                image_path = image_paths[0] if image_paths else None
                 self.log_output(f"找到图片路径: {image_path}")
                 
+                # 多图模式：把全部图片排成表格
+                if img_mapping.get("gallery", False) and image_paths:
+                    if not self.insert_image_gallery(doc, img_mapping, image_paths):
+                        self.log_output(f"警告：占位符 {placeholder} 在文档中未找到！")
+                    continue
+                
                 if image_path and os.path.exists(image_path):
                     self.log_output(f"图片文件存在，开始替换占位符")
                     image_replaced = False
@@ -2931,101 +5484,8 @@ class Excel2WordConverter:
                                     if placeholder in cell_paragraph.text:
                                         self.replace_text_preserve_style(cell_paragraph, placeholder, error_text)
             
-            # 处理文本占位符（跳过已处理的图片占位符）
-            for mapping in self.mapping_data:
-                placeholder = mapping["placeholder"]
-                match_pattern = mapping["mapping"]
-                
-                if not placeholder:
-                    continue
-                
-                # 跳过图片占位符，避免重复处理
-                if placeholder in image_placeholders:
-                    self.log_output(f"跳过图片占位符的文本处理: {placeholder}")
-                    continue
-                
-                # 获取替换值
-                value = "0"  # 默认值
-                
-                if match_pattern:
-                    if any(op in match_pattern for op in ['+', '-', '*', '/']):
-                        # 数学表达式
-                        value = self.process_math_expression(match_pattern, data_row)
-                    elif match_pattern in data_row.index:
-                        # 直接字段映射
-                        cell_value = data_row[match_pattern]
-                        if pd.notna(cell_value):
-                            raw_value = str(cell_value)
-                            # 对字段值进行数字格式化
-                            value = self.format_number_value(raw_value)
-                        else:
-                            value = "0"
-                    else:
-                        # 固定文本
-                        value = match_pattern
-                
-                # 替换主文档中的占位符
-                for paragraph in doc.paragraphs:
-                    if placeholder in paragraph.text:
-                        self.replace_text_preserve_style(paragraph, placeholder, value)
-                
-                # 替换主文档表格中的占位符
-                for table in doc.tables:
-                    for row in table.rows:
-                        for cell in row.cells:
-                            # 处理表格单元格中的每个段落
-                            for cell_paragraph in cell.paragraphs:
-                                if placeholder in cell_paragraph.text:
-                                    self.replace_text_preserve_style(cell_paragraph, placeholder, value)
-                            # 递归处理表格中的内容
-                            self.replace_placeholder_in_element(cell, placeholder, value)
-                
-                # 替换页眉和页脚中的占位符
-                for section in doc.sections:
-                    # 替换页眉
-                    if section.header:
-                        self.replace_placeholder_in_element(section.header, placeholder, value)
-                    
-                    # 替换页脚
-                    if section.footer:
-                        self.replace_placeholder_in_element(section.footer, placeholder, value)
-                    
-                    # 替换首页页眉
-                    if hasattr(section, 'first_page_header') and section.first_page_header:
-                        self.replace_placeholder_in_element(section.first_page_header, placeholder, value)
-                    
-                    # 替换首页页脚
-                    if hasattr(section, 'first_page_footer') and section.first_page_footer:
-                        self.replace_placeholder_in_element(section.first_page_footer, placeholder, value)
-                    
-                    # 替换奇数页页眉
-                    if hasattr(section, 'even_page_header') and section.even_page_header:
-                        self.replace_placeholder_in_element(section.even_page_header, placeholder, value)
-                    
-                    # 替换奇数页页脚
-                    if hasattr(section, 'even_page_footer') and section.even_page_footer:
-                        self.replace_placeholder_in_element(section.even_page_footer, placeholder, value)
-                
-                # 替换形状和文本框中的占位符
-                try:
-                    from docx.oxml.ns import qn
-                    
-                    # 查找所有文本框
-                    for textbox in doc._element.xpath('.//w:txbxContent'):
-                        for paragraph in textbox.xpath('.//w:p'):
-                            for run in paragraph.xpath('.//w:t'):
-                                if run.text and placeholder in run.text:
-                                    run.text = run.text.replace(placeholder, value)
-                    
-                    # 查找所有绘图对象中的文本
-                    for drawing in doc._element.xpath('.//w:drawing'):
-                        for text_run in drawing.xpath('.//w:t'):
-                            if text_run.text and placeholder in text_run.text:
-                                text_run.text = text_run.text.replace(placeholder, value)
-                
-                except Exception as replace_error:
-                    # 如果替换特殊元素失败，继续处理
-                    self.log_output(f"替换特殊元素时出错: {replace_error}")
+            # 处理文本占位符（图片占位符不在预计算结果中，已跳过）
+            self.replace_placeholders_in_document(doc, prepared_values)
                     
         except Exception as e:
             messagebox.showerror("错误", f"应用映射失败：{str(e)}")
@@ -3058,22 +5518,40 @@ class Excel2WordConverter:
             self.log_output(f"Excel数据总行数: {len(self.excel_data)}")
             self.log_output(f"预览范围: {message}")
             
-            # 使用范围内第一行数据生成预览
-            doc = Document(self.word_template_path)
-            first_row = export_data.iloc[0]
+            # 使用范围内第一行数据（设置分组时为第一组）生成预览
+            first_group = export_data.iloc[self.get_export_groups(export_data)[0]]
+            first_row = first_group.iloc[0]
             
             # 获取该行在原始数据中的索引（用于文件名生成等）
-            original_index = export_data.index[0]
+            original_index = first_group.index[0]
             
             self.log_output(f"使用第 {original_index + 1} 行数据进行预览")
             self.log_output("开始应用映射...")
             
-            # 应用映射
-            self.apply_mapping_to_document(doc, first_row, original_index)
-            
-            # 保存到临时文件
+            # 应用映射（内容未变化时直接使用渲染缓存）
+            group_values = self.prepare_mapping_values(first_group).to_dict('records')
             temp_path = os.path.join(tempfile.gettempdir(), "preview_temp.docx")
-            doc.save(temp_path)
+            
+            compression_level = self.get_compression_level()
+            if self.render_cache_var.get():
+                render_key = self.get_render_cache_key(self.get_render_settings_digest(), first_row, original_index,
+                                                       group_values[0], group_values, compression_level)
+                cache_key = render_key[0]
+                if cache_key == self.last_preview_key and os.path.exists(temp_path):
+                    self.log_output("预览内容未变化，直接使用上次的预览文档")
+                else:
+                    content = self.render_document_content(first_row, original_index, group_values[0], group_values,
+                                                           compression_level, render_key=render_key)
+                    with open(temp_path, "wb") as f:
+                        f.write(content)
+                    self.last_preview_key = cache_key
+            else:
+                doc = self.load_template_document()
+                self.apply_mapping_to_document(doc, first_row, original_index, group_values[0], group_values)
+                
+                # 保存到临时文件
+                with open(temp_path, "wb") as f:
+                    f.write(self.save_document_content(doc, compression_level))
             
             self.log_output(f"预览文档已保存到: {temp_path}")
             self.log_output("=== 预览文档完成 ===")
@@ -3087,8 +5565,113 @@ class Excel2WordConverter:
         except Exception as e:
             messagebox.showerror("错误", f"预览生成失败：{str(e)}")
     
+    def profile_document_render(self):
+        """对第一行数据的渲染过程进行性能分析"""
+        try:
+            if not self.word_template_path:
+                messagebox.showwarning("警告", "请先导入Word模板！")
+                return
+            
+            if self.excel_data is None or len(self.excel_data) == 0:
+                messagebox.showwarning("警告", "请先导入Excel数据！")
+                return
+            
+            # 验证导出范围
+            is_valid, message = self.validate_export_range()
+            if not is_valid:
+                messagebox.showwarning("警告", f"导出范围设置有误：{message}")
+                return
+            
+            export_data = self.get_export_data_range()
+            if export_data is None or len(export_data) == 0:
+                messagebox.showwarning("警告", "没有可分析的数据！")
+                return
+            
+            first_group = export_data.iloc[self.get_export_groups(export_data)[0]]
+            first_row = first_group.iloc[0]
+            original_index = first_group.index[0]
+            
+            self.log_output("=== 开始性能分析 ===")
+            self.log_output(f"使用第 {original_index + 1} 行数据进行分析")
+            
+            doc = self.load_template_document()
+            
+            # 只对映射应用过程进行分析，模板加载不计入
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                group_values = self.prepare_mapping_values(first_group).to_dict('records')
+                self.apply_mapping_to_document(doc, first_row, original_index, group_values[0], group_values)
+            finally:
+                profiler.disable()
+            
+            # 保存分析文件（可用snakeviz、flameprof等工具生成火焰图）
+            prof_path = os.path.join(tempfile.gettempdir(), "render_profile.prof")
+            profiler.dump_stats(prof_path)
+            self.log_output(f"性能分析文件已保存到: {prof_path}")
+            
+            # 生成热点函数报告
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.strip_dirs()
+            stream.write(f"=== 渲染性能分析（第 {original_index + 1} 行）===\n")
+            stream.write(f"模板: {os.path.basename(self.word_template_path)}\n")
+            stream.write(f"总耗时: {stats.total_tt:.3f} 秒，函数调用: {stats.total_calls} 次\n")
+            stream.write(f"分析文件: {prof_path}\n\n")
+            stream.write("--- 按累计时间排序（前30个） ---\n")
+            stats.sort_stats("cumulative").print_stats(30)
+            stream.write("\n--- 按自身耗时排序（前30个） ---\n")
+            stats.sort_stats("tottime").print_stats(30)
+            report_text = stream.getvalue()
+            
+            self.log_output("=== 性能分析完成 ===")
+            
+            # 显示分析结果窗口
+            profile_window = tk.Toplevel(self.root)
+            profile_window.title("渲染性能分析")
+            profile_window.geometry("900x600")
+            profile_window.transient(self.root)
+            
+            text_frame = ttk.Frame(profile_window)
+            text_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+            
+            text_widget = tk.Text(text_frame, wrap=tk.NONE, font=("Courier", 9))
+            scrollbar = ttk.Scrollbar(text_frame, orient="vertical", command=text_widget.yview)
+            text_widget.configure(yscrollcommand=scrollbar.set)
+            
+            text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            
+            text_widget.insert(tk.END, report_text)
+            text_widget.config(state=tk.DISABLED)
+            
+            def save_profile():
+                save_path = filedialog.asksaveasfilename(
+                    title="保存性能分析文件",
+                    defaultextension=".prof",
+                    initialfile="render_profile.prof",
+                    filetypes=[("Profile files", "*.prof"), ("All files", "*.*")]
+                )
+                if save_path:
+                    try:
+                        profiler.dump_stats(save_path)
+                        messagebox.showinfo("成功", f"性能分析文件已保存到：{save_path}")
+                    except Exception as save_error:
+                        messagebox.showerror("错误", f"保存性能分析文件失败：{str(save_error)}")
+            
+            btn_frame = ttk.Frame(profile_window)
+            btn_frame.pack(pady=10)
+            
+            ttk.Button(btn_frame, text="另存分析文件", command=save_profile).pack(side=tk.LEFT, padx=5)
+            ttk.Button(btn_frame, text="关闭", command=profile_window.destroy).pack(side=tk.LEFT, padx=5)
+        
+        except Exception as e:
+            messagebox.showerror("错误", f"性能分析失败：{str(e)}")
+    
     def export_documents(self):
         """批量导出文档"""
+        archive = None
+        prefetch_executor = None
         try:
             if not self.word_template_path:
                 messagebox.showwarning("警告", "请先导入Word模板！")
@@ -3110,20 +5693,92 @@ class Excel2WordConverter:
                 messagebox.showwarning("警告", "没有可导出的数据！")
                 return
             
-            # 选择保存目录
-            output_dir = filedialog.askdirectory(title="选择保存目录")
-            if not output_dir:
-                return
+            # 合并需要先逐个保存文件，此时不使用压缩包输出
+            archive_enabled = self.output_target_var.get() == "压缩包" and not self.merge_docs_var.get()
+            
+            # 选择保存位置
+            if archive_enabled:
+                archive_path = filedialog.asksaveasfilename(
+                    title="保存ZIP压缩包",
+                    defaultextension=".zip",
+                    initialfile="导出文档.zip",
+                    filetypes=[("ZIP压缩包", "*.zip"), ("所有文件", "*.*")]
+                )
+                if not archive_path:
+                    return
+                output_dir = os.path.dirname(archive_path)
+            else:
+                output_dir = filedialog.askdirectory(title="选择保存目录")
+                if not output_dir:
+                    return
             
             self.log_output("=== 开始批量导出文档 ===")
-            self.log_output(f"输出目录: {output_dir}")
+            if archive_enabled:
+                self.log_output(f"输出压缩包: {archive_path}")
+            else:
+                if self.output_target_var.get() == "压缩包":
+                    self.log_output("合并导出时不使用压缩包输出，文档保存到目录")
+                self.log_output(f"输出目录: {output_dir}")
             self.log_output(f"Excel数据总行数: {len(self.excel_data)}")
             self.log_output(f"导出范围: {message}")
             
             success_count = 0
-            total_count = len(export_data)
             generated_files = []
-            used_filenames = set()  # 跟踪已使用的文件名
+            created_shards = set()
+            
+            # 内存控制设置
+            low_memory_mode = self.low_memory_mode_var.get()
+            memory_limit = self.get_memory_limit()
+            merge_enabled = self.merge_docs_var.get()
+            memory_exceeded = False
+            self.memory_stage_peaks = {}
+            self.console_max_entries = 200 if low_memory_mode else 1000
+            self.record_memory_stage("导出开始")
+            if low_memory_mode:
+                self.log_output("已启用低内存导出模式")
+            if memory_limit:
+                self.log_output(f"内存上限: {memory_limit:.0f}MB")
+            
+            # 合并导出时逐个生成的文档只是中间文件，可以只存储不压缩
+            compression_level = self.get_compression_level(intermediate=merge_enabled)
+            self.log_output(f"输出压缩级别: {compression_level}（0表示仅存储）")
+            
+            # 模板和渲染设置在导出过程中不变，渲染缓存使用的设置摘要只计算一次
+            settings_digest = self.get_render_settings_digest() if self.render_cache_var.get() else None
+            
+            # 按列预先计算所有行的替换值，渲染时只做替换
+            prepared_rows = self.prepare_mapping_values(export_data).to_dict('records')
+            
+            # 按分组字段划分文档（未设置分组时每行一个文档）
+            export_groups = self.get_export_groups(export_data)
+            total_count = len(export_groups)
+            if self.group_field_var.get():
+                self.log_output(f"按字段 {self.group_field_var.get()} 分组，{len(export_data)} 行数据生成 {total_count} 个文档")
+            
+            # 一次性生成所有文档的文件名（按每个文档的首行数据命名）
+            output_filenames = self.build_output_filenames(
+                export_data.iloc[[positions[0] for positions in export_groups]])["文件名"].tolist()
+            
+            image_mappings = [(mapping_index, img_mapping) for mapping_index, img_mapping
+                              in enumerate(self.image_mapping_data) if img_mapping.get("placeholder")]
+            
+            # 导出前检查图片，避免长时间导出中途才发现图片问题
+            if image_mappings and self.preflight_images_var.get():
+                if not self.preflight_check_images(export_data, export_groups, image_mappings):
+                    return
+            
+            # 图片预读：后台线程提前查找并读取后续文档的图片
+            prefetch_count = self.get_image_prefetch_count() if image_mappings else 0
+            if prefetch_count:
+                prefetch_executor = ThreadPoolExecutor(max_workers=min(4, prefetch_count))
+                self.log_output(f"图片预读: 提前 {prefetch_count} 个文档")
+            prefetch_futures = {}
+            next_prefetch = 0
+            
+            # 压缩包输出：文档生成后直接写入压缩包，最后附加行号与文件名的索引
+            archive_index = []
+            if archive_enabled:
+                archive = zipfile.ZipFile(archive_path, "w", zipfile.ZIP_STORED)
             
             # 进度对话框
             progress_window = tk.Toplevel(self.root)
@@ -3144,30 +5799,68 @@ class Excel2WordConverter:
                 progress_window.update()
             
             # 批量生成文档
-            for i, (index, row) in enumerate(export_data.iterrows()):
+            for i, positions in enumerate(export_groups):
+                index = export_data.index[positions[0]]
                 try:
                     update_progress(i + 1, total_count, success_count)
+                    row = export_data.iloc[positions[0]]
                     
                     # 显示原始行号（用户视角的行号）
                     original_row_num = index + 1
                     self.log_output(f"处理第 {i+1}/{total_count} 个文档（原始数据第 {original_row_num} 行）...")
                     
-                    # 生成文档
-                    doc = Document(self.word_template_path)
-                    self.apply_mapping_to_document(doc, row, index)
+                    if prefetch_executor is not None:
+                        # 内存接近上限时暂停提前预读，只读取当前文档的图片
+                        current_mb = self.get_memory_usage()[0] if memory_limit else None
+                        ahead = 0 if current_mb and current_mb > memory_limit * 0.8 else prefetch_count
+                        while next_prefetch < min(i + ahead + 1, total_count):
+                            first_position = export_groups[next_prefetch][0]
+                            prefetch_futures[next_prefetch] = prefetch_executor.submit(
+                                self.prefetch_row_images, image_mappings,
+                                export_data.iloc[first_position], export_data.index[first_position])
+                            next_prefetch += 1
+                        self.use_prefetched_images(prefetch_futures.pop(i).result())
+                    
+                    # 生成文档（启用渲染缓存时复用内容未变化的结果）
+                    content = self.render_document_content(row, index, prepared_rows[positions[0]],
+                                                           [prepared_rows[position] for position in positions],
+                                                           compression_level, settings_digest)
+                    self.use_prefetched_images({})
+                    
+                    filename = output_filenames[i]
+                    shard = filename.rpartition("/")[0]
                     
-                    # 生成文件名（使用原始行索引）
-                    filename = self.generate_filename(row, index, used_filenames)
-                    used_filenames.add(filename)
+                    if archive is not None:
+                        # docx本身已压缩，写入压缩包时只存储
+                        archive.writestr(zipfile.ZipInfo(filename, date_time=time.localtime()[:6]), content)
+                        for position in positions:
+                            archive_index.append({"原始行号": export_data.index[position] + 1, "文件名": filename})
+                    else:
+                        if shard and shard not in created_shards:
+                            os.makedirs(os.path.join(output_dir, shard), exist_ok=True)
+                            created_shards.add(shard)
+                        output_path = os.path.join(output_dir, filename)
+                        with open(output_path, "wb") as f:
+                            f.write(content)
+                    self.record_memory_stage("保存文档")
                     
-                    output_path = os.path.join(output_dir, filename)
-                    doc.save(output_path)
+                    # 低内存模式下保存后立即释放文档
+                    if low_memory_mode:
+                        content = None
                     
-                    generated_files.append(output_path)
+                    # 只有合并时才需要保留全部文件路径
+                    if archive is None and (merge_enabled or not low_memory_mode):
+                        generated_files.append(output_path)
                     success_count += 1
                     
                     self.log_output(f"第 {i+1} 个文档生成成功: {filename}")
                     
+                    # 检查内存上限
+                    if not self.enforce_memory_limit(memory_limit):
+                        memory_exceeded = True
+                        self.log_output(f"内存超过上限，导出在第 {i+1} 个文档后停止")
+                        break
+                    
                 except Exception as row_ex:
                     original_row_num = index + 1
                     self.log_output(f"第 {i+1} 个文档处理失败（原始数据第 {original_row_num} 行）: {str(row_ex)}")
@@ -3175,15 +5868,41 @@ class Excel2WordConverter:
             
             progress_window.destroy()
             
+            if prefetch_executor is not None:
+                prefetch_executor.shutdown(wait=True, cancel_futures=True)
+                prefetch_executor = None
+                self.use_prefetched_images({})
+            
+            if archive is not None:
+                index_csv = pd.DataFrame(archive_index, columns=["原始行号", "文件名"]).to_csv(index=False)
+                archive.writestr(zipfile.ZipInfo("索引.csv", date_time=time.localtime()[:6]),
+                                 index_csv.encode("utf-8-sig"))
+                archive.close()
+                archive = None
+                self.log_output(f"已写入压缩包索引: 索引.csv（{len(archive_index)} 行）")
+            
             self.log_output(f"批量导出完成！成功: {success_count}/{total_count}")
             
+            if memory_exceeded:
+                # 合并是内存占用最大的步骤，内存超限后不再合并，保留已生成的单个文档
+                merge_message = "未执行合并，已生成的文档保留在输出目录中。\n" if merge_enabled else ""
+                if merge_enabled:
+                    self.log_output("内存超过上限，跳过文档合并")
+                messagebox.showwarning("警告", 
+                    f"内存占用超过设置的上限（{memory_limit:.0f}MB），导出已提前停止！\n"
+                    f"已成功导出：{success_count}个文档\n"
+                    f"{merge_message}"
+                    f"请调高内存上限或缩小导出范围后继续导出剩余数据。")
+            
             # 合并文档（如果选择）
-            if self.merge_docs_var.get() and generated_files:
+            if merge_enabled and generated_files and not memory_exceeded:
                 try:
                     merged_path = os.path.join(output_dir, "合并文档.docx")
                     
                     # 使用新的完整合并方法
-                    merge_success = self.merge_documents_completely(generated_files, merged_path)
+                    merge_success = self.merge_documents_completely(generated_files, merged_path,
+                                                                    self.get_compression_level())
+                    self.record_memory_stage("合并文档")
                     
                     if merge_success:
                         # 删除临时文件
@@ -3194,6 +5913,8 @@ class Excel2WordConverter:
                             except Exception as delete_error:
                                 self.log_output(f"删除临时文件失败: {delete_error}")
                         
+                        memory_report = self.get_memory_report()
+                        self.log_output(memory_report)
                         messagebox.showinfo("完成", 
                             f"完整文档合并成功！\n"
                             f"成功合并：{success_count}个文档\n"
@@ -3204,7 +5925,8 @@ class Excel2WordConverter:
                             f"• 分节符和分页符\n"
                             f"• 页眉和页脚\n"
                             f"• 表格和图片\n"
-                            f"• 文档属性")
+                            f"• 文档属性\n\n"
+                            f"{memory_report}")
                     else:
                         # 如果完整合并失败，尝试使用基本合并方法
                         self.log_output("完整合并失败，尝试使用基本合并方法")
@@ -3226,7 +5948,9 @@ class Excel2WordConverter:
                             self.copy_tables_with_format(doc_to_append, merged_doc)
                         
                         # 保存合并文档
-                        merged_doc.save(merged_path)
+                        self.save_document_file(merged_doc, merged_path, self.get_compression_level())
+                        merged_doc = None
+                        self.record_memory_stage("合并文档")
                         
                         # 删除临时文件
                         for file_path in generated_files:
@@ -3235,20 +5959,31 @@ class Excel2WordConverter:
                             except:
                                 pass
                         
+                        memory_report = self.get_memory_report()
+                        self.log_output(memory_report)
                         messagebox.showinfo("完成", 
-                            f"基本文档合并完成！\n成功：{success_count}个文档已合并\n失败：{total_count - success_count}个文档\n合并文档保存至：{merged_path}")
+                            f"基本文档合并完成！\n成功：{success_count}个文档已合并\n失败：{total_count - success_count}个文档\n合并文档保存至：{merged_path}\n\n{memory_report}")
                     
                 except Exception as merge_ex:
                     self.log_output(f"文档合并失败: {str(merge_ex)}")
                     messagebox.showerror("错误", f"文档合并失败：{str(merge_ex)}")
             else:
-                messagebox.showinfo("完成", 
-                    f"批量导出完成！\n成功：{success_count}个文档\n失败：{total_count - success_count}个文档\n保存目录：{output_dir}")
+                memory_report = self.get_memory_report()
+                self.log_output(memory_report)
+                save_location = f"压缩包：{archive_path}" if archive_enabled else f"保存目录：{output_dir}"
+                if not memory_exceeded:
+                    messagebox.showinfo("完成", 
+                        f"批量导出完成！\n成功：{success_count}个文档\n失败：{total_count - success_count}个文档\n{save_location}\n\n{memory_report}")
             
             # 打开输出目录
             self.open_file(output_dir)
             
         except Exception as e:
+            if prefetch_executor is not None:
+                prefetch_executor.shutdown(wait=True, cancel_futures=True)
+                self.use_prefetched_images({})
+            if archive is not None:
+                archive.close()
             messagebox.showerror("错误", f"批量导出失败：{str(e)}")
     
     def open_file(self, file_path: str):
@@ -3455,6 +6190,8 @@ class Excel2WordConverter:
         elif naming_mode == "前缀":
             prefix = self.naming_prefix_var.get()
             settings_text += f"\n前缀设置: '{prefix}'"
+        elif naming_mode == "模板":
+            settings_text += f"\n文件名模板: '{self.naming_pattern_var.get()}'"
         
         settings_text += f"\n导出范围: {range_message}"
         
@@ -3489,18 +6226,17 @@ class Excel2WordConverter:
         # 生成预览数据
         def generate_preview():
             """生成预览数据"""
-            used_names = set()
             preview_count = min(20, len(export_data))  # 只预览前20个
             
+            # 与导出使用相同的文件名计算
+            preview_filenames = self.build_output_filenames(export_data.iloc[:preview_count])
+            
             for i in range(preview_count):
                 try:
                     row = export_data.iloc[i]
                     original_index = export_data.index[i]  # 获取原始行索引
                     original_row_num = original_index + 1  # 用户视角的行号
-                    
-                    # 生成文件名（使用原始索引）
-                    filename = self.generate_filename(row, original_index, used_names)
-                    used_names.add(filename)
+                    filename, status = preview_filenames.iloc[i]
                     
                     # 生成显示的数据内容（取前几个字段的值）
                     data_preview = []
@@ -3514,14 +6250,6 @@ class Excel2WordConverter:
                     if len(data_text) > 50:
                         data_text = data_text[:47] + "..."
                     
-                    # 检查状态
-                    status = "正常"
-                    if filename.startswith("导出文档_") and naming_mode != "默认":
-                        status = "回退"  # 表示使用了默认命名（可能是因为字段值为空等）
-                    elif "_" in filename and not filename.startswith("导出文档_") and naming_mode == "字段":
-                        if any(char.isdigit() for char in filename.split("_")[-1].split(".")[0]):
-                            status = "重复处理"  # 表示处理了重复文件名
-                    
                     tree.insert("", "end", values=(original_row_num, data_text, filename, status))
                     
                 except Exception as e:
@@ -3552,6 +6280,10 @@ class Excel2WordConverter:
             prefix = self.naming_prefix_var.get()
             clean_prefix = self.clean_filename(prefix) if prefix else "文档"
             stats_text += f"使用前缀: '{clean_prefix}'"
+        elif naming_mode == "模板":
+            missing = [segment[0] for segment in self.compile_filename_pattern(self.naming_pattern_var.get())
+                       if not isinstance(segment, str) and segment[0] not in export_data.columns]
+            stats_text += f"模板中不存在的字段: {', '.join(missing)}" if missing else "模板字段均有效"
         
         ttk.Label(stats_frame, text=stats_text).pack(anchor=tk.W)
         
@@ -3587,8 +6319,16 @@ class Excel2WordConverter:
 
 2. 导入Word模板：
    - 点击"导入Word模板"按钮选择Word模板
-   - 支持的占位符格式：
-     {{字段名}}（双花括号）
+   - 支持的占位符格式（在高级设置的"占位符格式"中启用，默认只启用双花括号）：
+     {{字段名}}（双花括号）、【字段名】、《字段名》、[字段名]、<字段名>
+   - 启用的格式编译为一个扫描器，识别和替换共用，启用多种格式不会增加每行的扫描次数
+   - 修改占位符格式后会重新识别模板中的占位符，已设置的映射会保留
+   - 条件区域：用{{#if 条件}}和{{/if}}包围可选内容，条件不成立时删除该内容
+     • 标记单独成段：删除两个标记之间的段落和表格
+     • 标记在同一表格行的不同单元格中：删除整行
+     • 标记在同一段落中：删除标记之间的文字
+     • 条件写法：金额>1000、金额+金额2>=0、类型=VIP、类型<>普通，单独的字段名表示字段非空且不为0
+     • 条件在导出前按列一次性计算，循环表格行内的条件按组内第一行计算
 
    - 系统会自动识别模板中的占位符，完全支持中文字段名
    - 支持全文档扫描，包括：
@@ -3607,6 +6347,10 @@ class Excel2WordConverter:
    - 左侧显示Excel字段，右侧显示Word占位符
    - 双击右侧可以编辑映射关系
    - 支持数学运算，如：字段1+字段2、字段1*2等
+     • 支持函数：round(值, 位数)、sum、min、max、abs、if(条件, 成立值, 不成立值)
+     • 支持比较：>、<、>=、<=、=、<>
+     • 字段名按完整名称匹配，一个字段名包含另一个字段名时也能正确计算
+     • 表达式只允许运算和上述函数，不会执行任意代码
    - 支持固定文本
    - 未映射的占位符默认填充"0"
 
@@ -3629,12 +6373,20 @@ class Excel2WordConverter:
    - 点击"预览"查看第一行数据的效果
    - 点击"按模板导出"批量生成所有数据
    - 生成的文档会保存到选择的目录
+   - 点击"性能分析"对第一行数据的渲染过程进行分析
+     • 显示耗时最多的函数，便于定位模板中的慢速路径
+     • 分析结果保存为.prof文件，可用snakeviz、flameprof等工具生成火焰图
 
 6. 自动匹配：
    - 点击"自动匹配字段"自动匹配相同或相似的字段名
    - 精准匹配：完全匹配字段名
    - 模糊匹配：使用相似度算法（阈值0.6）自动匹配相似字段
+     • 先按字片段筛选最相近的候选字段，只对候选计算相似度，字段很多时也能快速完成
+     • 按所有占位符的相似度总和最大进行一对一匹配，一个字段不会同时匹配给多个占位符
    - 可通过"使用精准匹配"复选框切换匹配模式
+   - 映射配置：点击"保存映射配置"保存文本映射、图片映射、数字格式、命名和分组设置
+     • 配置按模板内容和Excel字段保存，再次导入相同的模板和Excel时自动应用，无需重新匹配
+     • 可导出为单独的配置文件，在其他电脑或批量任务中导入，保证每次导出结果一致
 
 7. 导出行数范围：
    - 全部数据：导出Excel中的所有行数据
@@ -3643,10 +6395,36 @@ class Excel2WordConverter:
      • 行号从1开始计算，对应Excel中的数据行
      • 系统会自动验证范围的有效性
      • 预览和导出功能都会应用此设置
+   - 分组导出：选择分组字段后，字段值相同的行生成一个文档
+     • 表格行中写入{{#循环}}标记，该行会按组内每行数据重复一次（如订单明细）
+     • {{#序号}}填充组内序号（从1开始），循环行以外的占位符使用组内第一行的值
+     • 未设置分组字段时每行生成一个文档，循环行只填充当前行
+     • 映射中可使用分组汇总：求和: 字段、计数: 字段、最小值: 字段、最大值: 字段、平均值: 字段
+     • 汇总值对全部导出数据按分组一次性计算，未设置分组时为当前行自身的值
 
 8. 其他选项：
    - 在文件中预览：直接打开预览文档
    - 合并导出文档：将生成的多个文档合并为一个文档
+   - 低内存导出模式：每个文档保存后立即释放，并缩减输出日志缓存
+   - 内存上限：内存占用超过上限时先释放缓存，仍超过则提前停止导出（合并导出时不再合并，保留已生成的文档）
+   - 导出完成后会显示峰值内存及各阶段（加载模板、应用映射、保存文档、合并文档）的内存占用
+   - 导出时模板文件只读取一次并保存在内存中，每个文档直接从内存创建；同一图片只读取一次
+   - 保存文档时样式、编号、主题、字体等未修改的部件直接复制模板中的压缩数据，只重新写出修改过的部分
+   - 输出压缩：可选择标准、速度优先、体积优先或仅存储；合并导出时中间文档默认仅存储，合并后的文档使用所选级别
+   - 输出方式可选择打包为一个ZIP压缩包，文档生成后直接写入压缩包，并附带“索引.csv”记录原始行号与文件名（合并导出时不适用）
+   - 子目录分片：可按字段值、按行号分段（每段行数可设置）或按哈希前缀把文档分到子目录，重名检查在子目录内进行
+   - 文件名在导出开始时一次性计算，重名按不区分大小写处理（与Windows一致），依次添加_1、_2等序号
+   - 图片预读：导出时后台线程提前查找并读取后续若干个文档的图片，渲染时直接使用；内存接近上限时暂停预读
+   - 图片文件夹只扫描一次并建立索引（文件夹内容变化后自动更新）；图片尺寸等信息每个文件只读取一次
+   - 带EXIF旋转标记的照片（如手机竖拍照片）通过图片的旋转属性摆正后插入，不重新编码图片（可在“图片处理”中关闭）
+   - 图片映射可启用多图模式，插入“名称”“名称_1”“名称_2”等全部匹配图片，按设置的每行图片数排成表格
+   - 图片映射可勾选“搜索子文件夹”，索引保存在图片文件夹的.e2w_image_index.json中（不可写时保存到临时目录），
+     再次导出时只重新扫描有变化的子文件夹
+   - 导出前检查图片：并行检查每个文档用到的图片是否存在、能否解码、格式是否支持，并提示CMYK、超大图片等问题，
+     发现问题时显示检查报告并询问是否继续导出
+   - 渲染缓存：模板、映射设置、行数据和图片都未变化时，预览和导出直接复用上次生成的文档
+     • 缓存按最近使用淘汰，内存中最多保留100MB，低内存模式下只使用磁盘缓存
+     • 可同时缓存到磁盘，程序重启后仍然有效；点击"清空缓存"可删除全部缓存
 
 9. 数字格式化：
    - 数字格式化：选择数字的显示格式
@@ -3656,6 +6434,11 @@ class Excel2WordConverter:
    - 自定义小数位数：可自定义保留的小数位数（启用后覆盖上述设置）
    - 千分位分隔符：为大数字添加千分位分隔符（如：1234.56 → 1,234.56）
    - 注意：只有识别为数字的内容才会被格式化，文本内容不受影响
+   - 字段数字格式：在编辑映射中可为单个占位符设置Excel风格的格式，优先于上述全局设置
+     • 数字：0、0.00、#,##0.00、0%、0.00万、0.00亿、¥#,##0.00 等
+     • 日期：yyyy-mm-dd、yyyy年m月d日、yyyy-mm-dd hh:mm:ss 等
+     • 单元格格式：直接使用Excel单元格自身的数字格式（仅xlsx文件）
+     • 格式在导出前编译一次，整列批量套用
 
 10. 文件命名设置：
    - 默认命名：使用"导出文档_001.docx"的格式（按行号排序）
@@ -3667,6 +6450,9 @@ class Excel2WordConverter:
    - 固定前缀命名：所有文件使用相同前缀+"_序号"的格式
      • 如：设置前缀为"报告"，生成"报告_001.docx, 报告_002.docx..."
      • 前缀也会进行不合法字符清理
+   - 文件名模板：用{字段名}组合多个字段，如"{地区}_{编号}_{日期:%Y%m}.docx"
+     • 日期字段可用%Y、%m、%d等格式，数字字段可用05d、.2f等格式
+     • 模板中的字段全部为空时回退到默认命名
    - 智能回退：任何命名方式出错时都会自动回退到默认命名，确保导出不会失败"""
         
         # 创建帮助窗口
@@ -0,0 +1,22 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from excel2word_template_version_1 import Excel2WordConverter
+
+
+@pytest.fixture
+def converter():
+    """不创建界面的转换器实例，只初始化纯计算辅助方法用到的属性"""
+    instance = Excel2WordConverter.__new__(Excel2WordConverter)
+    instance.console_output = []
+    instance.console_max_entries = 1000
+    instance.expression_cache = {}
+    instance.number_format_cache = {}
+    instance.image_folder_index = {}
+    instance.image_index_lock = threading.Lock()
+    return instance
@@ -0,0 +1,32 @@
+import itertools
+
+import numpy as np
+
+
+def assignment_cost(cost, pairs):
+    return sum(cost[row, column] for row, column in pairs)
+
+
+def test_small_matrix(converter):
+    cost = np.array([[4, 1, 3], [2, 0, 5], [3, 2, 2]], dtype=float)
+    pairs = converter.solve_assignment(cost)
+    assert sorted((int(row), int(column)) for row, column in pairs) == [(0, 1), (1, 0), (2, 2)]
+
+
+def test_matches_brute_force(converter):
+    rng = np.random.default_rng(0)
+    for size in range(1, 7):
+        for _ in range(20):
+            cost = rng.random((size, size))
+            pairs = converter.solve_assignment(cost)
+            assert sorted(row for row, _ in pairs) == list(range(size))
+            assert sorted(column for _, column in pairs) == list(range(size))
+            best = min(sum(cost[row, column] for row, column in enumerate(permutation))
+                       for permutation in itertools.permutations(range(size)))
+            assert np.isclose(assignment_cost(cost, pairs), best)
+
+
+def test_ties_still_produce_one_to_one_assignment(converter):
+    cost = np.zeros((4, 4))
+    pairs = converter.solve_assignment(cost)
+    assert sorted(column for _, column in pairs) == [0, 1, 2, 3]
@@ -0,0 +1,71 @@
+import pandas as pd
+from docx import Document
+
+
+def evaluate(converter, condition, data):
+    return list(converter.evaluate_condition(condition, data))
+
+
+def render(converter, doc, row):
+    converter.apply_conditional_blocks(doc, {}, pd.Series(row))
+    return [paragraph.text for paragraph in doc.paragraphs]
+
+
+def test_text_conditions_skip_the_expression_engine(converter):
+    data = pd.DataFrame({"类型": ["甲", "乙"], "金额": [5, 20]})
+    assert evaluate(converter, "类型=甲", data) == [True, False]
+    assert evaluate(converter, '类型!="乙"', data) == [True, False]
+    assert evaluate(converter, "类型＝甲", data) == [True, False]
+    assert not any("数学表达式无法编译" in line for line in converter.console_output)
+
+
+def test_numeric_conditions_use_the_expression_engine(converter):
+    data = pd.DataFrame({"类型": ["甲", "乙"], "金额": [5, 20], "上限": [10, 10]})
+    assert evaluate(converter, "金额>10", data) == [False, True]
+    assert evaluate(converter, "金额=20", data) == [False, True]
+    assert evaluate(converter, "金额<上限", data) == [True, False]
+    assert evaluate(converter, "类型", data) == [True, True]
+
+
+def test_inline_block(converter):
+    doc = Document()
+    doc.add_paragraph("您好{{#if 类型=甲}}，贵宾{{/if}}！")
+    assert render(converter, doc, {"类型": "甲"}) == ["您好，贵宾！"]
+
+    doc = Document()
+    doc.add_paragraph("您好{{#if 类型=甲}}，贵宾{{/if}}！")
+    assert render(converter, doc, {"类型": "乙"}) == ["您好！"]
+
+
+def test_block_across_paragraphs(converter):
+    def build():
+        doc = Document()
+        for text in ["开头", "{{#if 金额>10}}", "大额说明", "{{/if}}", "结尾"]:
+            doc.add_paragraph(text)
+        return doc
+
+    assert render(converter, build(), {"金额": 20}) == ["开头", "大额说明", "结尾"]
+    assert render(converter, build(), {"金额": 5}) == ["开头", "结尾"]
+
+
+def test_block_inside_table_row_removes_the_row(converter):
+    doc = Document()
+    table = doc.add_table(rows=2, cols=2)
+    table.cell(0, 0).text = "{{#if 类型=甲}}甲项"
+    table.cell(0, 1).text = "说明{{/if}}"
+    table.cell(1, 0).text = "其他"
+    converter.apply_conditional_blocks(doc, {}, pd.Series({"类型": "乙"}))
+    assert len(table.rows) == 1
+    assert table.cell(0, 0).text == "其他"
+
+
+def test_nested_blocks(converter):
+    def build():
+        doc = Document()
+        for text in ["{{#if 类型=甲}}", "甲类{{#if 金额>10}}（大额）{{/if}}", "{{/if}}", "结尾"]:
+            doc.add_paragraph(text)
+        return doc
+
+    assert render(converter, build(), {"类型": "甲", "金额": 20}) == ["甲类（大额）", "结尾"]
+    assert render(converter, build(), {"类型": "甲", "金额": 5}) == ["甲类", "结尾"]
+    assert render(converter, build(), {"类型": "乙", "金额": 20}) == ["结尾"]
@@ -0,0 +1,93 @@
+import io
+import zipfile
+
+import pytest
+from docx import Document
+from docx.shared import Cm
+from PIL import Image
+
+
+@pytest.fixture
+def template_path(tmp_path):
+    """带页眉和一张图片的模板"""
+    image_path = tmp_path / "logo.png"
+    Image.new("RGB", (20, 10), "red").save(image_path)
+    doc = Document()
+    doc.add_paragraph("姓名：{{姓名}}")
+    doc.add_picture(str(image_path), width=Cm(2))
+    doc.sections[0].header.paragraphs[0].text = "页眉"
+    path = tmp_path / "template.docx"
+    doc.save(path)
+    return path
+
+
+@pytest.fixture
+def photo_path(tmp_path):
+    path = tmp_path / "photo.jpg"
+    Image.new("RGB", (30, 40), "blue").save(path)
+    return str(path)
+
+
+def write_package(converter, template_path, edit=None, compression_level=6):
+    converter.word_template_path = str(template_path)
+    converter.template_bytes_cache = None
+    converter.template_zip_entries = None
+    doc = converter.load_template_document()
+    if edit is not None:
+        edit(doc)
+    content = converter.write_docx_package(doc, compression_level)
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        assert archive.testzip() is None
+        names = archive.namelist()
+        assert len(names) == len(set(names))
+    return content, Document(io.BytesIO(content))
+
+
+def test_unchanged_template_copies_members(converter, template_path):
+    content, doc = write_package(converter, template_path)
+    assert doc.paragraphs[0].text == "姓名：{{姓名}}"
+    assert len(doc.inline_shapes) == 1
+
+    with zipfile.ZipFile(template_path) as template, zipfile.ZipFile(io.BytesIO(content)) as output:
+        assert set(output.namelist()) == set(template.namelist())
+        for name in ("word/styles.xml", "word/media/image1.png", "[Content_Types].xml"):
+            assert output.read(name) == template.read(name)
+            assert output.getinfo(name).compress_size == template.getinfo(name).compress_size
+
+
+@pytest.mark.parametrize("compression_level", [0, 1, 9])
+def test_body_edits(converter, template_path, compression_level):
+    def edit(doc):
+        converter.replace_text_preserve_style(doc.paragraphs[0], "{{姓名}}", "张三")
+
+    content, doc = write_package(converter, template_path, edit, compression_level)
+    assert doc.paragraphs[0].text == "姓名：张三"
+    assert doc.sections[0].header.paragraphs[0].text == "页眉"
+    with zipfile.ZipFile(io.BytesIO(content)) as output:
+        expected = zipfile.ZIP_DEFLATED if compression_level else zipfile.ZIP_STORED
+        assert output.getinfo("word/document.xml").compress_type == expected
+
+
+def test_new_image_in_body(converter, template_path, photo_path):
+    def edit(doc):
+        doc.add_paragraph().add_run().add_picture(photo_path, width=Cm(3))
+
+    content, doc = write_package(converter, template_path, edit)
+    assert len(doc.inline_shapes) == 2
+    with zipfile.ZipFile(io.BytesIO(content)) as output:
+        assert b'Extension="jpg"' in output.read("[Content_Types].xml")
+        with open(photo_path, "rb") as f:
+            assert f.read() in [output.read(name) for name in output.namelist() if name.startswith("word/media/")]
+
+
+def test_new_image_in_header(converter, template_path, photo_path):
+    def edit(doc):
+        doc.sections[0].header.paragraphs[0].add_run().add_picture(photo_path, width=Cm(1))
+
+    content, doc = write_package(converter, template_path, edit)
+    header_part = doc.sections[0].header.part
+    image_rels = [rel for rel in header_part.rels.values() if rel.reltype.endswith("/image")]
+    assert len(image_rels) == 1
+    with open(photo_path, "rb") as f:
+        assert image_rels[0].target_part.blob == f.read()
+    assert len(doc.inline_shapes) == 1
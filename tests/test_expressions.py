@@ -0,0 +1,51 @@
+import pandas as pd
+
+
+def evaluate(converter, expression, data):
+    return list(converter.evaluate_math_expression(expression, data, str))
+
+
+def test_arithmetic_is_evaluated_per_row(converter):
+    data = pd.DataFrame({"单价": [2, 3.5], "数量": [3, 2]})
+    assert evaluate(converter, "单价*数量", data) == ["6.0", "7.0"]
+    assert evaluate(converter, "round(单价/3, 2)", data) == ["0.67", "1.17"]
+
+
+def test_longer_field_name_is_bound_first(converter):
+    data = pd.DataFrame({"单价": [2], "单价折扣": [1]})
+    assert evaluate(converter, "单价折扣+单价", data) == ["3.0"]
+
+
+def test_full_width_symbols_and_if(converter):
+    data = pd.DataFrame({"单价": [2, 3.5], "数量": [3, 1]})
+    assert evaluate(converter, "（单价＋1）×2", data) == ["6.0", "9.0"]
+    assert evaluate(converter, "if(数量>2, 1, 0)", data) == ["1.0", "0.0"]
+    assert evaluate(converter, "数量>2", data) == ["True", "False"]
+
+
+def test_empty_values_count_as_zero(converter):
+    data = pd.DataFrame({"单价": [None], "数量": [4]})
+    assert evaluate(converter, "单价*数量", data) == ["0.0"]
+
+
+def test_non_numeric_row_falls_back_to_substituted_text(converter):
+    data = pd.DataFrame({"单价": [2, "abc"], "数量": [3, 1]})
+    assert evaluate(converter, "单价*数量", data) == ["6.0", "abc*1"]
+
+
+def test_division_by_zero_falls_back_to_text(converter):
+    data = pd.DataFrame({"数量": [1]})
+    assert evaluate(converter, "1/0", data) == ["1/0"]
+
+
+def test_disallowed_syntax_is_not_executed(converter):
+    data = pd.DataFrame({"数量": [1]})
+    compiled = converter.compile_math_expression("__import__('os')", data.columns)
+    assert compiled["tree"] is None
+    assert evaluate(converter, "__import__('os')", data) == ["__import__('os')"]
+
+
+def test_compiled_expressions_are_cached(converter):
+    columns = pd.Index(["单价", "数量"])
+    first = converter.compile_math_expression("单价*数量", columns)
+    assert converter.compile_math_expression("单价*数量", columns) is first
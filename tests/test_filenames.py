@@ -0,0 +1,29 @@
+def new_registry():
+    return {"names": set(), "counters": {}}
+
+
+def test_duplicates_get_increasing_counters(converter):
+    registry = new_registry()
+    names = [converter.reserve_filename(registry, "张三") for _ in range(4)]
+    assert names == ["张三.docx", "张三_1.docx", "张三_2.docx", "张三_3.docx"]
+
+
+def test_names_compare_case_insensitively(converter):
+    registry = new_registry()
+    assert converter.reserve_filename(registry, "A") == "A.docx"
+    assert converter.reserve_filename(registry, "a") == "a_1.docx"
+    assert converter.reserve_filename(registry, "A") == "A_2.docx"
+
+
+def test_counter_skips_names_already_taken(converter):
+    registry = new_registry()
+    converter.reserve_filename(registry, "A")
+    assert converter.reserve_filename(registry, "A_1") == "A_1.docx"
+    assert converter.reserve_filename(registry, "A") == "A_2.docx"
+    assert converter.reserve_filename(registry, "A_1") == "A_1_1.docx"
+
+
+def test_registries_are_independent(converter):
+    first, second = new_registry(), new_registry()
+    assert converter.reserve_filename(first, "A") == "A.docx"
+    assert converter.reserve_filename(second, "A") == "A.docx"
@@ -0,0 +1,56 @@
+import os
+
+from excel2word_template_version_1 import GALLERY_NAME_PATTERN
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"")
+
+
+def test_scan_image_tree_only_rescans_changed_folders(converter, tmp_path):
+    touch(tmp_path / "a.jpg")
+    touch(tmp_path / "sub" / "b.png")
+    touch(tmp_path / "sub" / "deep" / "c.gif")
+    touch(tmp_path / "sub" / "notes.txt")
+
+    dirs, scanned = converter.scan_image_tree(str(tmp_path), {})
+    assert scanned == 3
+    assert dirs[""]["files"] == ["a.jpg"]
+    assert dirs["sub"]["files"] == ["b.png"]
+    assert dirs[os.path.join("sub", "deep")]["files"] == ["c.gif"]
+
+    dirs, scanned = converter.scan_image_tree(str(tmp_path), dirs)
+    assert scanned == 0
+
+    touch(tmp_path / "sub" / "d.png")
+    dirs, scanned = converter.scan_image_tree(str(tmp_path), dirs)
+    assert scanned == 1
+    assert sorted(dirs["sub"]["files"]) == ["b.png", "d.png"]
+
+
+def test_scan_image_tree_drops_removed_folders(converter, tmp_path):
+    touch(tmp_path / "sub" / "b.png")
+    dirs, _ = converter.scan_image_tree(str(tmp_path), {})
+
+    os.remove(tmp_path / "sub" / "b.png")
+    os.rmdir(tmp_path / "sub")
+    dirs, scanned = converter.scan_image_tree(str(tmp_path), dirs)
+    assert scanned == 1
+    assert set(dirs) == {""}
+
+
+def test_gallery_name_pattern_splits_trailing_number():
+    assert GALLERY_NAME_PATTERN.match("A001_2").groups() == ("A001", "2")
+    assert GALLERY_NAME_PATTERN.match("张_三_10").groups() == ("张_三", "10")
+    assert GALLERY_NAME_PATTERN.match("A001") is None
+    assert GALLERY_NAME_PATTERN.match("A001_x") is None
+
+
+def test_gallery_images_are_ordered_numerically(converter, tmp_path):
+    for name in ["G_10.png", "g_2.png", "G.png", "G_1.jpg", "G_x.png", "GX_1.png"]:
+        touch(tmp_path / name)
+
+    images = converter.find_gallery_images(str(tmp_path), "G")
+    assert [os.path.basename(path) for path in images] == ["G.png", "G_1.jpg", "g_2.png", "G_10.png"]
@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize("spec, value, expected", [
+    ("#,##0.00", 1234.5, "1,234.50"),
+    ("0.00", 2.675, "2.68"),
+    ("000", 7, "007"),
+    ("#.##", 0.5, ".5"),
+    ("0.0%", 0.125, "12.5%"),
+    ("0.00,", 12345, "12.35"),
+    ("0.0万", 123456, "12.3万"),
+    ('"¥"#,##0', -1234.5, "-¥1,235"),
+    ("[$¥-804]#,##0.0", 5, "¥5.0"),
+])
+def test_number_formats(converter, spec, value, expected):
+    compiled = converter.compile_number_format(spec)
+    assert compiled["kind"] == "number"
+    assert compiled["func"](value) == expected
+
+
+def test_date_format(converter):
+    compiled = converter.compile_number_format("yyyy-mm-dd")
+    assert compiled["kind"] == "date"
+    assert compiled["func"](pd.Timestamp("2024-03-05")) == "2024-03-05"
+
+
+def test_general_and_text_formats(converter):
+    assert converter.compile_number_format("General") is None
+    assert converter.compile_number_format("") is None
+    assert converter.compile_number_format("@")["kind"] == "text"
+
+
+def test_compiled_formats_are_cached(converter):
+    assert converter.compile_number_format("0.00") is converter.compile_number_format("0.00")